@@ -0,0 +1,100 @@
+"""asyncio + websockets transport. Serves only the game socket,
+static files are expected to be served separately."""
+import asyncio
+import json
+from http import HTTPStatus
+from typing import Callable
+
+import websockets
+
+import rooms
+from rooms import logger
+from transport import Timer, Transport
+
+
+class AsyncioTransport(Transport):
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+
+    def spawn(self, func: Callable, *args) -> None:
+        # may be called from a broker thread, see fanout.py
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def call_later(self, delay: float, func: Callable, *args) -> Timer:
+        return self.loop.call_later(delay, func, *args)
+
+    def time(self) -> float:
+        return self.loop.time()
+
+    def run_in_thread(self, func: Callable, *args) -> None:
+        self.loop.run_in_executor(None, func, *args)
+
+
+class AsyncioConnection(object):
+    """Connection for rooms: sends are queued and written
+    in order by write_loop."""
+
+    def __init__(self, websocket) -> None:
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.closed = False
+
+    def send(self, data: str) -> None:
+        if self.closed:
+            raise ConnectionError(f'{self} is closed')
+        self.queue.put_nowait(data)
+
+    async def write_loop(self) -> None:
+        try:
+            while True:
+                data = await self.queue.get()
+                await self.websocket.send(data)
+        except websockets.ConnectionClosed:
+            self.closed = True
+
+
+async def socket(websocket, path=None) -> None:
+    ws = AsyncioConnection(websocket)
+    writer = asyncio.ensure_future(ws.write_loop())
+    rooms.connect(ws)
+    try:
+        async for message in websocket:
+            rooms.handle_message(ws, message)
+    except websockets.ConnectionClosed as error:
+        logger.info('%s connection error: %s', ws, error)
+    finally:
+        ws.closed = True
+        writer.cancel()
+        rooms.disconnect(ws)
+
+
+def process_request(connection_or_path, request_or_headers):
+    """Answers GET /stats with rooms.memory_stats() instead of a handshake.
+    Accepts both the legacy (path, headers) and the new
+    (connection, request) signatures of websockets."""
+    if isinstance(connection_or_path, str):
+        path = connection_or_path
+    else:
+        path = request_or_headers.path
+    if path != '/stats':
+        return None
+    body = json.dumps(rooms.memory_stats())
+    if isinstance(connection_or_path, str):
+        headers = [('Content-Type', 'application/json')]
+        return HTTPStatus.OK, headers, body.encode()
+    response = connection_or_path.respond(HTTPStatus.OK, body)
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+
+async def run(port: int) -> None:
+    rooms.main_lobby.transport = AsyncioTransport(asyncio.get_running_loop())
+    if rooms.main_lobby.snapshots is not None:
+        logger.info('Restored %s rooms', rooms.restore_rooms())
+    async with websockets.serve(socket, '', port,
+                                process_request=process_request):
+        await asyncio.Future()
+
+
+def serve(port: int) -> None:
+    asyncio.run(run(port))
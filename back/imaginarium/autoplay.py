@@ -0,0 +1,106 @@
+"""Scripted players.
+
+play_until_phase drives a Game directly: the storyteller plays the first
+card of the hand, listeners bet their first card (or a random one) and
+guess the first card of the table (or a random one). AutoPlayer plays
+the same way through the client protocol, guessing the first card of
+the table which is not its own. Used by the tests, the game runner
+(gamerunner.py) and the load harness (benchmarks.py load).
+"""
+from random import choice
+from typing import List, Optional
+
+from mechanics import Game
+
+
+def play_until_phase(game: Game, phase: Game.GamePhase,
+                     bets: Optional[List[int]] = None,
+                     guesses: Optional[List[int]] = None,
+                     stop: bool = False,
+                     enable_random: bool = False) -> None:
+    if phase == game.get_state() and stop:
+        return
+    if game.get_state() == Game.GamePhase.WAITING:
+        for player in game.players:
+            game.make_current_game_state(player)
+        game.start_game()
+    elif game.get_state() == Game.GamePhase.STORYTELLING:
+        winner = game.finished()
+        if winner is not None:
+            game.end_game(winner)
+            for player in game.players:
+                game.make_current_game_state(player)
+            return
+        cur_player = game.get_cur_player()
+        game.add_lead_card(game.hands[cur_player][0].id)
+        for player in game.players:
+            game.make_current_game_state(player)
+        game.start_turn("association")
+    elif game.get_state() == Game.GamePhase.MATCHING:
+        if bets is None:
+            bets = [game.hands[player][0] for player in game.players]
+        if enable_random:
+            bets = [choice(game.hands[player]) for player in game.players]
+        for player, bet in zip(game.players, bets):
+            game.make_bet(player, bet.id)
+            game.finish_turn(player)
+        for player in game.players:
+            game.make_current_game_state(player)
+        game.place_cards()
+    elif game.get_state() == Game.GamePhase.GUESSING:
+        if guesses is None:
+            guesses = [list(game.current_table.keys())[0]] * len(game.players)
+        if enable_random:
+            guesses = [choice(list(game.current_table.keys()))
+                       for player in game.players]
+        for player, guess in zip(game.players, guesses):
+            game.make_guess(player, guess.id)
+            game.finish_turn(player)
+        for player in game.players:
+            game.make_current_game_state(player)
+        game.valuate_guesses()
+    elif game.get_state() == Game.GamePhase.INTERLUDE:
+        for player in game.players:
+            game.make_current_game_state(player)
+        game.end_turn()
+    play_until_phase(
+        game,
+        phase,
+        bets=bets,
+        guesses=guesses,
+        stop=True,
+        enable_random=enable_random
+    )
+
+
+class AutoPlayer(object):
+    def __init__(self, story: str = "story") -> None:
+        self.story = story
+        # phase the player has already moved in, moves are made once
+        self.moved: Optional[str] = None
+        # card put on the table in the current round
+        self.bet: Optional[str] = None
+
+    def moves(self, update: dict) -> List[list]:
+        """Messages to send in reply to the RoomUpdate payload."""
+        phase = update["Phase"]
+        if phase != self.moved:
+            self.moved = None
+        client = update["Client"]
+        if self.moved is not None or not client["MoveAvailable"]:
+            return []
+        hand = [card["ID"] for card in update["Hand"]["Cards"]]
+        storyteller = client["Role"] == "Storyteller"
+        if phase == "Storytelling" and storyteller and hand:
+            self.moved = phase
+            return [["SelectCard", hand[0]], ["TellStory", self.story]]
+        if phase == "Matching" and not storyteller and hand:
+            self.moved = phase
+            self.bet = hand[0]
+            return [["SelectCard", self.bet], ["EndTurn"]]
+        if phase == "Guessing" and not storyteller:
+            for card in update["Table"]["Cards"]:
+                if card["ID"] != self.bet:
+                    self.moved = phase
+                    return [["SelectCard", card["ID"]], ["EndTurn"]]
+        return []
@@ -0,0 +1,885 @@
+"""Performance benchmarks for the imaginarium backend.
+
+python benchmarks.py latency [--idle 500] [--rounds 200]
+                            [--transport gevent|asyncio] [--url ws://...]
+
+latency starts server.py (unless --url is given), opens idle lobby
+connections and measures the round trip of UpdateInfo -> RoomUpdate
+for one active client. Run it with both transports, or against an older
+checkout with --url, to compare servers.
+
+python benchmarks.py load [--clients 300] [--duration 60]
+                          [--transport gevent|asyncio] [--url ws://...]
+
+load starts server.py (unless --url is given) and plays full games with
+--clients protocol clients, three to a room, driven by autoplay.py. It
+reports actions/s, received messages/s, action -> RoomUpdate latency
+percentiles (TellStory, EndTurn, UpdateInfo) and the server RSS.
+
+python benchmarks.py deadlines [--rooms 10000] [--rearms 10]
+
+deadlines measures the timing wheel holding one move deadline per room:
+arming, re-arming on every phase change and firing them all.
+
+python benchmarks.py deck [--images 10000] [--players 6] [--games 100]
+
+deck measures Game.start_game and dealing on a synthetic pack, next to
+the former eager deck (a Card per picture, shuffled, sliced per deal).
+
+python benchmarks.py quickjoin [--clients 100000] [--scans 100]
+
+quickjoin connects lobby clients in process and sends QuickJoin from all
+of them at once, next to a scan of all rooms for the fullest waiting one.
+
+python benchmarks.py messages [--rooms 100] [--frames 20000]
+                              [--log-level DEBUG|INFO|WARNING]
+
+messages measures in process handle_message throughput of UpdateInfo
+frames in full rooms, with logs.setup writing to a temporary file.
+
+python benchmarks.py mechanics [--players 3 6 12 25 50]
+                               [--images 100 1000 10000] [--only NAME]
+                               [--save results.json]
+python benchmarks.py compare BASE.json NEW.json [--threshold 1.2]
+
+mechanics times the Game hot paths on synthetic packs for every room and
+pack size: make_current_game_state, encoding RoomUpdate (json.dumps) for
+all players, valuate_guesses, end_turn, _deal_hand and all_turns_ended.
+Each case is calibrated to run for at least 0.05 s and the best of 5
+repeats is kept as seconds per call. --save stores the results with the
+commit and Python version; compare prints the ratios of two stored runs
+and exits with 1 if some case got slower than --threshold times.
+Packs never come from the front-end directory.
+
+python benchmarks.py packs [--files 5000] [--size 20000] [--packs 4]
+
+packs builds a temporary picture library, a tenth of it duplicated
+across packs, and times packs.update_store: the first run hashing and
+linking everything, a run without changes, and a run after one file was
+added, next to the former startup copying every picture.
+
+python benchmarks.py static [--rooms 1000] [--players 4] [--pictures 2000]
+                            [--size 30000] [--cache-mb 64]
+
+static reveals a 6-card table to every player of every room, each card
+a GET of a stored picture made in process on the WSGI application of
+static.py, and reports requests/s of reading the file for every request
+as flask does, of static.py with a cold and a warm cache and of
+conditional requests of browsers which have the pictures.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+from contextlib import contextmanager
+from random import Random, shuffle
+from statistics import mean, quantiles
+from time import perf_counter, sleep
+from typing import Callable, Dict, Iterator, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER_URL = "ws://localhost:5000/socket"
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Mean and p50/p95/p99 of samples in milliseconds."""
+    cuts = quantiles(samples, n=100, method="inclusive")
+    return {
+        "mean": mean(samples) * 1000,
+        "p50": cuts[49] * 1000,
+        "p95": cuts[94] * 1000,
+        "p99": cuts[98] * 1000,
+    }
+
+
+def print_report(name: str, stats: Dict[str, float]) -> None:
+    values = ", ".join(f"{key}={value:.3f}" for key, value in stats.items())
+    print(f"{name}: {values}")
+
+
+def wait_for_port(host: str, port: int, timeout: float = 30) -> None:
+    start = perf_counter()
+    while perf_counter() - start < timeout:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            sleep(0.1)
+    raise TimeoutError(f"Server at {host}:{port} did not start")
+
+
+def rss_mb(pid: int) -> float:
+    """Resident memory of the process (Linux)."""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+@contextmanager
+def local_server(*args: str) -> Iterator[subprocess.Popen]:
+    """Runs server.py in a subprocess for the duration of the block."""
+    process = subprocess.Popen(
+        [sys.executable, "server.py", *args],
+        cwd=HERE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port("localhost", 5000)
+        yield process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def receive_kind(ws, kind: str):
+    """Skips messages until one of the given kind arrives."""
+    while True:
+        message = json.loads(await ws.recv())
+        if isinstance(message, list) and message[0] == kind:
+            return message
+
+
+async def measure_latency(url: str, idle: int, rounds: int) -> List[float]:
+    import websockets
+
+    idle_connections = [await websockets.connect(url) for _ in range(idle)]
+    try:
+        async with websockets.connect(url) as ws:
+            await ws.send(json.dumps(["JoinRoom", ""]))
+            # joining sends the room to the player and then broadcasts it
+            for _ in range(2):
+                await receive_kind(ws, "RoomUpdate")
+            samples = []
+            for i in range(rounds):
+                start = perf_counter()
+                await ws.send(json.dumps(["UpdateInfo", {"Name": str(i)}]))
+                await receive_kind(ws, "RoomUpdate")
+                samples.append(perf_counter() - start)
+            return samples
+    finally:
+        for ws in idle_connections:
+            await ws.close()
+
+
+def bench_latency(args: argparse.Namespace) -> None:
+    if args.url:
+        samples = asyncio.run(measure_latency(args.url, args.idle, args.rounds))
+    else:
+        with local_server("--transport", args.transport):
+            samples = asyncio.run(
+                measure_latency(SERVER_URL, args.idle, args.rounds)
+            )
+    print_report(f"latency {args.transport} idle={args.idle} ms",
+                 percentiles(samples))
+
+
+class LoadStats(object):
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.actions = 0
+        self.received = 0
+        self.rounds = 0
+        self.games = 0
+        self.errors = 0
+
+
+async def load_client(url: str, room: "asyncio.Future[str]", leader: bool,
+                      deadline: float, stats: LoadStats) -> None:
+    import websockets
+    from autoplay import AutoPlayer
+
+    player = AutoPlayer()
+    # time of the last action waiting for its RoomUpdate
+    sent_at = None
+    phase = None
+    async with websockets.connect(url, max_queue=None) as ws:
+        if leader:
+            await ws.send(json.dumps(["JoinRoom", ""]))
+            update = await receive_kind(ws, "RoomUpdate")
+            room.set_result(update[1]["ID"])
+        else:
+            await ws.send(json.dumps(["JoinRoom", await room]))
+        loop = asyncio.get_running_loop()
+        while loop.time() < deadline:
+            try:
+                data = await asyncio.wait_for(ws.recv(),
+                                              deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            stats.received += 1
+            message = json.loads(data)
+            if not isinstance(message, list) or message[0] != "RoomUpdate":
+                continue
+            update = message[1]
+            if sent_at is not None:
+                stats.latencies.append(perf_counter() - sent_at)
+                sent_at = None
+            moves = player.moves(update)
+            if update["Phase"] != phase:
+                phase = update["Phase"]
+                if phase == "Interlude":
+                    # once a round every client renames itself
+                    moves.append(["UpdateInfo",
+                                  {"Name": f"p{stats.actions}"}])
+                elif phase == "Victory" and \
+                        update["Client"]["Role"] == "Storyteller":
+                    stats.games += 1
+            for move in moves:
+                if move[0] == "TellStory":
+                    stats.rounds += 1
+                await ws.send(json.dumps(move))
+                stats.actions += 1
+            if moves:
+                sent_at = perf_counter()
+
+
+async def run_load(url: str, clients: int, duration: float,
+                   stats: LoadStats) -> None:
+    loop = asyncio.get_running_loop()
+    rooms = [loop.create_future() for _ in range(clients // 3)]
+    deadline = loop.time() + duration
+    tasks = [
+        load_client(url, rooms[i // 3], i % 3 == 0, deadline, stats)
+        for i in range(len(rooms) * 3)
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    stats.errors = sum(isinstance(result, Exception) for result in results)
+
+
+def bench_load(args: argparse.Namespace) -> None:
+    stats = LoadStats()
+    rss = []
+
+    async def sample_rss(pid: int) -> None:
+        while True:
+            rss.append(rss_mb(pid))
+            await asyncio.sleep(1)
+
+    async def run(pid=None) -> float:
+        sampler = asyncio.ensure_future(sample_rss(pid)) if pid else None
+        start = perf_counter()
+        await run_load(args.url or SERVER_URL, args.clients, args.duration,
+                       stats)
+        if sampler is not None:
+            sampler.cancel()
+        return perf_counter() - start
+
+    if args.url:
+        elapsed = asyncio.run(run())
+    else:
+        with local_server("--transport", args.transport,
+                          "--log-level", "WARNING") as server:
+            elapsed = asyncio.run(run(server.pid))
+    print(f"load {args.transport} clients={args.clients} "
+          f"in {elapsed:.1f} s: rounds={stats.rounds} games={stats.games} "
+          f"errors={stats.errors}")
+    print(f"actions/s={stats.actions / elapsed:.1f} "
+          f"received messages/s={stats.received / elapsed:.1f}")
+    if stats.latencies:
+        print_report("action -> RoomUpdate ms", percentiles(stats.latencies))
+    if rss:
+        print(f"server RSS: start={rss[0]:.1f} MB max={max(rss):.1f} MB")
+
+
+def bench_deadlines(args: argparse.Namespace) -> None:
+    from timing import TimingWheel
+
+    wheel = TimingWheel()
+    rng = Random(0)
+    move_ticks = 600  # 60 s of 0.1 s ticks
+    fired = []
+
+    start = perf_counter()
+    timers = [wheel.schedule(rng.randint(1, move_ticks), fired.append, room)
+              for room in range(args.rooms)]
+    arm = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(args.rearms):
+        for room, timer in enumerate(timers):
+            timer.cancel()
+            timers[room] = wheel.schedule(
+                wheel.current + rng.randint(1, move_ticks),
+                fired.append, room
+            )
+    rearm = perf_counter() - start
+
+    start = perf_counter()
+    wheel.advance_to(move_ticks)
+    fire = perf_counter() - start
+    assert len(fired) == args.rooms
+
+    operations = args.rooms * args.rearms
+    print(f"deadlines rooms={args.rooms}: "
+          f"arm={arm / args.rooms * 1e6:.3f} us/op, "
+          f"rearm={rearm / operations * 1e6:.3f} us/op, "
+          f"fire={fire / args.rooms * 1e6:.3f} us/op "
+          f"({move_ticks} ticks in {fire * 1000:.1f} ms)")
+
+
+@contextmanager
+def benchmark_pack(images: int) -> Iterator:
+    """Makes a synthetic pack the only one, forgetting its cards after."""
+    from mechanics import Card, Pack
+
+    saved_packs = dict(Pack.pack_ids)
+    saved_cards = dict(Card.card_ids)
+    Pack.pack_ids.clear()
+    try:
+        yield Pack("benchmark", [f"{i}.jpg" for i in range(images)])
+    finally:
+        Pack.pack_ids.clear()
+        Pack.pack_ids.update(saved_packs)
+        Card.card_ids.clear()
+        Card.card_ids.update(saved_cards)
+
+
+def bench_deck(args: argparse.Namespace) -> None:
+    from mechanics import Card, Deck, Game, Player
+
+    with benchmark_pack(args.images) as pack:
+        games = []
+        for _ in range(args.games):
+            game = Game()
+            for i in range(args.players):
+                game.add_player(Player(str(i)))
+            games.append(game)
+        start = perf_counter()
+        for game in games:
+            game.start_game()
+        lazy_start = (perf_counter() - start) / args.games
+
+        start = perf_counter()
+        for _ in range(args.games):
+            cards = [Card(image, pack.id) for image in pack.pictures]
+            shuffle(cards)
+            for _ in range(args.players):
+                cards = cards[6:]
+        eager_start = (perf_counter() - start) / args.games
+
+        deck = Deck(pack)
+        start = perf_counter()
+        while len(deck):
+            deck.deal(6)
+        lazy_deal = (perf_counter() - start) / args.images
+
+        cards = [Card(image, pack.id) for image in pack.pictures]
+        start = perf_counter()
+        while cards:
+            cards = cards[6:]
+        eager_deal = (perf_counter() - start) / args.images
+
+    print(f"deck images={args.images} players={args.players}: "
+          f"start_game lazy={lazy_start * 1000:.3f} ms "
+          f"eager={eager_start * 1000:.3f} ms, "
+          f"deal lazy={lazy_deal * 1e6:.3f} us/card (with Card creation) "
+          f"eager={eager_deal * 1e6:.3f} us/card (slicing only)")
+
+
+class InlineTransport(object):
+    """Runs spawned work at once, timers never fire."""
+
+    class NoTimer(object):
+        def cancel(self) -> None:
+            pass
+
+    def spawn(self, func, *args) -> None:
+        func(*args)
+
+    def call_later(self, delay, func, *args) -> "InlineTransport.NoTimer":
+        return self.NoTimer()
+
+    def time(self) -> float:
+        return perf_counter()
+
+    def run_in_thread(self, func, *args) -> None:
+        func(*args)
+
+
+class NullConnection(object):
+    def send(self, data: str) -> None:
+        pass
+
+
+def bench_quickjoin(args: argparse.Namespace) -> None:
+    import io
+    import logging
+    from contextlib import redirect_stdout
+    import rooms
+    from mechanics import Game
+
+    rooms.main_lobby = rooms.Lobby(InlineTransport())
+    logging.getLogger("app").setLevel(logging.WARNING)
+    clients = [NullConnection() for _ in range(args.clients)]
+    with benchmark_pack(10000), redirect_stdout(io.StringIO()):
+        for ws in clients:
+            rooms.connect(ws)
+        samples = []
+        for ws in clients:
+            start = perf_counter()
+            rooms.handle_message(ws, '"QuickJoin"')
+            samples.append(perf_counter() - start)
+        waiting = [game_backend
+                   for game_backend in rooms.main_lobby.backends.values()
+                   if game_backend.open_seats() > 0]
+
+        # what QuickJoin would cost without the index
+        start = perf_counter()
+        for _ in range(args.scans):
+            # every room is full if --clients is a multiple of 3
+            min(((game_backend.open_seats(), game_id)
+                 for game_id, game_backend in rooms.main_lobby.backends.items()
+                 if game_backend.game.get_state() == Game.GamePhase.WAITING),
+                default=None)
+        scan = (perf_counter() - start) / args.scans
+
+    print(f"quickjoin clients={args.clients} "
+          f"rooms={len(rooms.main_lobby.backends)} "
+          f"waiting={len(waiting)}")
+    print_report("quickjoin ms", percentiles(samples))
+    print(f"scan of all rooms={scan * 1000:.3f} ms/lookup")
+
+
+def bench_messages(args: argparse.Namespace) -> None:
+    import tempfile
+    import logs
+    import rooms
+
+    rooms.main_lobby = rooms.Lobby(InlineTransport())
+    with benchmark_pack(10000), tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "app.log")
+        listener = logs.setup(path, args.log_level)
+        clients = [NullConnection() for _ in range(args.rooms * 3)]
+        for ws in clients:
+            rooms.connect(ws)
+            rooms.handle_message(ws, '"QuickJoin"')
+        frames = [json.dumps(["UpdateInfo", {"Name": str(i)}])
+                  for i in range(args.frames)]
+        start = perf_counter()
+        for i, frame in enumerate(frames):
+            rooms.handle_message(clients[i % len(clients)], frame)
+        elapsed = perf_counter() - start
+        listener.stop()
+        written = os.path.getsize(path) if os.path.exists(path) else 0
+    print(f"messages rooms={args.rooms} log={args.log_level}: "
+          f"{args.frames / elapsed:.0f} frames/s, "
+          f"{written / 1024:.0f} KiB logged")
+
+
+def mechanics_game(players: int, phase):
+    """A game of the only pack in the given phase, played with the
+    first card of every hand and the first foreign card of the table."""
+    from mechanics import Game, Player
+
+    game = Game()
+    for i in range(players):
+        game.add_player(Player(str(i)))
+    game.start_game()
+    storyteller = game.get_cur_player()
+    steps = [Game.GamePhase.STORYTELLING, Game.GamePhase.MATCHING,
+             Game.GamePhase.GUESSING, Game.GamePhase.INTERLUDE]
+    for step in steps[1:steps.index(phase) + 1]:
+        if step == Game.GamePhase.MATCHING:
+            game.add_lead_card(game.hands[storyteller][0].id)
+            game.start_turn("story")
+        elif step == Game.GamePhase.GUESSING:
+            for player in game.players:
+                game.make_bet(player, game.hands[player][0].id)
+                game.finish_turn(player)
+            game.place_cards()
+        elif step == Game.GamePhase.INTERLUDE:
+            for player in game.players:
+                for card, owner in game.current_table.items():
+                    if owner is not player:
+                        game.make_guess(player, card.id)
+                        break
+                game.finish_turn(player)
+            game.valuate_guesses()
+    return game
+
+
+def time_per_call(run: Callable[[int], float], repeats: int = 5,
+                  minimum: float = 0.05) -> float:
+    """run(n) makes n calls and returns the seconds they took.
+    Returns the best seconds per call."""
+    number = 1
+    while True:
+        elapsed = run(number)
+        if elapsed >= minimum or number >= 1 << 20:
+            break
+        number *= 2 if elapsed * 10 > minimum else 10
+    best = elapsed / number
+    for _ in range(repeats - 1):
+        best = min(best, run(number) / number)
+    return best
+
+
+def case_state(players: int) -> Callable[[int], float]:
+    from mechanics import Game
+
+    game = mechanics_game(players, Game.GamePhase.GUESSING)
+    player = game.players[-1]
+
+    def run(number: int) -> float:
+        start = perf_counter()
+        for _ in range(number):
+            game.touch()  # the shared view is rebuilt after every change
+            game.make_current_game_state(player)
+        return perf_counter() - start
+    return run
+
+
+def case_encode_all(players: int) -> Callable[[int], float]:
+    from mechanics import Game
+    from rooms import json_room_update
+
+    game = mechanics_game(players, Game.GamePhase.GUESSING)
+
+    def run(number: int) -> float:
+        start = perf_counter()
+        for _ in range(number):
+            game.touch()
+            for player in game.players:
+                # what GameBackend.update sends to every player
+                json_room_update(game, player)
+        return perf_counter() - start
+    return run
+
+
+def case_valuate_guesses(players: int) -> Callable[[int], float]:
+    from mechanics import Game
+
+    game = mechanics_game(players, Game.GamePhase.GUESSING)
+    for player in game.players:
+        for card, owner in game.current_table.items():
+            if owner is not player:
+                game.make_guess(player, card.id)
+                break
+    result = dict(game.result)
+
+    def run(number: int) -> float:
+        elapsed = 0.0
+        for _ in range(number):
+            game.state = Game.GamePhase.GUESSING
+            game.result = dict(result)
+            start = perf_counter()
+            game.valuate_guesses()
+            elapsed += perf_counter() - start
+        return elapsed
+    return run
+
+
+def case_end_turn(players: int) -> Callable[[int], float]:
+    from mechanics import Game
+
+    game = mechanics_game(players, Game.GamePhase.INTERLUDE)
+    saved = game.to_dict()
+
+    def run(number: int) -> float:
+        elapsed = 0.0
+        for _ in range(number):
+            game.load_dict(saved)
+            start = perf_counter()
+            game.end_turn()
+            elapsed += perf_counter() - start
+        return elapsed
+    return run
+
+
+def case_deal_hand(players: int) -> Callable[[int], float]:
+    from mechanics import Game
+
+    game = mechanics_game(players, Game.GamePhase.STORYTELLING)
+    player = game.players[0]
+
+    def run(number: int) -> float:
+        elapsed = 0.0
+        for _ in range(number):
+            game.deck.put_back([game.hands[player].pop()])
+            start = perf_counter()
+            game._deal_hand(player)
+            elapsed += perf_counter() - start
+        return elapsed
+    return run
+
+
+def case_all_turns_ended(players: int) -> Callable[[int], float]:
+    from mechanics import Game
+
+    game = mechanics_game(players, Game.GamePhase.MATCHING)
+
+    def run(number: int) -> float:
+        start = perf_counter()
+        for _ in range(number):
+            game.all_turns_ended()
+        return perf_counter() - start
+    return run
+
+
+MECHANICS_CASES = {
+    "make_current_game_state": case_state,
+    "encode_all": case_encode_all,
+    "valuate_guesses": case_valuate_guesses,
+    "end_turn": case_end_turn,
+    "deal_hand": case_deal_hand,
+    "all_turns_ended": case_all_turns_ended,
+}
+
+
+def bench_mechanics(args: argparse.Namespace) -> None:
+    results = dict()
+    for images in args.images:
+        for players in args.players:
+            if players * 7 > images:
+                continue  # the pack cannot deal a round
+            with benchmark_pack(images):
+                for name, case in MECHANICS_CASES.items():
+                    if args.only and name not in args.only:
+                        continue
+                    key = f"{name}[players={players},images={images}]"
+                    results[key] = time_per_call(case(players))
+                    print(f"{key}: {results[key] * 1e6:.2f} us")
+    if args.save:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=HERE, capture_output=True, text=True)
+        with open(args.save, "w") as file:
+            json.dump({
+                "commit": commit.stdout.strip(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, file, indent=1)
+
+
+def bench_packs(args: argparse.Namespace) -> None:
+    import shutil
+    import tempfile
+    from packs import STORE, update_store
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, "public")
+        manifest = os.path.join(directory, "manifest.json")
+        for pack in range(args.packs):
+            os.makedirs(os.path.join(root, f"pack{pack}"))
+        rng = Random(0)
+        originals = []
+        for index in range(args.files):
+            pack = os.path.join(root, f"pack{index % args.packs}")
+            if originals and rng.random() < 0.1:
+                data = rng.choice(originals)
+            else:
+                data = os.urandom(args.size)
+                originals.append(data)
+            with open(os.path.join(pack, f"{index}.jpg"), "wb") as file:
+                file.write(data)
+
+        start = perf_counter()
+        update_store(root, manifest)
+        first = perf_counter() - start
+        start = perf_counter()
+        update_store(root, manifest)
+        unchanged = perf_counter() - start
+        with open(os.path.join(root, "pack0", "new.jpg"), "wb") as file:
+            file.write(os.urandom(args.size))
+        start = perf_counter()
+        update_store(root, manifest)
+        one_new = perf_counter() - start
+        stored = len(os.listdir(os.path.join(root, STORE)))
+
+        copies = os.path.join(directory, "copies")
+        os.makedirs(copies)
+        start = perf_counter()
+        for pack in range(args.packs):
+            for name in os.listdir(os.path.join(root, f"pack{pack}")):
+                shutil.copy(os.path.join(root, f"pack{pack}", name), copies)
+        copy_all = perf_counter() - start
+
+    print(f"packs files={args.files + 1} size={args.size} B: "
+          f"{stored} stored pictures, "
+          f"first run={first * 1000:.1f} ms, "
+          f"unchanged={unchanged * 1000:.1f} ms, "
+          f"one new file={one_new * 1000:.1f} ms, "
+          f"copying all={copy_all * 1000:.1f} ms")
+
+
+def bench_static(args: argparse.Namespace) -> None:
+    import tempfile
+    from static import StaticFiles
+
+    def start_response(status, headers):
+        pass
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = []
+        for index in range(args.pictures):
+            name = f"{index:032x}.jpg"
+            with open(os.path.join(directory, name), "wb") as file:
+                file.write(os.urandom(args.size))
+            names.append(name)
+        rng = Random(0)
+        requests = [f"/{name}" for _ in range(args.rooms)
+                    for name in rng.sample(names, 6)
+                    for _ in range(args.players)]
+
+        def read_every_time(environ, start_response):
+            path = os.path.join(directory, environ["PATH_INFO"][1:])
+            os.stat(path)
+            with open(path, "rb") as file:
+                return [file.read()]
+
+        files = StaticFiles(directory, immutable=True,
+                            cache_bytes=args.cache_mb << 20)
+        runs = [
+            ("read every time", read_every_time, False),
+            ("cold cache", files, False),
+            ("warm cache", files, False),
+            ("if-none-match", files, True),
+        ]
+        for label, app, conditional in runs:
+            start = perf_counter()
+            for path in requests:
+                environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path}
+                if conditional:
+                    environ["HTTP_IF_NONE_MATCH"] = f'"{path[1:]}"'
+                for _ in app(environ, start_response):
+                    pass
+            elapsed = perf_counter() - start
+            print(f"static {label}: {len(requests)} requests in "
+                  f"{elapsed * 1000:.1f} ms, "
+                  f"{len(requests) / elapsed:.0f} requests/s")
+        print(f"static cache: {files.cached >> 20} MiB, "
+              f"{files.reads} files read")
+
+
+def bench_compare(args: argparse.Namespace) -> None:
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    print(f"{args.base} ({base['commit']}) -> {args.new} ({new['commit']})")
+    regressions = 0
+    for key, seconds in new["results"].items():
+        if key not in base["results"]:
+            continue
+        ratio = seconds / base["results"][key]
+        mark = ""
+        if ratio > args.threshold:
+            mark = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 / args.threshold:
+            mark = "  faster"
+        print(f"{key}: {base['results'][key] * 1e6:.2f} -> "
+              f"{seconds * 1e6:.2f} us x{ratio:.2f}{mark}")
+    if regressions:
+        print(f"{regressions} regressions")
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    latency = commands.add_parser(
+        "latency", help="action -> RoomUpdate round trip under idle load"
+    )
+    latency.add_argument("--idle", type=int, default=500)
+    latency.add_argument("--rounds", type=int, default=200)
+    latency.add_argument("--url", default=None)
+    latency.add_argument("--transport", choices=["gevent", "asyncio"],
+                         default="gevent")
+    latency.set_defaults(run=bench_latency)
+
+    load = commands.add_parser(
+        "load", help="protocol clients playing full games"
+    )
+    load.add_argument("--clients", type=int, default=300)
+    load.add_argument("--duration", type=float, default=60)
+    load.add_argument("--url", default=None)
+    load.add_argument("--transport", choices=["gevent", "asyncio"],
+                      default="gevent")
+    load.set_defaults(run=bench_load)
+
+    deadlines = commands.add_parser(
+        "deadlines", help="timing wheel with one move deadline per room"
+    )
+    deadlines.add_argument("--rooms", type=int, default=10000)
+    deadlines.add_argument("--rearms", type=int, default=10)
+    deadlines.set_defaults(run=bench_deadlines)
+
+    deck = commands.add_parser(
+        "deck", help="start_game and dealing on a synthetic pack"
+    )
+    deck.add_argument("--images", type=int, default=10000)
+    deck.add_argument("--players", type=int, default=6)
+    deck.add_argument("--games", type=int, default=100)
+    deck.set_defaults(run=bench_deck)
+
+    quickjoin = commands.add_parser(
+        "quickjoin", help="QuickJoin of many lobby clients at once"
+    )
+    quickjoin.add_argument("--clients", type=int, default=100000)
+    quickjoin.add_argument("--scans", type=int, default=100)
+    quickjoin.set_defaults(run=bench_quickjoin)
+
+    messages = commands.add_parser(
+        "messages", help="handle_message throughput with logging on"
+    )
+    messages.add_argument("--rooms", type=int, default=100)
+    messages.add_argument("--frames", type=int, default=20000)
+    messages.add_argument("--log-level", default="INFO",
+                          choices=["DEBUG", "INFO", "WARNING"])
+    messages.set_defaults(run=bench_messages)
+
+    mechanics = commands.add_parser(
+        "mechanics", help="Game hot paths by room and pack size"
+    )
+    mechanics.add_argument("--players", type=int, nargs="+",
+                           default=[3, 6, 12, 25, 50])
+    mechanics.add_argument("--images", type=int, nargs="+",
+                           default=[100, 1000, 10000])
+    mechanics.add_argument("--only", nargs="+", default=None,
+                           choices=list(MECHANICS_CASES))
+    mechanics.add_argument("--save", default=None,
+                           help="file to store the results in")
+    mechanics.set_defaults(run=bench_mechanics)
+
+    packs = commands.add_parser(
+        "packs", help="incremental picture store next to copying all"
+    )
+    packs.add_argument("--files", type=int, default=5000)
+    packs.add_argument("--size", type=int, default=20000)
+    packs.add_argument("--packs", type=int, default=4)
+    packs.set_defaults(run=bench_packs)
+
+    static = commands.add_parser(
+        "static", help="card picture requests of hand reveals"
+    )
+    static.add_argument("--rooms", type=int, default=1000)
+    static.add_argument("--players", type=int, default=4)
+    static.add_argument("--pictures", type=int, default=2000)
+    static.add_argument("--size", type=int, default=30000)
+    static.add_argument("--cache-mb", type=int, default=64)
+    static.set_defaults(run=bench_static)
+
+    compare = commands.add_parser(
+        "compare", help="compare two results stored by mechanics --save"
+    )
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=1.2,
+                         help="slowdown ratio reported as a regression")
+    compare.set_defaults(run=bench_compare)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
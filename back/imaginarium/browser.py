@@ -0,0 +1,61 @@
+"""Room list for clients waiting in the lobby."""
+import json
+from typing import Dict, Optional
+
+
+class RoomFeed(object):
+    """Room summaries pushed to subscribed lobby clients.
+
+    mark() only remembers the latest summary of a changed room, flush()
+    then compares them with the published ones and encodes a single
+    "RoomListPatch" message for all watchers:
+    ["RoomListPatch", [["Add", summary], ["Update", summary], ["Remove", id]]]
+    New watchers get the whole list as ["RoomList", [summary, ...]].
+    """
+
+    def __init__(self, interval: float = 0.1) -> None:
+        # seconds to collect room changes before flushing
+        self.interval = interval
+        # clients subscribed with "WatchRooms", a dict keeps their order
+        self.watchers: Dict[object, None] = dict()
+        # game_id -> summary the watchers have
+        self.rooms: Dict[int, dict] = dict()
+        # game_id -> latest summary not published yet, None if removed
+        self.pending: Dict[int, Optional[dict]] = dict()
+
+    def watch(self, ws) -> str:
+        """Subscribes the client, returns the list to send it."""
+        self.watchers[ws] = None
+        return json.dumps(["RoomList", list(self.rooms.values())])
+
+    def unwatch(self, ws) -> None:
+        self.watchers.pop(ws, None)
+
+    def mark(self, game_id: int, summary: Optional[dict]) -> bool:
+        """Remembers the room change, None removes the room.
+        Returns True if a flush has to be scheduled."""
+        schedule = not self.pending
+        self.pending[game_id] = summary
+        return schedule
+
+    def flush(self) -> Optional[str]:
+        """Publishes pending changes. Returns the message for watchers
+        or None if their list has not changed."""
+        pending, self.pending = self.pending, dict()
+        events = []
+        for game_id, summary in pending.items():
+            published = self.rooms.get(game_id)
+            if summary is None:
+                if published is not None:
+                    del self.rooms[game_id]
+                    events.append(["Remove", str(game_id)])
+            elif published is None:
+                self.rooms[game_id] = summary
+                events.append(["Add", summary])
+            elif published != summary:
+                self.rooms[game_id] = summary
+                events.append(["Update", summary])
+        if not events:
+            return None
+        return json.dumps(["RoomListPatch", events])
+
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Any, Dict, List, Optional
+
+
+def make_patch(old: Any, new: Any, path: Optional[list] = None,
+               ops: Optional[list] = None) -> List[list]:
+    """Returns the list of operations turning old room state into new one.
+    [path, value] sets value by path (index equal to the list length appends),
+    [path] deletes the key or the list item.
+    """
+    if path is None:
+        path = []
+    if ops is None:
+        ops = []
+    if old is new:
+        return ops
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            if key in old:
+                make_patch(old[key], value, path + [key], ops)
+            else:
+                ops.append([path + [key], value])
+        for key in old:
+            if key not in new:
+                ops.append([path + [key]])
+    elif isinstance(old, list) and isinstance(new, list):
+        common = min(len(old), len(new))
+        for i in range(common):
+            make_patch(old[i], new[i], path + [i], ops)
+        for i in range(common, len(new)):
+            ops.append([path + [i], new[i]])
+        for i in range(len(old) - 1, common - 1, -1):
+            ops.append([path + [i]])
+    elif type(old) is not type(new) or old != new:
+        ops.append([path, new])
+    return ops
+
+
+def apply_patch(state: Any, ops: List[list]) -> Any:
+    """Applies operations made by make_patch to a copy of state."""
+    state = deepcopy(state)
+    for op in ops:
+        path = op[0]
+        if not path:
+            state = deepcopy(op[1])
+            continue
+        target = state
+        for key in path[:-1]:
+            target = target[key]
+        key = path[-1]
+        if len(op) == 1:
+            del target[key]
+        elif isinstance(target, list) and key == len(target):
+            target.append(deepcopy(op[1]))
+        else:
+            target[key] = deepcopy(op[1])
+    return state
+
+
+class DeltaStream:
+    """Versioned room states sent to one client.
+
+    Patches are made against the last version acknowledged by the client
+    ("Ack" message), so the client keeps states starting from the Base of
+    the latest patch. A snapshot resets the stream and is used as the base
+    until newer acknowledgements come. If the client stops acknowledging,
+    the stream falls back to a snapshot.
+    """
+    max_pending = 32
+
+    def __init__(self) -> None:
+        self.acked_version: Optional[int] = None
+        self.acked_state: Optional[dict] = None
+        # version -> state, sent but not acknowledged yet
+        self.sent: Dict[int, dict] = OrderedDict()
+
+    def snapshot(self, state: dict, version: int) -> list:
+        self.acked_version = version
+        self.acked_state = state
+        self.sent = OrderedDict()
+        return ["RoomSnapshot", {"Version": version, "State": state}]
+
+    def encode(self, state: dict, version: int) -> Optional[list]:
+        """Returns the message bringing the client to the given state
+        or None if the client's view has not changed."""
+        if self.acked_state is None or len(self.sent) >= self.max_pending:
+            return self.snapshot(state, version)
+        last_state = next(reversed(self.sent.values()), self.acked_state)
+        if not make_patch(last_state, state):
+            return None
+        self.sent[version] = state
+        return ["RoomPatch", {
+            "Base": self.acked_version,
+            "Version": version,
+            "Ops": make_patch(self.acked_state, state)
+        }]
+
+    def ack(self, version: int) -> None:
+        if version not in self.sent:
+            return
+        self.acked_version = version
+        self.acked_state = self.sent[version]
+        while self.sent:
+            sent_version = next(iter(self.sent))
+            if sent_version > version:
+                break
+            self.sent.pop(sent_version)
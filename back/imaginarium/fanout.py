@@ -0,0 +1,119 @@
+"""Room change announcements between server processes.
+
+Every process publishes "room <id> is now at version <v>" after saving
+a game to the shared store. Processes holding sockets of that room
+reload it and send updates to their own clients.
+"""
+import json
+from fnmatch import fnmatchcase
+from typing import Callable, Dict, List, Tuple
+from uuid import uuid4
+
+# callback(channel, data)
+Listener = Callable[[str, str], None]
+
+
+class Broker(object):
+    """Publish/subscribe channel interface."""
+
+    def publish_many(self, messages: List[Tuple[str, str]]) -> None:
+        """Publishes (channel, data) pairs."""
+        raise NotImplementedError
+
+    def listen(self, pattern: str, callback: Listener) -> None:
+        """Calls callback for messages on channels matching the
+        glob-style pattern. May call it from another thread."""
+        raise NotImplementedError
+
+
+class MemoryBroker(Broker):
+    """Single process stand-in for RedisBroker."""
+
+    def __init__(self) -> None:
+        self.listeners: List[Tuple[str, Listener]] = list()
+        self.published = 0
+
+    def publish_many(self, messages: List[Tuple[str, str]]) -> None:
+        for channel, data in messages:
+            self.published += 1
+            for pattern, callback in self.listeners:
+                if fnmatchcase(channel, pattern):
+                    callback(channel, data)
+
+    def listen(self, pattern: str, callback: Listener) -> None:
+        self.listeners.append((pattern, callback))
+
+
+class RedisBroker(Broker):
+    def __init__(self, client) -> None:
+        self.client = client
+        self.pubsub = None
+        self.thread = None
+
+    def publish_many(self, messages: List[Tuple[str, str]]) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for channel, data in messages:
+            pipe.publish(channel, data)
+        pipe.execute()
+
+    def listen(self, pattern: str, callback: Listener) -> None:
+        def handler(message):
+            channel, data = message["channel"], message["data"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            if isinstance(data, bytes):
+                data = data.decode()
+            callback(channel, data)
+
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.psubscribe(**{pattern: handler})
+        self.thread = self.pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
+class Fanout(object):
+    """Batches room announcements of this process.
+
+    mark() only remembers the latest version of the room, flush() then
+    publishes one message per changed room channel, however many
+    mutations and recipients there were in between.
+    """
+
+    def __init__(self, broker: Broker, prefix: str = "imaginarium",
+                 interval: float = 0.01) -> None:
+        self.broker = broker
+        self.prefix = prefix
+        # seconds to collect announcements before flushing
+        self.interval = interval
+        self.worker_id = uuid4().hex
+        # game_id -> latest version not published yet
+        self.pending: Dict[int, int] = dict()
+
+    def channel(self, game_id: int) -> str:
+        return f"{self.prefix}:room:{game_id}"
+
+    def mark(self, game_id: int, version: int) -> bool:
+        """Remembers the room change.
+        Returns True if a flush has to be scheduled."""
+        schedule = not self.pending
+        self.pending[game_id] = version
+        return schedule
+
+    def flush(self) -> None:
+        pending, self.pending = self.pending, dict()
+        if not pending:
+            return
+        self.broker.publish_many([
+            (self.channel(game_id),
+             json.dumps([self.worker_id, game_id, version]))
+            for game_id, version in pending.items()
+        ])
+
+    def listen(self, callback: Callable[[int, int], None]) -> None:
+        """Calls callback(game_id, version) for rooms changed
+        by other processes."""
+        def on_message(channel: str, data: str) -> None:
+            worker_id, game_id, version = json.loads(data)
+            if worker_id != self.worker_id:
+                callback(game_id, version)
+
+        self.broker.listen(f"{self.prefix}:room:*", on_message)
@@ -0,0 +1,163 @@
+"""Event-sourced history of a game.
+
+A GameLog appends a JSON line for every outermost mutation of its game
+(see mechanics.mutation) and a snapshot of the whole game (Game.to_dict)
+every snapshot_every events:
+    [version, method, *arguments]
+    ["Snapshot", version, data]
+where version is Game.version before the call. Players are recorded by
+id and cards by picture, as card ids are not reproducible. Game.rng
+depends only on the seed and the version, so replaying the events
+after a snapshot repeats the game exactly.
+
+replay() rebuilds a game from the lines as of any version: it parses
+only the latest snapshot before that version and the events after it.
+"""
+import json
+import logging
+from typing import Iterable, List, Optional, TextIO
+
+from mechanics import Card, Game, Player
+
+logger = logging.getLogger("app.mechanics")
+
+# how arguments of every mutation are recorded
+PLAYER = "player"
+NEW_PLAYER = "new player"
+CARD = "card"
+VALUE = "value"
+ARGUMENTS = {
+    "add_player": (NEW_PLAYER,),
+    "remove_player": (PLAYER,),
+    "purge_player": (PLAYER,),
+    "update_player": (PLAYER, VALUE, VALUE),
+    "start_game": (),
+    "start_turn": (VALUE,),
+    "add_lead_card": (CARD,),
+    "make_bet": (PLAYER, CARD),
+    "make_random_bet": (PLAYER,),
+    "place_cards": (),
+    "make_guess": (PLAYER, CARD),
+    "skip_guess": (PLAYER,),
+    "finish_turn": (PLAYER,),
+    "valuate_guesses": (),
+    "end_turn": (),
+    "end_game": (PLAYER,),
+    "touch": (),
+}
+SNAPSHOT = '["Snapshot",'
+
+
+class ReplayError(Exception):
+    """The replayed game went another way than the recorded one."""
+
+
+class GameLog(object):
+    """Lines are written to out, or kept in lines if out is None."""
+
+    def __init__(self, game: Game, out: Optional[TextIO] = None,
+                 snapshot_every: int = 100) -> None:
+        self.game = game
+        self.out = out
+        self.lines: List[str] = list()
+        self.snapshot_every = snapshot_every
+        # events written since the last snapshot
+        self.events = 0
+        game.log = self
+        self.snapshot()
+
+    def write(self, line: str) -> None:
+        if self.out is None:
+            self.lines.append(line)
+        else:
+            self.out.write(line + "\n")
+
+    def snapshot(self) -> None:
+        self.events = 0
+        self.write(json.dumps(["Snapshot", self.game.version,
+                               self.game.to_dict()],
+                              separators=(",", ":")))
+
+    def record(self, method: str, args: tuple) -> None:
+        if self.events >= self.snapshot_every:
+            self.snapshot()
+        self.events += 1
+        event = [self.game.version, method]
+        for kind, value in zip(ARGUMENTS[method], args):
+            event.append(encode(kind, value))
+        self.write(json.dumps(event, separators=(",", ":")))
+
+    def close(self) -> None:
+        self.game.log = None
+        if self.out is not None:
+            self.out.close()
+
+
+def encode(kind: str, value):
+    if value is None or kind == VALUE:
+        return value
+    if kind == PLAYER:
+        return value.id
+    if kind == NEW_PLAYER:
+        return [value.id, value.name, value.picture]
+    card = Card.card_ids.get(value)
+    # an unknown id fails the same way when replayed
+    return None if card is None else card.picture
+
+
+def decode(game: Game, kind: str, value):
+    if value is None or kind == VALUE:
+        return value
+    if kind == CARD:
+        for card in game._all_cards():
+            if card.picture == value:
+                return card.id
+        return None
+    player_id = value[0] if kind == NEW_PLAYER else value
+    for player in list(game.result) + game.players:
+        if player.id == player_id:
+            return player
+    if kind == PLAYER:
+        raise ReplayError(f"Unknown player {player_id}")
+    player = Player(value[1], id=player_id)
+    player.picture = value[2]
+    return player
+
+
+def apply(game: Game, event: list) -> None:
+    version, method = event[0], event[1]
+    if game.version != version:
+        raise ReplayError(f"Game {game.id} is at version {game.version}, "
+                          f"{method} was recorded at {version}")
+    args = [decode(game, kind, value)
+            for kind, value in zip(ARGUMENTS[method], event[2:])]
+    try:
+        getattr(game, method)(*args)
+    except Exception:
+        # the recorded call has failed the same way
+        logger.debug("Replayed %s of game %s failed", method, game.id,
+                     exc_info=True)
+
+
+def replay(lines: Iterable[str], version: Optional[int] = None) -> Game:
+    """Rebuilds the game as it was after the last mutation started
+    before version (by default after all of them).
+    The game is registered like Game.from_dict does."""
+    lines = [line for line in lines if line.strip()]
+    start = None
+    for index, line in enumerate(lines):
+        if line.startswith(SNAPSHOT):
+            at = int(line[len(SNAPSHOT):line.index(",", len(SNAPSHOT))])
+            if version is None or at <= version:
+                start = index
+    if start is None:
+        raise ReplayError("No snapshot to start from")
+    game = Game.from_dict(json.loads(lines[start])[2])
+    for line in lines[start + 1:]:
+        if line.startswith(SNAPSHOT):
+            continue
+        event = json.loads(line)
+        if version is not None and event[0] >= version:
+            break
+        apply(game, event)
+    return game
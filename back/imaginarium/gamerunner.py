@@ -0,0 +1,212 @@
+"""Seeded random games in parallel, checking invariants after every phase.
+
+python gamerunner.py [--games 500000] [--workers CPUS] [--seed 0]
+                     [--players 4] [--images 100] [--shard 1000]
+python gamerunner.py --replay SEED [--players 4] [--images 100]
+
+Games are played with play_until_phase(enable_random=True) on a
+synthetic pack of --images pictures and split into shards of --shard
+games run by a process pool. Game i is seeded with seed * 2**32 + i,
+both Game.rng and the module random used by play_until_phase, so every
+failing game is printed with the seed replaying it alone.
+
+Invariants: scores are never negative, every hand has 6 cards when a
+round starts, every picture of the pack is either in the deck, in a
+hand or on the table, and no card is in two places.
+"""
+import argparse
+import os
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import List, NamedTuple, Tuple
+
+from autoplay import play_until_phase
+from mechanics import Game, Pack, Player
+
+NEXT_PHASE = {
+    Game.GamePhase.WAITING: Game.GamePhase.STORYTELLING,
+    Game.GamePhase.STORYTELLING: Game.GamePhase.MATCHING,
+    Game.GamePhase.MATCHING: Game.GamePhase.GUESSING,
+    Game.GamePhase.GUESSING: Game.GamePhase.INTERLUDE,
+    Game.GamePhase.INTERLUDE: Game.GamePhase.STORYTELLING,
+}
+HAND_SIZE = 6
+# violations kept per shard, the rest are only counted
+KEPT_VIOLATIONS = 20
+
+
+class Violation(NamedTuple):
+    seed: int
+    round: int
+    phase: str
+    kind: str
+    detail: str
+
+
+class ShardResult(NamedTuple):
+    games: int
+    rounds: int
+    # kind -> count
+    counts: Counter
+    violations: List[Violation]
+
+
+def use_pack(images: int) -> None:
+    """Makes a synthetic pack the only one (pool initializer)."""
+    Pack.pack_ids.clear()
+    Pack("runner", [f"{i}.jpg" for i in range(images)])
+
+
+def check_invariants(game: Game) -> List[Tuple[str, str]]:
+    """(kind, detail) of every broken invariant."""
+    broken = []
+    for player in game.players:
+        if game.result[player] < 0:
+            broken.append(("negative score",
+                           f"{player.name}: {game.result[player]}"))
+    if game.get_state() == Game.GamePhase.STORYTELLING:
+        for player in game.players:
+            if len(game.hands[player]) != HAND_SIZE:
+                broken.append(("hand size", f"{player.name}: "
+                               f"{len(game.hands[player])} cards"))
+    cards = list(game.deck.returned) + list(game.current_table)
+    for hand in game.hands.values():
+        cards += hand
+    pictures = Counter(card.picture for card in cards)
+    twice = [picture for picture, count in pictures.items() if count > 1]
+    if twice:
+        broken.append(("duplicate card", ", ".join(sorted(twice))))
+    total = game.deck.remaining + len(cards)
+    if total != len(game.deck.pack.pictures):
+        broken.append(("deck conservation", f"{total} cards in play of "
+                       f"{len(game.deck.pack.pictures)}"))
+    return broken
+
+
+def play_game(seed: int, players: int, max_rounds: int = 1000
+              ) -> Tuple[Game, int, List[Violation]]:
+    """Plays a seeded game to the end, returns it with the number of
+    rounds and the broken invariants. The caller forgets the game."""
+    random.seed(seed)
+    game = Game(seed=seed)
+    for i in range(players):
+        game.add_player(Player(str(i)))
+    violations = []
+    rounds = 0
+    while game.get_state() != Game.GamePhase.VICTORY:
+        state = game.get_state()
+        if state == Game.GamePhase.STORYTELLING:
+            rounds += 1
+            if rounds > max_rounds:
+                violations.append(Violation(
+                    seed, rounds, state.name, "endless game",
+                    f"no winner after {max_rounds} rounds"))
+                break
+        play_until_phase(game, NEXT_PHASE[state], enable_random=True)
+        for kind, detail in check_invariants(game):
+            violations.append(Violation(
+                seed, rounds, game.get_state().name, kind, detail))
+    return game, rounds, violations
+
+
+def forget(game: Game) -> None:
+    game.release_cards()
+    Game.delete_game(game.id)
+
+
+def game_seed(seed: int, index: int) -> int:
+    return seed * 2 ** 32 + index
+
+
+def run_shard(seed: int, start: int, count: int,
+              players: int) -> ShardResult:
+    counts: Counter = Counter()
+    kept = []
+    rounds = 0
+    for index in range(start, start + count):
+        game, played, violations = play_game(game_seed(seed, index),
+                                             players)
+        rounds += played
+        forget(game)
+        for violation in violations:
+            counts[violation.kind] += 1
+            if len(kept) < KEPT_VIOLATIONS:
+                kept.append(violation)
+    return ShardResult(count, rounds, counts, kept)
+
+
+def run(games: int, workers: int, seed: int, players: int, images: int,
+        shard: int) -> ShardResult:
+    """Plays the games in shards on a pool of workers."""
+    starts = range(0, games, shard)
+    total = ShardResult(0, 0, Counter(), [])
+    with ProcessPoolExecutor(workers, initializer=use_pack,
+                             initargs=(images,)) as pool:
+        results = pool.map(run_shard, [seed] * len(starts), starts,
+                           [min(shard, games - start) for start in starts],
+                           [players] * len(starts))
+        for result in results:
+            total.counts.update(result.counts)
+            total.violations.extend(result.violations)
+            total = total._replace(games=total.games + result.games,
+                                   rounds=total.rounds + result.rounds)
+    return total
+
+
+def replay(seed: int, players: int) -> None:
+    """Plays a single game again, printing every broken invariant."""
+    game, rounds, violations = play_game(seed, players)
+    for violation in violations:
+        print(f"round {violation.round} {violation.phase}: "
+              f"{violation.kind}: {violation.detail}")
+    scores = ", ".join(f"{player.name}: {score}"
+                       for player, score in game.result.items())
+    print(f"seed {seed}: {rounds} rounds, scores {scores}, "
+          f"{len(violations)} violations")
+    forget(game)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--games", type=int, default=500000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--shard", type=int, default=1000,
+                        help="games a worker plays per task")
+    parser.add_argument("--replay", type=int, default=None, metavar="SEED",
+                        help="play the game of this seed only")
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        use_pack(args.images)
+        replay(args.replay, args.players)
+        return
+
+    start = perf_counter()
+    result = run(args.games, args.workers, args.seed, args.players,
+                 args.images, args.shard)
+    elapsed = perf_counter() - start
+    print(f"{result.games} games of {args.players} players on "
+          f"{args.workers} workers in {elapsed:.2f} s: "
+          f"{result.games / elapsed:.0f} games/s, "
+          f"{result.rounds / max(result.games, 1):.1f} rounds a game")
+    if not result.counts:
+        print("no invariant violations")
+        return
+    for kind, count in result.counts.most_common():
+        print(f"{kind}: {count}")
+    for violation in result.violations:
+        print(f"seed {violation.seed} round {violation.round} "
+              f"{violation.phase}: {violation.kind}: {violation.detail}")
+    seeds = sorted({violation.seed for violation in result.violations})
+    print(f"replay with: python gamerunner.py --replay {seeds[0]} "
+          f"--players {args.players} --images {args.images}")
+    raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""gevent + flask_sockets transport.
+gevent.monkey.patch_all() must be applied before importing this module.
+Pictures and the deploy bundle are served by static.py ahead of flask."""
+from time import monotonic
+from typing import Callable
+
+from flask import Flask, jsonify, render_template
+from flask_sockets import Sockets
+from gevent import get_hub, pywsgi, spawn, spawn_later
+from geventwebsocket.exceptions import WebSocketError
+from geventwebsocket.handler import WebSocketHandler
+
+import rooms
+from packs import STORE
+from rooms import logger
+from static import StaticFiles, mount
+from transport import Timer, Transport
+
+app = Flask(
+    __name__,
+    static_folder='../../front/deploy',
+    static_url_path='',
+    template_folder='../../front/deploy'
+)
+sockets = Sockets(app)
+pictures = StaticFiles(f'../../front/public/{STORE}', immutable=True)
+bundle = StaticFiles('../../front/deploy')
+
+
+class GreenletTimer(object):
+    def __init__(self, greenlet) -> None:
+        self.greenlet = greenlet
+
+    def cancel(self) -> None:
+        self.greenlet.kill(block=False)
+
+
+class GeventTransport(Transport):
+    def spawn(self, func: Callable, *args) -> None:
+        spawn(func, *args)
+
+    def call_later(self, delay: float, func: Callable, *args) -> Timer:
+        return GreenletTimer(spawn_later(delay, func, *args))
+
+    def time(self) -> float:
+        return monotonic()
+
+    def run_in_thread(self, func: Callable, *args) -> None:
+        # a real thread, the threading module is patched into greenlets
+        get_hub().threadpool.spawn(func, *args)
+
+
+@sockets.route("/socket")
+def socket(ws):
+    rooms.connect(ws)
+    try:
+        while True:
+            # receive() blocks only this greenlet until a frame arrives
+            message = ws.receive()
+            if message is None:
+                break
+            rooms.handle_message(ws, message)
+    except WebSocketError as error:
+        logger.info('%s connection error: %s', ws, error)
+    finally:
+        rooms.disconnect(ws)
+
+
+@app.route('/')
+def index():
+    return render_template('index.html', initial_message="")
+
+
+def json_join_room_message(room_id: str) -> str:
+    # Player is the default username
+    return f'["UserMsg", ["JoinRoom", "{room_id}", "Player"]]'
+
+
+@app.route('/id/<room_id>')
+def join_room_page(room_id: str):
+    return render_template(
+        'index.html',
+        initial_message=json_join_room_message(room_id)
+    )
+
+
+@app.route('/stats')
+def stats():
+    return jsonify(rooms.memory_stats())
+
+
+def serve(port: int) -> None:
+    rooms.main_lobby.transport = GeventTransport()
+    if rooms.main_lobby.snapshots is not None:
+        logger.info('Restored %s rooms', rooms.restore_rooms())
+    wsgi_app = mount(app, (f'/{STORE}/', pictures, False),
+                     ('/', bundle, True))
+    server = pywsgi.WSGIServer(('', port), wsgi_app,
+                               handler_class=WebSocketHandler)
+    server.serve_forever()
@@ -0,0 +1,188 @@
+"""Offline ingest of pack pictures into card-sized variants.
+
+python ingest.py [--root ../../front/public] [--manifest manifest.json]
+                 [--workers CPUS] [--force]
+
+Brings the picture store up to date (packs.update_store), then makes
+every stored picture into the variants of VARIANTS: cropped to the card
+shape, scaled to fixed dimensions and encoded as WebP and JPEG with the
+best quality fitting into the byte budget of the variant. Variants go
+to img/variants/<content hash>-<variant>-<settings hash>.<ext>; since
+stored names are content hashes, a picture is processed once however
+many packs have it and only new pictures are processed by the next run.
+Changing VARIANTS or FORMATS makes everything again under new names, so
+a name always has the same content (see static.py).
+
+Pictures are processed by a process pool. The variants are listed in
+the "Variants" of the manifest, load_packs gives them to Pack.variants
+and room states send them with every card, see mechanics.card_view.
+Pictures which can not be decoded are logged and get no variants.
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from packs import STORE, Variants, read_manifest, update_store, write_manifest
+
+logger = logging.getLogger("app")
+
+# variant -> (width, height, byte budget of every format)
+VARIANTS = {
+    "thumb": (160, 240, 12000),
+    "full": (480, 720, 60000),
+}
+# format -> (PIL format, extension)
+FORMATS = {
+    "webp": ("WEBP", ".webp"),
+    "jpeg": ("JPEG", ".jpg"),
+}
+DIRECTORY = "variants"
+# qualities tried while fitting into a budget
+MIN_QUALITY = 30
+MAX_QUALITY = 90
+
+
+def settings() -> list:
+    """What the variants depend on besides the picture."""
+    return [VARIANTS, sorted(FORMATS), MIN_QUALITY, MAX_QUALITY]
+
+
+def encode(image: Image.Image, kind: str, quality: int) -> bytes:
+    out = io.BytesIO()
+    image.save(out, FORMATS[kind][0], quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def fit_budget(image: Image.Image, kind: str,
+               budget: int) -> Tuple[bytes, int]:
+    """The image encoded with the best quality not over budget bytes,
+    or with MIN_QUALITY if none is. Returns the data and the quality."""
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best = None
+    # binary search, the size grows with the quality
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode(image, kind, quality)
+        if len(data) <= budget:
+            best = data, quality
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is None:
+        return encode(image, kind, MIN_QUALITY), MIN_QUALITY
+    return best
+
+
+def settings_tag() -> str:
+    data = json.dumps(settings(), sort_keys=True).encode()
+    return hashlib.blake2b(data, digest_size=4).hexdigest()
+
+
+def variant_name(picture: str, variant: str, kind: str) -> str:
+    """Path of a variant file in the store."""
+    stem = os.path.splitext(picture)[0]
+    return f"{DIRECTORY}/{stem}-{variant}-{settings_tag()}{FORMATS[kind][1]}"
+
+
+def make_variants(store: str,
+                  picture: str) -> Optional[Dict[str, Dict[str, str]]]:
+    """Writes the variants of a stored picture, runs in a worker process.
+    Returns variant -> format -> file, None if the picture is
+    unreadable."""
+    try:
+        with Image.open(os.path.join(store, picture)) as source:
+            image = ImageOps.exif_transpose(source).convert("RGB")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    variants: Dict[str, Dict[str, str]] = dict()
+    for variant, (width, height, budget) in VARIANTS.items():
+        # crops the middle of the picture to the card shape
+        card = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        variants[variant] = dict()
+        for kind in FORMATS:
+            data, _ = fit_budget(card, kind, budget)
+            name = variant_name(picture, variant, kind)
+            temporary = os.path.join(store, name + ".tmp")
+            with open(temporary, "wb") as file:
+                file.write(data)
+            os.replace(temporary, os.path.join(store, name))
+            variants[variant][kind] = name
+    return variants
+
+
+def _make_variants(job: Tuple[str, str]):
+    return make_variants(*job)
+
+
+def ingest(root: str = "../../front/public",
+           manifest_path: str = "manifest.json",
+           workers: Optional[int] = None,
+           force: bool = False) -> Tuple[int, List[str]]:
+    """Makes the missing variants of the stored pictures and drops the
+    variants of pictures no pack has any more. Returns the number of
+    pictures processed and the pictures which failed."""
+    packs = update_store(root, manifest_path)
+    store = os.path.join(root, STORE)
+    os.makedirs(os.path.join(store, DIRECTORY), exist_ok=True)
+    document = read_manifest(manifest_path)
+    variants: Variants = document.get("Variants", dict())
+    # settings go through JSON to compare with the ones read back
+    current = json.loads(json.dumps(settings()))
+    pictures = sorted({picture for names in packs.values()
+                       for picture in names})
+    if force or document.get("Settings") != current:
+        stale = set(variants)
+    else:
+        stale = set(variants) - set(pictures)
+    for picture in stale:
+        for files in variants.pop(picture).values():
+            for name in files.values():
+                try:
+                    os.remove(os.path.join(store, name))
+                except FileNotFoundError:
+                    pass
+    todo = [picture for picture in pictures if picture not in variants]
+    failed = []
+    if todo:
+        jobs = [(store, picture) for picture in todo]
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(_make_variants, jobs,
+                               chunksize=max(1, len(jobs) // 64))
+            for picture, result in zip(todo, results):
+                if result is None:
+                    logger.warning("Skipping unreadable picture %s", picture)
+                    failed.append(picture)
+                # the same content fails again, it is not retried
+                variants[picture] = result or dict()
+    document["Variants"] = variants
+    document["Settings"] = current
+    write_manifest(manifest_path, document)
+    return len(todo), failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--root", default="../../front/public")
+    parser.add_argument("--manifest", default="manifest.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true",
+                        help="make all variants again")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    start = perf_counter()
+    processed, failed = ingest(args.root, args.manifest, args.workers,
+                               args.force)
+    print(f"{processed - len(failed)} pictures made into variants, "
+          f"{len(failed)} unreadable, in {perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Logging setup of the server.
+
+Records of the "app" loggers are filtered in the calling thread and put
+into a bounded queue; a QueueListener thread encodes them as JSON lines
+and writes them to a rotating file. A full queue drops records instead
+of blocking the game loop.
+
+Loggers are the categories:
+    app            rooms and lobby
+    app.mechanics  game rules
+    app.frames     every frame received from clients
+    app.updates    every message sent to clients
+Chatty categories are sampled and rate limited by SamplingFilter.
+Call sites pass arguments instead of formatting messages themselves,
+so records below the level cost a level check only.
+"""
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from time import monotonic
+from typing import Dict, Optional, Union
+
+# attributes every LogRecord has, the rest came with extra=
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with extra= fields as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class Rule(object):
+    """Keeps a sample of the records and at most rate of them a second
+    (with bursts up to burst records)."""
+
+    def __init__(self, sample: float = 1.0, rate: Optional[float] = None,
+                 burst: Optional[float] = None) -> None:
+        self.sample = sample
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = monotonic()
+        self.dropped = 0
+
+    def allow(self) -> bool:
+        if self.sample < 1 and random.random() >= self.sample:
+            self.dropped += 1
+            return False
+        if self.rate is None:
+            return True
+        now = monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.dropped += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Applies the Rule of the record's logger or its closest parent.
+    Warnings and errors always pass."""
+
+    def __init__(self, rules: Dict[str, Rule]) -> None:
+        super().__init__()
+        self.rules = rules
+        # logger name -> rule, None if no rule matches
+        self.resolved: Dict[str, Optional[Rule]] = dict()
+
+    def rule(self, name: str) -> Optional[Rule]:
+        if name not in self.resolved:
+            category = name
+            while category not in self.rules and "." in category:
+                category = category.rsplit(".", 1)[0]
+            self.resolved[name] = self.rules.get(category)
+        return self.resolved[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self.rule(record.name)
+        return rule is None or rule.allow()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Counts and drops records when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the message is rendered now, as its arguments may change later,
+        # JSON encoding and writing are left to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def default_rules() -> Dict[str, Rule]:
+    return {
+        "app.frames": Rule(sample=0.01, rate=10),
+        "app.updates": Rule(sample=0.01, rate=10),
+    }
+
+
+def setup(path: str = "app.log", level: Union[int, str] = logging.INFO,
+          max_bytes: int = 10 * 1024 * 1024, backups: int = 5,
+          rules: Optional[Dict[str, Rule]] = None,
+          queue_size: int = 10000) -> QueueListener:
+    """Sends the "app" loggers to a rotating JSON lines file through
+    a background writer. Stop the returned listener to flush it."""
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes,
+                                       backupCount=backups, delay=True)
+    file_handler.setFormatter(JsonFormatter())
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(
+        default_rules() if rules is None else rules))
+    logger = logging.getLogger("app")
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    logger.propagate = False
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+    return listener
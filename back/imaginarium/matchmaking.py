@@ -0,0 +1,50 @@
+"""Directory of rooms waiting for players."""
+from typing import Dict, Optional
+
+
+class OpenRooms(object):
+    """Waiting rooms of the process bucketed by open seats.
+
+    A bucket is an insertion ordered dict used as a set, so adding,
+    moving and removing a room are O(1). The number of buckets is bounded
+    by the largest Game.players_to_start, so finding the fullest room
+    does not depend on the number of rooms.
+    """
+
+    def __init__(self) -> None:
+        # open seats -> game ids, empty buckets are removed
+        self.buckets: Dict[int, Dict[int, None]] = dict()
+        # game_id -> open seats of the indexed rooms
+        self.seats: Dict[int, int] = dict()
+
+    def __len__(self) -> int:
+        return len(self.seats)
+
+    def __contains__(self, game_id: int) -> bool:
+        return game_id in self.seats
+
+    def update(self, game_id: int, seats: int) -> None:
+        """Indexes the room with the given number of open seats,
+        rooms without open seats are removed."""
+        if self.seats.get(game_id) == seats:
+            return
+        self.discard(game_id)
+        if seats <= 0:
+            return
+        self.seats[game_id] = seats
+        self.buckets.setdefault(seats, dict())[game_id] = None
+
+    def discard(self, game_id: int) -> None:
+        seats = self.seats.pop(game_id, None)
+        if seats is None:
+            return
+        bucket = self.buckets[seats]
+        del bucket[game_id]
+        if not bucket:
+            del self.buckets[seats]
+
+    def fullest(self) -> Optional[int]:
+        """The room with the fewest open seats, the oldest of them."""
+        if not self.buckets:
+            return None
+        return next(iter(self.buckets[min(self.buckets)]))
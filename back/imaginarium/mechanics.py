@@ -1,21 +1,40 @@
 from enum import Enum, auto
-from random import shuffle, choice
+import random
+import secrets
 from typing import Any, Dict, List, Optional
 from uuid import uuid1
-from os import listdir, makedirs
-from shutil import copy
-from json import dump as js_dump, load as js_load
+from json import dumps as js_dumps
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
+from functools import wraps
 
+from packs import read_variants, update_store
+
+# configured by logs.setup
 logger = logging.getLogger("app.mechanics")
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler("app.log")
-file_handler.setFormatter(logging.Formatter(
-    "%(filename)s[LINE:%(lineno)-3s]# "
-    "%(levelname)-8s [%(asctime)s]  %(message)s")
-)
-logger.addHandler(file_handler)
+
+
+def mutation(method):
+    """Marks a Game method as changing the room state.
+    Every call moves Game.version forward. Outermost calls are recorded
+    to Game.log, and Game.rng numbers they draw depend only on the game
+    seed and version, so replaying the log repeats the game.
+    Arguments are positional to be recorded."""
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args):
+        if not self._mutating:
+            self.rng.at(self.version)
+            if self.log is not None:
+                self.log.record(name, args)
+        self._mutating += 1
+        try:
+            return method(self, *args)
+        finally:
+            self._mutating -= 1
+            self.version += 1
+    return wrapper
 
 
 class Player:
@@ -27,15 +46,17 @@ class Player:
     fav_packs: [Pack.id]
     current_game: None | game_id
     password_hash: hash
+    token: string # resumes the player's seat after a server restart
     """
 
-    def __init__(self, name: str, password_hash=None) -> None:
-        self.__get_new_id()
+    def __init__(self, name: str, password_hash=None, id=None) -> None:
+        self.__get_new_id(id)
         self.name: str = name
         self.picture: Optional[str] = None
         self.friends: List[int] = []
         self.fav_packs: List[int] = []
         self.current_game: Optional[Game] = None
+        self.token: str = secrets.token_urlsafe(12)
         if password_hash is None:
             self.registered = False
             self.password_hash = None
@@ -45,8 +66,12 @@ class Player:
 
     # TODO add Databases
 
-    def __get_new_id(self):
-        self.id = uuid1().time_low
+    def __get_new_id(self, id):
+        self.id = uuid1().time_low if id is None else id
+
+    def to_dict(self) -> dict:
+        return {"Name": self.name, "Picture": self.picture,
+                "Token": self.token}
 
 
 class Game:
@@ -63,6 +88,9 @@ class Game:
     state: Waiting/Storytelling/Matching/Guessing/Interlude/Victory
     turn: None/Player
     removed_players: [Player]
+    version: int # grows on every state change
+    seed: int # of rng, random numbers of the game
+    log: None | gamelog.GameLog # records mutations
     """
     __game_ids: Dict[int, Any] = {}
 
@@ -78,15 +106,17 @@ class Game:
         IMAGINARIUM = auto()
         DIXIT = auto()
 
-    def __init__(self):
-        self.__get_new_id()
+    def __init__(self, id=None, seed: Optional[int] = None):
+        self.__get_new_id(id)
+        self.seed: int = random.getrandbits(64) if seed is None else seed
+        self.rng = GameRandom(self.seed)
         self.packs = set()
         self.players: List[Player] = []
         self.result = dict()
         self.settings = {
             "win_score": 40,
             "move_time": 60,  # in seconds
-            "rule_set": self.RuleSet.IMAGINARIUM  # only IMAGINARIUM for now
+            "rule_set": self.RuleSet.IMAGINARIUM
         }
         # TODO game should be started by leader of the room
         self.players_to_start = 3
@@ -104,8 +134,15 @@ class Game:
         self.current_table = dict()
         self.removed_players = list()
         self.started: bool = False
-        self._cards: List[Card] = list()
-
+        self.deck = Deck(rng=self.rng)
+        self.version: int = 0
+        # nested mutation calls, only outermost ones are recorded
+        self._mutating = 0
+        self.log = None
+        self._public_version: Optional[int] = None
+        self._public_state: dict = dict()
+
+    @mutation
     def add_player(self, player: Player):
         """Can be called before and in the game
         If game has already started
@@ -125,6 +162,7 @@ class Game:
 
     # Decides if the player could be completely removed
     # or should be just added to the removed_list (and does it)
+    @mutation
     def remove_player(self, player: Player) -> None:
         self.removed_players.append(player)
         self.turn_ended[player] = True
@@ -195,12 +233,15 @@ class Game:
         player.current_game = None
         """
 
+    @mutation
     def start_game(self):
         """Shuffles players, generates card list,
         deals 6 cards to each player.
         """
         self.started = True
         self.turn = 0  # first player is a storyteller now
+        # cards of the previous game left in the deck are not used anymore
+        self._forget_cards(self.deck.returned)
         self._fix_packs()
         self._shuffle_players()
         for player in self.players:
@@ -211,24 +252,31 @@ class Game:
         self.current_player = self.players[self.turn]
         self.state = Game.GamePhase.STORYTELLING
 
+    @mutation
     def start_turn(self, association: str) -> None:
         """Sets association, removes card from active player.
         association: string
         """
-        logger.info(f"Game {self.id} is starting a turn")
-        logger.info(f"Game {self.id} players: {self.players}")
+        logger.info("Game %s is starting a turn", self.id,
+                    extra={"game": self.id, "turn": self.turn})
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Game %s hands", self.id, extra={
+                "game": self.id,
+                "storyteller": self.current_player.name,
+                "lead_card": self.lead_card.id,
+                "hands": {player.name: [card.id for card in hand]
+                          for player, hand in self.hands.items()},
+            })
         self.current_association = association
         for player in self.players:
             self.turn_ended[player] = False
-            logger.info(f"{player.name}'s hands: {self.hands[player]}")
-        logger.info(f"Current player: {self.current_player.name}")
-        logger.info(f"Current lead card: {self.lead_card}")
         self.bets = dict()
         self.current_table = {self.lead_card: self.current_player}
         self.hands[self.current_player].remove(self.lead_card)
         self.turn_ended[self.current_player] = True
         self.state = self.GamePhase.MATCHING  # the next stage is matching
 
+    @mutation
     def place_cards(self) -> None:
         """Removes cards from players and adds them to the current table.
         bets: {Player: Card.id}
@@ -247,11 +295,15 @@ class Game:
 
         self.state = self.GamePhase.GUESSING
 
+    @mutation
     def valuate_guesses(self):
         """Changes score according to guesses.
         guesses: {Player: Card.id}
         """
         self.state = self.GamePhase.INTERLUDE
+        if not self.guesses:
+            # nobody guessed in time, the round is not scored
+            return
         if self.settings["rule_set"] == Game.RuleSet.IMAGINARIUM:
             # everyone guessed leader
             if all(self.lead_card ==
@@ -282,16 +334,48 @@ class Game:
                 card_owner = self.current_table[card]
                 if card_owner in self.players:
                     self.result[card_owner] += 1
+        elif self.settings["rule_set"] == Game.RuleSet.DIXIT:
+            found = [player for player, card in self.guesses.items()
+                     if card == self.lead_card]
+            if len(found) in (0, len(self.guesses)):
+                # the story was too obvious or too obscure
+                for player in self.players:
+                    if player != self.current_player:
+                        self.result[player] += 2
+            else:
+                self.result[self.current_player] += 3
+                for player in found:
+                    self.result[player] += 3
+            for player, card in self.guesses.items():
+                if card == self.lead_card:
+                    continue
+                card_owner = self.current_table[card]
+                if card_owner in self.players:
+                    self.result[card_owner] += 1
 
+    @mutation
     def finish_turn(self, player):
         if (self.state == self.GamePhase.GUESSING and
                 player not in self.guesses):
             return
         self.turn_ended[player] = True
 
+    @mutation
+    def skip_guess(self, player) -> None:
+        """Ends the player's guessing turn without a guess."""
+        if self.state == self.GamePhase.GUESSING:
+            self.turn_ended[player] = True
+
+    @mutation
+    def make_random_bet(self, player) -> None:
+        """Bets a random card for the player who has not chosen one."""
+        if player not in self.bets and self.hands[player]:
+            self.bets[player] = self.rng.choice(self.hands[player])
+
     # Deleting all information about player (except his score) from the game.
+    @mutation
     def purge_player(self, player: Player) -> None:
-        self._cards += self.hands[player]
+        self.deck.put_back(self.hands[player])
         self.hands[player] = []
         if self.started:
             self.result[player] = f"did_not_finish {self.result[player]}"
@@ -314,6 +398,7 @@ class Game:
                 return False
         return True
 
+    @mutation
     def make_bet(self, player: Player, card_id: str):
         # player isn't a storyteller
         card = Card.card_ids[card_id]
@@ -322,6 +407,7 @@ class Game:
         if card in self.hands[player]:
             self.bets[player] = card
 
+    @mutation
     def make_guess(self, player: Player, card_id: str) -> None:
         # player isn't a storyteller
         card = Card.card_ids[card_id]
@@ -329,18 +415,22 @@ class Game:
             return
         if card in self.current_table.keys():
             if self.current_table[card] != player:
-                logger.debug(f"{player.id} choose {card_id}")
+                logger.debug("%s choose %s", player.id, card_id)
                 self.guesses[player] = card
 
+    @mutation
     def add_lead_card(self, card_id: str) -> None:
         self.lead_card = Card.card_ids[card_id]
 
+    @mutation
     def end_turn(self):
         """Ends turn changing game.state, clearing internal variables
         and dealing cards."""
 
         # TODO clearing the removelist (Alice)
         self.purge_removed_players()
+        if not self.players:
+            return  # everybody has left
 
         self.turn = (self.turn + 1) % len(self.players)
 
@@ -349,8 +439,7 @@ class Game:
             self.turn_ended[player] = False
 
         # clear table
-        for card in self.current_table.keys():
-            self._cards.append(card)
+        self.deck.put_back(self.current_table.keys())
         self.current_table = dict()
 
         # deal cards
@@ -372,10 +461,21 @@ class Game:
             return player_with_maximum
         return None
 
+    @mutation
     def end_game(self, player):
         self.state = Game.GamePhase.VICTORY
         self.winner = player
 
+    @mutation
+    def touch(self) -> None:
+        """Marks changes made outside of Game."""
+
+    @mutation
+    def update_player(self, player: Player, name: str,
+                      picture: Optional[str]) -> None:
+        player.name = name
+        player.picture = picture
+
     def get_votes(self, card_id):
         votes = []
         for player, card in self.guesses.items():
@@ -390,26 +490,23 @@ class Game:
         return self.current_player
 
     def get_hand(self, target: Player) -> List[dict]:
-        return [{'ID': str(card.id), 'Owner': None, 'Voters': []} for card in self.hands[target]]
+        return [card_view(card) for card in self.hands[target]]
 
     def _fix_packs(self) -> None:
         """Fixes packs choice.
-        Transforms packs to cards and shuffles them."""
-        logger.debug(list(Pack.pack_ids.values()))
-        pack = choice(list(Pack.pack_ids.values()))
-        self._cards = [Card(image, pack.id) for image in pack.pictures]
-        shuffle(self._cards)
+        Cards are made from the pack when dealt."""
+        pack = self.rng.choice(list(Pack.pack_ids.values()))
+        self.deck = Deck(pack, self.rng)
 
     def _shuffle_players(self):
         """Shuffles players order.
         New players are appended to the end"""
-        shuffle(self.players)
+        self.rng.shuffle(self.players)
 
     def _deal_hand(self, target):
         """Fills hand until it's full."""
         needed = 6 - len(self.hands[target])
-        self.hands[target] += self._cards[:needed]
-        self._cards = self._cards[needed:]
+        self.hands[target] += self.deck.deal(needed)
 
     def make_example_player(self, player):
         to_return = dict()
@@ -423,62 +520,250 @@ class Game:
         to_return["MoveAvailable"] = not self.turn_ended[player]
         return to_return
 
+    def make_public_state(self) -> dict:
+        """Part of the room state which is the same for every player.
+        Built once per version and shared between all players' states,
+        so its dicts must not be changed.
+        """
+        if self._public_version == self.version:
+            return self._public_state
+        views = {player: self.make_example_player(player)
+                 for player in self.players}
+        votes = defaultdict(list)
+        for player, card in self.guesses.items():
+            votes[card].append(views.get(player) or
+                               self.make_example_player(player))
+        cards = []
+        owned = dict()
+        for card, owner in self.current_table.items():
+            if self.state == self.GamePhase.INTERLUDE:
+                owner_view = views.get(owner) or \
+                    self.make_example_player(owner)
+                cards.append(card_view(card, owner_view, votes[card]))
+            else:
+                cards.append(card_view(card))
+            if self.state == self.GamePhase.GUESSING:
+                # owner sees his own card opened
+                owned[owner] = (len(cards) - 1, card_view(
+                    card,
+                    views.get(owner) or self.make_example_player(owner),
+                    votes[card]
+                ))
+        self._public_state = {
+            "Players": views,
+            "Cards": cards,
+            "Owned": owned,
+            "Story": self.current_association,
+            "Phase": self.state.name.capitalize(),
+            "ID": str(self.id),
+            "Json": None
+        }
+        self._public_version = self.version
+        return self._public_state
+
+    def _selected_card(self, player) -> Optional[str]:
+        if self.state == self.GamePhase.MATCHING and player in self.bets:
+            return str(self.bets[player].id)
+        if self.state == self.GamePhase.GUESSING and player in self.guesses:
+            return str(self.guesses[player].id)
+        return None
+
+    def _table_cards(self, public: dict, player, cards: list) -> list:
+        if player in public["Owned"]:
+            index, card = public["Owned"][player]
+            cards = list(cards)
+            cards[index] = card
+        return cards
+
     def make_current_game_state(self, player):
+        public = self.make_public_state()
+        views = public["Players"]
         to_return = dict()
-        to_return["Client"] = self.make_example_player(player)
-        opponents = []
-        for other_player in self.players:
-            if other_player != player:
-                opponents.append(self.make_example_player(other_player))
-        to_return["Opponents"] = opponents
-        player_hand = dict()
-        hand = self.get_hand(player)
-        player_hand["Cards"] = hand
-        if self.state == self.GamePhase.MATCHING:
-            if player in self.bets:
-                player_hand["SelectedCard"] = str(self.bets[player].id)
-            else:
-                player_hand["SelectedCard"] = None
-        elif self.state == self.GamePhase.GUESSING:
-            if player in self.guesses:
-                player_hand["SelectedCard"] = str(self.guesses[player].id)
-            else:
-                player_hand["SelectedCard"] = None
-        else:
-            player_hand["SelectedCard"] = None
-        to_return["Hand"] = player_hand
-        table = dict()
-        cards_on_table = []
-        for card, other_player in self.current_table.items():
-            request = {"ID": card.id, "Owner": None, "Voters": []}
-            if (self.state == self.GamePhase.GUESSING and other_player ==
-                    player) or self.state == self.GamePhase.INTERLUDE:
-                request["Owner"] = self.make_example_player(player)
-                request["Voters"] = self.get_votes(card)
-            cards_on_table.append(request)
-
-        table["Cards"] = cards_on_table
-        table["Story"] = self.current_association
-        to_return["Table"] = table
-        if self.state == self.GamePhase.STORYTELLING:
-            to_return["Phase"] = "Storytelling"
-        if self.state == self.GamePhase.WAITING:
-            to_return["Phase"] = "Waiting"
-        if self.state == self.GamePhase.MATCHING:
-            to_return["Phase"] = "Matching"
-        if self.state == self.GamePhase.INTERLUDE:
-            to_return["Phase"] = "Interlude"
-        if self.state == self.GamePhase.GUESSING:
-            to_return["Phase"] = "Guessing"
-        if self.state == self.GamePhase.VICTORY:
-            to_return["Phase"] = "Victory"
-        to_return['ID'] = str(self.id)
-        # print(to_return)
+        to_return["Client"] = views.get(player) or \
+            self.make_example_player(player)
+        to_return["Opponents"] = [
+            views[other_player] for other_player in self.players
+            if other_player != player
+        ]
+        to_return["Hand"] = {
+            "Cards": self.get_hand(player),
+            "SelectedCard": self._selected_card(player)
+        }
+        to_return["Table"] = {
+            "Cards": self._table_cards(public, player, public["Cards"]),
+            "Story": public["Story"]
+        }
+        to_return["Phase"] = public["Phase"]
+        to_return["ID"] = public["ID"]
         return to_return
 
+    def encode_current_game_state(self, player) -> str:
+        """JSON of make_current_game_state(player).
+        Public parts are encoded once per version."""
+        public = self.make_public_state()
+        if public["Json"] is None:
+            owned = public["Owned"]
+            public["Json"] = {
+                "Players": {player: js_dumps(view)
+                            for player, view in public["Players"].items()},
+                "Cards": [js_dumps(card) for card in public["Cards"]],
+                "Owned": {player: (index, js_dumps(card))
+                          for player, (index, card) in owned.items()},
+                "Story": js_dumps(public["Story"]),
+                "Phase": js_dumps(public["Phase"]),
+                "ID": js_dumps(public["ID"])
+            }
+        encoded = public["Json"]
+        views = encoded["Players"]
+        client = views.get(player) or \
+            js_dumps(self.make_example_player(player))
+        opponents = ", ".join(
+            views[other_player] for other_player in self.players
+            if other_player != player
+        )
+        hand = js_dumps({
+            "Cards": self.get_hand(player),
+            "SelectedCard": self._selected_card(player)
+        })
+        cards = ", ".join(self._table_cards(encoded, player, encoded["Cards"]))
+        return (
+            f'{{"Client": {client}, "Opponents": [{opponents}], '
+            f'"Hand": {hand}, '
+            f'"Table": {{"Cards": [{cards}], "Story": {encoded["Story"]}}}, '
+            f'"Phase": {encoded["Phase"]}, "ID": {encoded["ID"]}}}'
+        )
+
+    def to_dict(self) -> dict:
+        """Compact JSON-compatible representation of the game.
+        Players are referenced by id, cards by id."""
+        known = list(self.players)
+        for player in self.result:
+            if player not in known:
+                known.append(player)
+        cards = self._all_cards()
+        lead_card = getattr(self, "lead_card", None)
+        winner = getattr(self, "winner", None)
+        current_player = self.current_player
+        return {
+            "ID": self.id,
+            "Version": self.version,
+            "Seed": self.seed,
+            "Known": {str(player.id): player.to_dict() for player in known},
+            "Cards": {card.id: [card.picture, card.pack_id] for card in cards},
+            "Players": [player.id for player in self.players],
+            "Removed": [player.id for player in self.removed_players],
+            "Result": {str(player.id): score
+                       for player, score in self.result.items()},
+            "TurnEnded": {str(player.id): ended
+                          for player, ended in self.turn_ended.items()},
+            "Hands": {str(player.id): [card.id for card in hand]
+                      for player, hand in self.hands.items() if hand},
+            "Bets": {str(player.id): card.id
+                     for player, card in self.bets.items()},
+            "Guesses": {str(player.id): card.id
+                        for player, card in self.guesses.items()},
+            "Table": [[card.id, player.id]
+                      for card, player in self.current_table.items()],
+            "Deck": self.deck.to_dict(),
+            "Settings": dict(self.settings,
+                             rule_set=self.settings["rule_set"].name),
+            "ToStart": self.players_to_start,
+            "State": self.state.name,
+            "Association": self.current_association,
+            "Turn": self.turn,
+            "Current": current_player.id if current_player else None,
+            "Lead": lead_card.id if lead_card else None,
+            "Winner": winner.id if winner else None,
+            "Started": self.started,
+        }
+
+    def _all_cards(self) -> List['Card']:
+        """Dealt cards which are in the game."""
+        cards = list(self.deck.returned)
+        for hand in self.hands.values():
+            cards += hand
+        cards += self.current_table.keys()
+        return cards
+
+    @staticmethod
+    def _forget_cards(cards) -> None:
+        for card in cards:
+            Card.card_ids.pop(card.id, None)
+
+    def release_cards(self) -> None:
+        """Forgets the cards of a game which is not played anymore."""
+        self._forget_cards(self._all_cards())
+
+    def load_dict(self, data: dict) -> None:
+        """Replaces the game state with one made by to_dict.
+        Player and Card objects with known ids are reused."""
+        players = {str(player.id): player for player in self.result}
+        for player in self.players:
+            players[str(player.id)] = player
+        for key, info in data["Known"].items():
+            if key not in players:
+                players[key] = Player(info["Name"], id=int(key))
+            players[key].name = info["Name"]
+            players[key].picture = info["Picture"]
+            players[key].token = info["Token"]
+        cards = dict()
+        for card_id, (picture, pack_id) in data["Cards"].items():
+            cards[card_id] = Card.card_ids.get(card_id) or \
+                Card(picture, pack_id, card_id)
+
+        def player_by(key):
+            return None if key is None else players[str(key)]
+
+        def card_by(key):
+            return None if key is None else cards[key]
+
+        self.players = [player_by(key) for key in data["Players"]]
+        for player in self.players:
+            player.current_game = self
+        self.removed_players = [player_by(key) for key in data["Removed"]]
+        self.result = {players[key]: score
+                       for key, score in data["Result"].items()}
+        self.turn_ended = {players[key]: ended
+                           for key, ended in data["TurnEnded"].items()}
+        self.hands = defaultdict(list)
+        for key, hand in data["Hands"].items():
+            self.hands[players[key]] = [cards[card] for card in hand]
+        self.bets = {players[key]: cards[card]
+                     for key, card in data["Bets"].items()}
+        self.guesses = {players[key]: cards[card]
+                        for key, card in data["Guesses"].items()}
+        self.current_table = {cards[card]: player_by(key)
+                              for card, key in data["Table"]}
+        self.seed = data["Seed"]
+        self.rng = GameRandom(self.seed)
+        self.deck = Deck.from_dict(data["Deck"], cards, self.rng)
+        self.settings = dict(
+            data["Settings"],
+            rule_set=Game.RuleSet[data["Settings"]["rule_set"]]
+        )
+        self.players_to_start = data["ToStart"]
+        self.state = Game.GamePhase[data["State"]]
+        self.current_association = data["Association"]
+        self.turn = data["Turn"]
+        self.current_player = player_by(data["Current"])
+        self.lead_card = card_by(data["Lead"])
+        self.winner = player_by(data["Winner"])
+        self.started = data["Started"]
+        self.version = data["Version"]
+        # the same version may mean another state after a reload
+        self._public_version = None
+        if self.log is not None:
+            self.log.snapshot()
+
+    @staticmethod
+    def from_dict(data: dict):
+        game = Game(data["ID"])
+        game.load_dict(data)
+        return game
+
     # TODO add Database
-    def __get_new_id(self):
-        self.id = uuid1().time_low
+    def __get_new_id(self, id):
+        self.id = uuid1().time_low if id is None else id
         Game.__game_ids[self.id] = self
 
     @staticmethod
@@ -489,6 +774,10 @@ class Game:
     def delete_game(id):
         Game.__game_ids.pop(id)
 
+    @staticmethod
+    def count_games() -> int:
+        return len(Game.__game_ids)
+
 
 class Card:
     """id: Card.id
@@ -510,44 +799,133 @@ class Card:
         Card.card_ids[self.id] = self
 
 
+def card_view(card: Card, owner: Optional[dict] = None,
+              voters: Optional[list] = None) -> dict:
+    """Card as clients see it. Picture is the file in the picture store,
+    Thumb and Full are its variants (format -> file) for the hand and
+    the table, None until ingest.py has made them."""
+    pack = Pack.pack_ids.get(card.pack_id)
+    variants = pack.variants.get(card.picture, {}) if pack else {}
+    return {"ID": str(card.id), "Owner": owner,
+            "Voters": [] if voters is None else voters,
+            "Picture": card.picture, "Thumb": variants.get("thumb"),
+            "Full": variants.get("full")}
+
+
+class GameRandom(random.Random):
+    """Random numbers of a game, a function of its seed and version.
+
+    Game mutations call at(version), the generator is reseeded from the
+    seed and the version before the first number drawn after that, so
+    mutations which draw nothing do not pay for reseeding.
+    """
+
+    def __init__(self, seed: int) -> None:
+        self.game_seed = seed
+        # version to reseed with before the next number, None if seeded
+        self.version: Optional[int] = None
+        super().__init__(seed)
+
+    def at(self, version: int) -> None:
+        self.version = version
+
+    def _reseed(self) -> None:
+        super().seed((self.game_seed << 32) + self.version)
+        self.version = None
+
+    def random(self) -> float:
+        if self.version is not None:
+            self._reseed()
+        return super().random()
+
+    def getrandbits(self, k: int) -> int:
+        if self.version is not None:
+            self._reseed()
+        return super().getrandbits(k)
+
+
+class Deck:
+    """Shuffled pack, dealt lazily.
+
+    Keeps a lazy Fisher-Yates permutation of the pack pictures: only
+    swapped positions are stored and Card objects are made when dealt.
+    Cards put back are dealt after the rest of the pack.
+    """
+
+    def __init__(self, pack=None, rng=random) -> None:
+        self.pack: Optional[Pack] = pack
+        self.rng = rng
+        # pictures not dealt yet are pack.pictures[swaps.get(i, i)]
+        # for i < remaining
+        self.remaining: int = len(pack.pictures) if pack is not None else 0
+        self.swaps: Dict[int, int] = dict()
+        self.returned = deque()
+
+    def __len__(self) -> int:
+        return self.remaining + len(self.returned)
+
+    def draw(self) -> Optional[Card]:
+        if self.remaining:
+            last = self.remaining - 1
+            index = self.rng.randrange(self.remaining)
+            picture = self.swaps.get(index, index)
+            if index != last:
+                self.swaps[index] = self.swaps.pop(last, last)
+            else:
+                self.swaps.pop(last, None)
+            self.remaining = last
+            return Card(self.pack.pictures[picture], self.pack.id)
+        if self.returned:
+            return self.returned.popleft()
+        return None
+
+    def deal(self, count: int) -> List[Card]:
+        cards = []
+        for _ in range(min(count, len(self))):
+            cards.append(self.draw())
+        return cards
+
+    def put_back(self, cards) -> None:
+        self.returned.extend(cards)
+
+    def to_dict(self) -> dict:
+        return {
+            "Pack": self.pack.id if self.pack is not None else None,
+            "Remaining": self.remaining,
+            "Swaps": list(self.swaps.items()),
+            "Returned": [card.id for card in self.returned],
+        }
+
+    @staticmethod
+    def from_dict(data: dict, cards: Dict[str, Card], rng=random):
+        """Restores a deck made by to_dict, cards: id -> Card."""
+        deck = Deck(rng=rng)
+        if data["Pack"] is not None:
+            deck.pack = Pack.pack_ids[data["Pack"]]
+        deck.remaining = data["Remaining"]
+        deck.swaps = {index: picture for index, picture in data["Swaps"]}
+        deck.returned = deque(cards[card] for card in data["Returned"])
+        return deck
+
+
 class Pack:
+    """variants: picture -> variant -> format -> file, see ingest.py"""
     pack_ids: Dict[str, Any] = dict()
 
-    def __init__(self, name, images=None):
+    def __init__(self, name, images=None, variants=None):
         if images is None:
             images = []
         self.id = name
         Pack.pack_ids[self.id] = self
         self.pictures = images
+        self.variants = variants if variants is not None else dict()
 
 
-def load_packs():
-    try:
-        with open('packs.json', 'r') as read_file:
-            data = js_load(read_file)
-            for name, images in data.items():
-                Pack(name, images)
-    except FileNotFoundError:
-        pass
-    cd = '../../front/public'
-    packs_name = listdir(cd)
-    if 'img' in packs_name:
-        packs_name.remove('img')
-    else:
-        makedirs(f'{cd}/img')
-    if len(packs_name) > 0:
-        for name in packs_name:
-            if name in Pack.pack_ids:
-                continue
-            images = listdir(f'{cd}/{name}')
-            Pack(name, images)
-            for image in images:
-                copy(f'{cd}/{name}/{image}', f'{cd}/img')
-    with open('packs.json', 'w') as write_file:
-        data = {}
-        for name, pack in Pack.pack_ids.items():
-            data[name] = pack.pictures
-        js_dump(data, write_file)
-
-
-load_packs()
+def load_packs(root: str = "../../front/public",
+               manifest_path: str = "manifest.json"):
+    """Registers the packs of the front-end directory, see packs.py.
+    Called by server.py, importing this module does not touch the disk."""
+    variants = read_variants(manifest_path)
+    for name, pictures in update_store(root, manifest_path).items():
+        Pack(name, pictures, {picture: variants[picture]
+                              for picture in pictures if variants.get(picture)})
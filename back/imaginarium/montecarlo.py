@@ -0,0 +1,244 @@
+"""Batched Monte Carlo simulation of whole games for rule balancing.
+
+python montecarlo.py [--games 1000000] [--players 4] [--win-score 40]
+                     [--rules IMAGINARIUM|DIXIT] [--seed 0] [--check 200]
+
+Plays games with the random policy of tests.play_until_phase: every
+listener bets some card and guesses a random card of the table, a guess
+of their own card is rejected by Game.make_guess. Under this policy
+cards are interchangeable, so a card on the table is represented by its
+owner and a round of N games is a pair of (players, N) arrays: scores
+and guessed owners. Scoring follows Game.valuate_guesses.
+
+--check replays seeded games through Game and compares the scores after
+every round with the simulated ones.
+"""
+import argparse
+from dataclasses import dataclass
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+IMAGINARIUM = "IMAGINARIUM"
+DIXIT = "DIXIT"
+
+
+@dataclass
+class Simulation:
+    # rounds played in every game
+    rounds: np.ndarray
+    # final scores, (games, players)
+    scores: np.ndarray
+    # index of the winner, the first player with the best score
+    winners: np.ndarray
+    # (games still playing, their guessed owners, their scores after
+    # the round) for every round, kept only with trace=True;
+    # arrays are (players, games still playing)
+    trace: Optional[List[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = None
+
+
+def score_round(scores: np.ndarray, storyteller: int, guesses: np.ndarray,
+                rule_set: str = IMAGINARIUM) -> None:
+    """Scores one round of every game in place.
+    Arrays are (players, games): guesses[i, g] is the owner of the card
+    guessed by player i in game g. The storyteller's guesses and guesses
+    of own cards are ignored, as Game.make_guess rejects them.
+    Players are few, so the loops are over players and every operation
+    is a whole row of games."""
+    players, games = scores.shape
+    guessed = np.zeros(games, dtype=np.int8)
+    right = np.zeros(games, dtype=np.int8)
+    # votes[k]: wrong guesses of the card of player k
+    votes = np.zeros((players, games), dtype=np.int8)
+    found = np.zeros((players, games), dtype=bool)
+    for i in range(players):
+        if i == storyteller:
+            continue
+        guess = guesses[i]
+        guessed += guess != i
+        np.equal(guess, storyteller, out=found[i])
+        right += found[i]
+        for k in range(players):
+            if k != i and k != storyteller:
+                votes[k] += guess == k
+    scored = guessed > 0
+    everyone = scored & (right == guessed)
+    nobody = scored & (right == 0)
+    some = scored & ~everyone & ~nobody
+
+    lead = scores[storyteller]
+    if rule_set == IMAGINARIUM:
+        lead -= 3 * everyone + 2 * nobody
+        np.maximum(lead, 0, out=lead)
+        lead += some * (3 + right)
+        scores += 3 * (found & some)
+        # nobody gets votes when everyone found the storyteller's card
+        scores += votes * (scored & ~everyone)
+    elif rule_set == DIXIT:
+        bonus = 2 * (everyone | nobody)
+        for i in range(players):
+            if i != storyteller:
+                scores[i] += bonus
+        lead += 3 * some
+        scores += 3 * (found & some)
+        scores += votes
+    else:
+        raise ValueError(f"Unknown rule set {rule_set}")
+
+
+def simulate(games: int, players: int = 4, win_score: int = 40,
+             rule_set: str = IMAGINARIUM,
+             rng: Optional[np.random.Generator] = None,
+             max_rounds: int = 10000, trace: bool = False) -> Simulation:
+    """Plays games until somebody reaches win_score after a round."""
+    if rng is None:
+        rng = np.random.default_rng()
+    final = np.zeros((games, players), dtype=np.int16)
+    rounds = np.full(games, max_rounds, dtype=np.int32)
+    # indices and scores of the games still playing
+    active = np.arange(games)
+    scores = np.zeros((players, games), dtype=np.int16)
+    history = [] if trace else None
+    for turn in range(max_rounds):
+        if not len(active):
+            break
+        guesses = rng.integers(0, players, size=(players, len(active)),
+                               dtype=np.int8)
+        # every game starts with the first player telling the story
+        score_round(scores, turn % players, guesses, rule_set)
+        if trace:
+            history.append((active, guesses, scores.copy()))
+        finished = scores.max(axis=0) >= win_score
+        if finished.any():
+            final[active[finished]] = scores[:, finished].T
+            rounds[active[finished]] = turn + 1
+            active = active[~finished]
+            scores = scores[:, ~finished]
+    final[active] = scores.T
+    return Simulation(rounds, final, final.argmax(axis=1), history)
+
+
+def replay(simulation: Simulation, game_index: int,
+           win_score: int = 40,
+           rule_set: str = IMAGINARIUM) -> Optional[str]:
+    """Plays a traced simulated game through Game.
+    Returns the description of the first difference or None."""
+    from mechanics import Game, Player
+
+    players = simulation.scores.shape[1]
+    game = Game()
+    game.settings["win_score"] = win_score
+    game.settings["rule_set"] = Game.RuleSet[rule_set]
+    for i in range(players):
+        game.add_player(Player(str(i)))
+    game.start_game()
+    # simulated player i is the i-th in the turn order
+    seats = list(game.players)
+    try:
+        for turn, (active, guesses, scores) in enumerate(simulation.trace):
+            row = np.searchsorted(active, game_index)
+            if row == len(active) or active[row] != game_index:
+                return f"game {game_index} did not finish in Game"
+            storyteller = game.get_cur_player()
+            game.add_lead_card(game.hands[storyteller][0].id)
+            game.start_turn("story")
+            for player in seats:
+                game.make_bet(player, game.hands[player][0].id)
+            game.place_cards()
+            cards = {owner: card
+                     for card, owner in game.current_table.items()}
+            for i, player in enumerate(seats):
+                if player is not storyteller:
+                    owner = seats[guesses[i, row]]
+                    game.make_guess(player, cards[owner].id)
+            game.valuate_guesses()
+            result = [game.result[player] for player in seats]
+            if result != scores[:, row].tolist():
+                return (f"game {game_index} round {turn + 1}: Game scores "
+                        f"{result}, simulated {scores[:, row].tolist()}")
+            winner = game.finished()
+            if winner is not None:
+                if turn + 1 != simulation.rounds[game_index]:
+                    return (f"game {game_index} finished in Game "
+                            f"after {turn + 1} rounds")
+                if seats.index(winner) != simulation.winners[game_index]:
+                    return f"game {game_index}: winners differ"
+                return None
+            game.end_turn()
+    finally:
+        game.release_cards()
+        Game.delete_game(game.id)
+    return f"game {game_index} did not finish in the simulation"
+
+
+def cross_check(games: int, players: int = 4, win_score: int = 40,
+                rule_set: str = IMAGINARIUM, seed: int = 0) -> List[str]:
+    """Differences between Game and the simulation on seeded games."""
+    simulation = simulate(games, players, win_score, rule_set,
+                          np.random.default_rng(seed), trace=True)
+    differences = []
+    for game_index in range(games):
+        difference = replay(simulation, game_index, win_score, rule_set)
+        if difference is not None:
+            differences.append(difference)
+    return differences
+
+
+def report(simulation: Simulation) -> None:
+    rounds = simulation.rounds
+    scores = simulation.scores
+    best = scores.max(axis=1)
+    ranked = np.sort(scores, axis=1)
+    cuts = np.percentile(rounds, [5, 50, 95, 99])
+    print(f"rounds: mean={rounds.mean():.2f} min={rounds.min()} "
+          f"p5={cuts[0]:.0f} p50={cuts[1]:.0f} p95={cuts[2]:.0f} "
+          f"p99={cuts[3]:.0f} max={rounds.max()}")
+    print(f"winner score: mean={best.mean():.2f} max={best.max()}")
+    print("final scores by rank: " + ", ".join(
+        f"{rank + 1}: {ranked[:, -1 - rank].mean():.2f}"
+        for rank in range(scores.shape[1])))
+    wins = np.bincount(simulation.winners, minlength=scores.shape[1])
+    print("wins by seat: " + ", ".join(
+        f"{seat + 1}: {share:.3f}"
+        for seat, share in enumerate(wins / len(rounds))))
+    ties = (scores == best[:, None]).sum(axis=1) > 1
+    print(f"tied for the win: {ties.mean():.4f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--games", type=int, default=1000000)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--win-score", type=int, default=40)
+    parser.add_argument("--rules", choices=[IMAGINARIUM, DIXIT],
+                        default=IMAGINARIUM)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--check", type=int, default=0,
+                        help="games to replay through Game first")
+    args = parser.parse_args()
+
+    if args.check:
+        from mechanics import Pack
+
+        Pack.pack_ids.clear()
+        Pack("montecarlo", [f"{i}.jpg" for i in range(1000)])
+        differences = cross_check(args.check, args.players, args.win_score,
+                                  args.rules, 0 if args.seed is None
+                                  else args.seed)
+        for difference in differences:
+            print(difference)
+        print(f"check: {args.check - len(differences)}/{args.check} "
+              f"games match Game")
+
+    start = perf_counter()
+    simulation = simulate(args.games, args.players, args.win_score,
+                          args.rules, np.random.default_rng(args.seed))
+    elapsed = perf_counter() - start
+    print(f"{args.games} games of {args.players} players, {args.rules}, "
+          f"win score {args.win_score} in {elapsed:.2f} s")
+    report(simulation)
+
+
+if __name__ == "__main__":
+    main()
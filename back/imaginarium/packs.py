@@ -0,0 +1,142 @@
+"""Picture packs of the front-end and their content-addressed store.
+
+Every directory of front/public but img is a pack. A picture is stored
+once as img/<content hash><extension>, hard-linked to its pack file or
+copied where links are not possible, and pack pictures are these names,
+so the same image in several packs takes the disk once.
+
+manifest.json keeps the size, mtime and stored name of every pack file.
+A startup lists the pack directories and hashes, links or unlinks only
+the files added, changed or removed since the manifest was written.
+Card-sized variants of the stored pictures are made offline by
+ingest.py and listed in the manifest too, see read_variants.
+"""
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+STORE = "img"
+# pack/file -> [size, mtime_ns, stored name]
+Manifest = Dict[str, list]
+# stored name -> variant -> format -> file in the store
+Variants = Dict[str, Dict[str, Dict[str, str]]]
+
+
+def scan(root: str) -> Dict[str, Tuple[int, int]]:
+    """pack/file -> (size, mtime_ns) of every pack file."""
+    files = dict()
+    with os.scandir(root) as packs:
+        for pack in packs:
+            if pack.name == STORE or not pack.is_dir():
+                continue
+            with os.scandir(pack.path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files[f"{pack.name}/{entry.name}"] = (
+                            stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def content_digest():
+    """Hash of the stored names, also used by the picture downloader."""
+    return hashlib.blake2b(digest_size=16)
+
+
+def content_name(path: str) -> str:
+    """Name of the file in the store: hash of the content and the
+    original extension."""
+    digest = content_digest()
+    with open(path, "rb") as file:
+        # hashlib releases the GIL on large chunks, threads hash in parallel
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest() + os.path.splitext(path)[1].lower()
+
+
+def link(source: str, target: str) -> None:
+    """Puts the file into the store unless it is already there."""
+    if os.path.exists(target):
+        return
+    try:
+        os.link(source, target)
+    except OSError:
+        # another file system or no hard links there
+        shutil.copyfile(source, target)
+
+
+def read_manifest(path: str) -> dict:
+    """The whole manifest: "Files" is a Manifest, "Variants" Variants
+    and "Settings" the ingest.py settings they were made with."""
+    try:
+        with open(path) as file:
+            document = json.load(file)
+    except (OSError, ValueError):
+        document = dict()
+    if not isinstance(document, dict):
+        document = dict()
+    document.setdefault("Files", dict())
+    return document
+
+
+def write_manifest(path: str, document: dict) -> None:
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        json.dump(document, file, separators=(",", ":"), sort_keys=True)
+    os.replace(temporary, path)
+
+
+def read_variants(manifest_path: str = "manifest.json") -> Variants:
+    return read_manifest(manifest_path).get("Variants", dict())
+
+
+def update_store(root: str = "../../front/public",
+                 manifest_path: str = "manifest.json",
+                 workers: Optional[int] = None) -> Dict[str, List[str]]:
+    """Brings the store and the manifest up to date with the packs.
+    Returns pack name -> stored names of its pictures."""
+    store = os.path.join(root, STORE)
+    os.makedirs(store, exist_ok=True)
+    document = read_manifest(manifest_path)
+    manifest: Manifest = document["Files"]
+    files = scan(root)
+    changed = [key for key, (size, mtime) in files.items()
+               if manifest.get(key, [None, None])[:2] != [size, mtime]]
+    removed = [key for key in manifest if key not in files]
+    # stored names the changed and removed files had
+    stale = {manifest[key][2] for key in changed + removed
+             if key in manifest}
+    for key in removed:
+        del manifest[key]
+    if changed:
+        paths = [os.path.join(root, key) for key in changed]
+        with ThreadPoolExecutor(workers) as pool:
+            names = list(pool.map(content_name, paths))
+        for key, name in zip(changed, names):
+            manifest[key] = [*files[key], name]
+    # a file changed in place has changed its hard link in the store too,
+    # so stale names are linked again from a file which still has them
+    if stale:
+        sources = {entry[2]: key for key, entry in manifest.items()
+                   if entry[2] in stale}
+    for name in stale:
+        try:
+            os.remove(os.path.join(store, name))
+        except FileNotFoundError:
+            pass
+        if name in sources:
+            link(os.path.join(root, sources[name]), os.path.join(store, name))
+    for key in changed:
+        link(os.path.join(root, key), os.path.join(store, manifest[key][2]))
+    if changed or removed:
+        write_manifest(manifest_path, document)
+
+    # dicts drop copies of a picture in a pack, keeping the order
+    packs: Dict[str, Dict[str, None]] = dict()
+    for key in sorted(manifest):
+        pack = key.split("/", 1)[0]
+        packs.setdefault(pack, dict())[manifest[key][2]] = None
+    return {name: list(pictures) for name, pictures in packs.items()}
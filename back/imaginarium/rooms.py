@@ -0,0 +1,828 @@
+"""Rooms and lobby logic shared by all server transports.
+
+A transport (see server.py) calls connect, handle_message and disconnect
+for every client connection and provides the Transport used for
+deferred work.
+"""
+import logging
+import json
+import os
+from functools import wraps
+from mechanics import Player, Game, Card
+from memory import deep_sizeof
+from browser import RoomFeed
+from delta import DeltaStream
+from fanout import Fanout
+from gamelog import GameLog
+from matchmaking import OpenRooms
+from scheduler import RoomScheduler
+from snapshots import Snapshots
+from timing import TimingWheel
+from store import GameStore, VersionConflict
+from transport import Connection, Transport
+from typing import Any, Dict, Optional, Union, List
+
+
+class Lobby(object):
+    """Interface for registering and updating WebSocket clients."""
+
+    def __init__(self, transport: Optional[Transport] = None,
+                 store: Optional[GameStore] = None):
+        # game_id -> GameBackend
+        self.backends: Dict[int, GameBackend] = dict()
+        self.clients = list()
+        self.transport = transport
+        # shared with other server processes, None keeps games local
+        self.store: Optional[GameStore] = store
+        # announces room changes to other server processes
+        self.fanout: Optional[Fanout] = None
+        # local rooms waiting for players, for QuickJoin
+        self.open_rooms = OpenRooms()
+        # local room list for lobby clients
+        self.feed = RoomFeed()
+        # directory of <game id>.jsonl event logs, None keeps no logs
+        self.game_logs: Optional[str] = None
+        # crash-safe copies of local rooms, None keeps no copies
+        self.snapshots: Optional[Snapshots] = None
+        # Player.token -> restored room the player has not resumed yet
+        self.absent: Dict[str, GameBackend] = dict()
+
+    @property
+    def transport(self) -> Optional[Transport]:
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport: Optional[Transport]) -> None:
+        self._transport = transport
+        # all room deadlines of the process
+        self.wheel = TimingWheel(transport)
+
+    def get_backend(self, game_id: int) -> Optional["GameBackend"]:
+        """Local backend of the game, loaded from the store if needed."""
+        game_backend = self.backends.get(game_id)
+        if game_backend is None and self.store is not None:
+            stored = self.store.load(game_id)
+            if stored is not None:
+                game_backend = GameBackend(Game.from_dict(stored[1]))
+                game_backend.stored_version = stored[0]
+                self.backends[game_id] = game_backend
+                game_backend.index()
+        return game_backend
+
+    def register(self, ws: Connection) -> None:
+        """Register a WebSocket connection for updates."""
+        self.clients.append(ws)
+
+    def unregister(self, ws: Connection) -> None:
+        """Unregister a WebSocket connection"""
+        if ws in self.clients:
+            self.clients.remove(ws)
+        self.feed.unwatch(ws)
+
+    def awaits(self, game_backend: "GameBackend") -> bool:
+        """Whether some players of the restored room have not resumed.
+        Until they do, or the room is closed as idle, it is kept."""
+        return any(absent is game_backend for absent in self.absent.values())
+
+    def room_changed(self, game_id: int, summary: Optional[dict]) -> None:
+        """Queues the room for the next RoomListPatch, None removes it."""
+        if self.feed.mark(game_id, summary):
+            self.transport.call_later(self.feed.interval, self.flush_feed)
+
+    def snapshot_changed(self, game_id: int, game: Optional[Game]) -> None:
+        """Queues the game for the next snapshot, None deletes it."""
+        if self.snapshots is not None and self.snapshots.mark(game_id, game):
+            self.transport.call_later(self.snapshots.interval,
+                                      self.write_snapshots)
+
+    def write_snapshots(self) -> None:
+        batch = self.snapshots.collect()
+        if batch is None:
+            # the previous batch is still being written
+            self.transport.call_later(self.snapshots.interval,
+                                      self.write_snapshots)
+        elif batch:
+            self.transport.run_in_thread(self.snapshots.write, batch)
+
+    def flush_feed(self) -> None:
+        # encoded once, the same string goes to every watcher
+        data = self.feed.flush()
+        if data is None:
+            return
+        for ws in list(self.feed.watchers):
+            self.send(ws, data)
+
+    @staticmethod
+    def process_message(ws: Connection, message: List) -> None:
+        """Process a message from a client"""
+        if message[0] == "JoinRoom":
+            if message[1] == "":
+                create_room(ws)
+                return
+            game_backend = main_lobby.get_backend(int(message[1]))
+            if game_backend is None:
+                fail_connect(ws)
+                return
+            game_backend.transact(game_backend.join, ws)
+        elif message[0] == "QuickJoin":
+            quick_join(ws)
+        elif message[0] == "Resume":
+            resume(ws, str(message[1]))
+        elif message[0] == "WatchRooms":
+            if ws in main_lobby.clients:
+                main_lobby.send(ws, main_lobby.feed.watch(ws))
+        elif message[0] == "UnwatchRooms":
+            main_lobby.feed.unwatch(ws)
+
+    def send(self, ws: Connection, data: str) -> None:
+        """Send given data to the registered client.
+        Automatically discards invalid connections."""
+        try:
+            ws.send(data)
+        except Exception:
+            logger.info('Player %s disconnected from lobby', ws)
+            self.unregister(ws)
+
+
+def effect(method):
+    """Marks a GameBackend method acting outside the game (clients,
+    messages, timers). Called inside transact, it runs once the game
+    is saved, so a retried mutation does not repeat it."""
+    @wraps(method)
+    def wrapper(self, *args):
+        if self.effects is not None:
+            self.effects.append((method, args))
+            return
+        method(self, *args)
+    return wrapper
+
+
+class GameBackend(object):
+    """Interface for game and updating WebSocket clients."""
+    # seconds to show round results and the winner
+    interlude_time = 5
+    victory_time = 5
+    # seconds without changes before the room is closed
+    idle_time = 30 * 60
+    # phases limited by game.settings["move_time"]
+    move_phases = (Game.GamePhase.STORYTELLING, Game.GamePhase.MATCHING,
+                   Game.GamePhase.GUESSING)
+    backend: Dict[Connection, Any] = {}
+
+    max_attempts = 3
+
+    def __init__(self, game: Optional[Game] = None) -> None:
+        self.game: Game = Game() if game is None else game
+        # version of the game in main_lobby.store this process is based on
+        self.stored_version: Optional[int] = None
+        self.clients: List[Connection] = list()
+        # clients which asked for RoomPatch messages instead of RoomUpdate
+        self.streams: Dict[Connection, DeltaStream] = dict()
+        self.scheduler = RoomScheduler(main_lobby.wheel)
+        # phase and turn the "move" deadline is armed for
+        self.deadline: Optional[tuple] = None
+        # effects of the running transact, None outside of it
+        self.effects: Optional[list] = None
+        if main_lobby.game_logs is not None and self.game.log is None:
+            path = os.path.join(main_lobby.game_logs,
+                                f"{self.game.id}.jsonl")
+            # line buffered to survive a crash of the process
+            GameLog(self.game, open(path, "a", buffering=1))
+
+    def __bool__(self) -> bool:
+        # players who left stay in game.players until the end of the turn
+        return len(self.game.players) > len(self.game.removed_players)
+
+    def process_message(self, ws: Connection, message: list) -> None:
+        if message[0] == "LeaveRoom":
+            # may close the room, so it is not run in a transaction
+            leave_room(ws)
+            return
+        self.touch()
+        self.transact(self.dispatch, ws, message)
+
+    def dispatch(self, ws: Connection, message: list) -> None:
+        if message[0] == "UpdateInfo":
+            self.update_info(ws, message[1])
+        elif message[0] == "SelectCard":
+            self.select_card(ws, str(message[1]))
+        elif message[0] == "TellStory":
+            self.tell_story(ws, message[1])
+        elif message[0] == "EndTurn":
+            self.end_turn(ws)
+        elif message[0] == "EnableDelta":
+            self.streams[ws] = DeltaStream()
+            self.resync(ws)
+        elif message[0] == "Ack":
+            if ws in self.streams:
+                self.streams[ws].ack(int(message[1]))
+        elif message[0] == "Resync":
+            self.resync(ws)
+
+    def transact(self, func, *args) -> None:
+        """Runs func(*args) on the latest stored game and stores the result.
+        If another process changed the game meanwhile, retries on its state.
+        The @effect methods func calls run once, after the game is saved,
+        and not at all if it is not."""
+        if self.effects is not None:
+            # nested in a running transact
+            func(*args)
+            return
+        self.effects = []
+        saved = False
+        try:
+            if main_lobby.store is None:
+                func(*args)
+                saved = True
+            else:
+                for _ in range(self.max_attempts):
+                    self.sync()
+                    self.effects.clear()
+                    func(*args)
+                    try:
+                        self.save()
+                        saved = True
+                        break
+                    except VersionConflict:
+                        logger.info('Game %s changed concurrently',
+                                    self.game.id)
+                else:
+                    logger.warning('Game %s: gave up saving %s',
+                                   self.game.id, func)
+        finally:
+            effects, self.effects = self.effects, None
+            self.index()
+        if saved:
+            for method, args in effects:
+                method(self, *args)
+
+    def open_seats(self) -> int:
+        """Players the room waits for before the game starts."""
+        game = self.game
+        if game.get_state() != Game.GamePhase.WAITING:
+            return 0
+        players = len(game.players) - len(game.removed_players)
+        return game.players_to_start - players
+
+    def summary(self) -> dict:
+        """The room as shown in the lobby room list."""
+        game = self.game
+        pack = game.deck.pack
+        return {
+            "ID": str(game.id),
+            "Players": len(game.players) - len(game.removed_players),
+            "Phase": game.get_state().name.capitalize(),
+            "Pack": None if pack is None else pack.id,
+        }
+
+    def index(self) -> None:
+        """Brings main_lobby.open_rooms and the room list
+        up to date with the game."""
+        if main_lobby.backends.get(self.game.id) is self:
+            main_lobby.open_rooms.update(self.game.id, self.open_seats())
+            main_lobby.room_changed(self.game.id, self.summary())
+            main_lobby.snapshot_changed(self.game.id, self.game)
+
+    @effect
+    def touch(self) -> None:
+        """Postpones closing the room as idle.
+        Moves made on timeout do not count as activity."""
+        self.scheduler.schedule("idle", self.idle_time, self.evict)
+
+    @effect
+    def schedule(self, name: str, delay: float, func, *args) -> None:
+        self.scheduler.schedule(name, delay, func, *args)
+
+    @effect
+    def cancel_timers(self) -> None:
+        self.scheduler.cancel_all()
+
+    def sync(self) -> None:
+        """Loads the stored game if another process has changed it."""
+        store = main_lobby.store
+        if store.version(self.game.id) in (None, self.stored_version):
+            return
+        self.stored_version, data = store.load(self.game.id)
+        self.game.load_dict(data)
+
+    def save(self) -> None:
+        if self.game.version == self.stored_version:
+            return
+        main_lobby.store.save(self.game, self.stored_version)
+        self.stored_version = self.game.version
+        fanout = main_lobby.fanout
+        if fanout is not None and fanout.mark(self.game.id, self.game.version):
+            main_lobby.transport.call_later(fanout.interval, fanout.flush)
+
+    def join(self, ws: Connection) -> None:
+        self.touch()
+        game = self.game
+        join_room(ws, game)
+        if len(game.players) == game.players_to_start:
+            self.start_game()
+
+    @effect
+    def register(self, ws: Connection) -> None:
+        """Register a WebSocket connection for updates."""
+        logger.debug('Add %s in lobby', ws)
+        self.clients.append(ws)
+
+    def unregister(self, ws: Connection) -> None:
+        """Unregister a WebSocket connection"""
+        if ws in self.clients:
+            self.clients.remove(ws)
+            self.streams.pop(ws, None)
+            GameBackend.backend.pop(ws)
+        player = ws_to_player[ws]
+        # may run again on a reloaded game, see transact
+        if (player in self.game.players and
+                player not in self.game.removed_players):
+            self.game.remove_player(player)
+        player.current_game = None
+        if not self:
+            # nobody is left to see the next phase
+            self.cancel_timers()
+
+    def evict(self) -> None:
+        """Closes the idle room, sending its clients to the lobby."""
+        logger.info('Game %s is idle, closing', self.game.id)
+        for ws in list(self.clients):
+            self.clients.remove(ws)
+            self.streams.pop(ws, None)
+            GameBackend.backend.pop(ws, None)
+            ws_to_player[ws].current_game = None
+            main_lobby.register(ws)
+            fail_connect(ws)
+        # nobody has played in it on any worker, it is not coming back
+        close_room(self, idle=True)
+
+    def update_info(self, ws: Connection, data: dict) -> None:
+        player = ws_to_player[ws]
+        self.game.update_player(player, data.get('Name', player.name),
+                                data.get('Avi', player.picture))
+        self.update_all()
+
+    @effect
+    def send(self, ws: Connection, data: str) -> None:
+        """Send given data to the registered client.
+        Automatically discards invalid connections."""
+        try:
+            ws.send(data)
+        except Exception as e:
+            logger.info('Player %s disconnect from game with error %s',
+                        ws, e)
+            self.unregister(ws)
+
+    @effect
+    def update(self, ws: Connection) -> None:
+        player = ws_to_player[ws]
+        game = player.current_game
+        if game != self.game:
+            fail_connect(ws)
+            return
+        stream = self.streams.get(ws)
+        if stream is None:
+            data = json_room_update(game, player)
+        else:
+            state = game.make_current_game_state(player)
+            message = stream.encode(state, game.version)
+            if message is None:
+                return
+            data = json.dumps(message)
+        if updates_logger.isEnabledFor(logging.DEBUG):
+            updates_logger.debug('Sending message: %s', data,
+                                 extra={'game': game.id, 'bytes': len(data)})
+        main_lobby.transport.spawn(self.send, ws, data)
+
+    @effect
+    def resync(self, ws: Connection) -> None:
+        """Sends the full room state to a delta client."""
+        stream = self.streams.get(ws)
+        if stream is None:
+            self.update(ws)
+            return
+        player = ws_to_player[ws]
+        data = json.dumps(stream.snapshot(
+            self.game.make_current_game_state(player),
+            self.game.version
+        ))
+        main_lobby.transport.spawn(self.send, ws, data)
+
+    @effect
+    def update_all(self) -> None:
+        self.arm_move_deadline()
+        for player in self.game.players:
+            # players who left during the turn stay in game.players
+            if player in self.game.removed_players:
+                continue
+            ws = player_to_ws.get(player)
+            if ws is not None:
+                self.update(ws)
+
+    def start_game(self) -> None:
+        self.game.start_game()
+        self.update_all()
+
+    def select_card(self, ws: Connection, card_id: str) -> None:
+        player = ws_to_player[ws]
+        logger.debug('%s select card %s', player.id, card_id)
+        game = self.game
+        cur_player = game.get_cur_player()
+        cur_phase = game.get_state()
+        logger.debug('%s, %s', cur_phase, cur_player.id)
+        if cur_phase == Game.GamePhase.INTERLUDE:
+            return
+        if cur_phase == Game.GamePhase.WAITING:
+            return
+        if cur_phase == Game.GamePhase.VICTORY:
+            return
+        if cur_phase == Game.GamePhase.GUESSING and player != cur_player:
+            game.make_guess(player, card_id)
+        if cur_phase == Game.GamePhase.MATCHING and player != cur_player:
+            game.make_bet(player, card_id)
+        if cur_phase == Game.GamePhase.STORYTELLING and player == cur_player:
+            game.add_lead_card(card_id)
+
+    def tell_story(self, ws: Connection, story: str) -> None:
+        player = ws_to_player[ws]
+        game = self.game
+        cur_player = game.get_cur_player()
+        cur_state = game.get_state()
+        if cur_state != Game.GamePhase.STORYTELLING:
+            return
+        if cur_player != player:
+            return
+        logger.info('Player %s is telling a story', player.name)
+        game.start_turn(story)
+        self.update_all()
+
+    def end_turn(self, ws: Connection) -> None:
+        player = ws_to_player[ws]
+        game = self.game
+        cur_player = game.get_cur_player()
+        cur_state = game.get_state()
+        logger.debug('end_turn from %s, status = %s', ws, cur_state)
+        if cur_state != Game.GamePhase.GUESSING \
+                and cur_state != Game.GamePhase.MATCHING:
+            logger.debug('%s try end turn for %s', player.id, cur_state)
+            return
+        if cur_state == Game.GamePhase.GUESSING and player.id != cur_player:
+            game.finish_turn(player)
+            assert game.turn_ended[player]
+            logger.debug('%s end turn for %s, res = %s',
+                         player.id, cur_state, game.all_turns_ended())
+            if not game.all_turns_ended():
+                for player in game.players:
+                    logger.debug('%s is %s', player.id,
+                                 game.turn_ended[player])
+            if game.all_turns_ended():
+                self.end_guessing()
+        if cur_state == Game.GamePhase.MATCHING and player != cur_player:
+            game.finish_turn(player)
+            logger.debug('%s is %s for matching', player.id,
+                         game.turn_ended[player])
+            if game.all_turns_ended():
+                self.end_matching()
+        self.update(ws)
+
+    def end_matching(self) -> None:
+        self.game.place_cards()
+        self.update_all()
+
+    def end_guessing(self) -> None:
+        game = self.game
+        logger.debug('%s end round, showing results', game.id)
+        game.valuate_guesses()
+        self.update_all()
+        self.schedule(
+            "interlude", self.interlude_time,
+            self.transact, self.start_round
+        )
+
+    def arm_move_deadline(self) -> None:
+        """Keeps one "move" deadline for the current phase.
+        Every worker showing the room arms it, so it is keyed by the
+        turn too: a worker which missed the phase change fires it on a
+        newer game, where it does nothing (see expire_move)."""
+        state = self.game.get_state()
+        deadline = (state, self.game.turn)
+        if deadline == self.deadline:
+            return
+        self.deadline = deadline
+        if state in self.move_phases and self.game.players:
+            self.scheduler.schedule(
+                "move", self.game.settings["move_time"],
+                self.transact, self.expire_move, state, self.game.turn
+            )
+        else:
+            self.scheduler.cancel("move")
+
+    def expire_move(self, state: Game.GamePhase, turn: int) -> None:
+        """Makes the moves of players who ran out of time:
+        the storyteller passes the turn, listeners bet a random card
+        or skip guessing."""
+        game = self.game
+        if (game.get_state(), game.turn) != (state, turn):
+            return
+        logger.info('Game %s: move time is over in %s', game.id, state)
+        storyteller = game.get_cur_player()
+        # the next phase may be the same one, arm the deadline again
+        self.deadline = None
+        if state == Game.GamePhase.STORYTELLING:
+            game.end_turn()
+            self.update_all()
+            return
+        for player in game.players:
+            if player == storyteller or game.turn_ended[player]:
+                continue
+            if state == Game.GamePhase.MATCHING:
+                game.make_random_bet(player)
+                game.finish_turn(player)
+            else:
+                game.skip_guess(player)
+        if state == Game.GamePhase.MATCHING:
+            self.end_matching()
+        else:
+            self.end_guessing()
+
+    def start_round(self) -> None:
+        """Ends the interlude, finishing the game if someone has won."""
+        game = self.game
+        if game.get_state() != Game.GamePhase.INTERLUDE:
+            return
+        logger.debug('%s start new round', game.id)
+        game.end_turn()
+        winner = game.finished()
+        if winner is not None:
+            logger.debug('%s game end', game.id)
+            game.end_game(winner)
+            self.schedule(
+                "victory", self.victory_time,
+                self.transact, self.restart_game
+            )
+        self.update_all()
+
+    def restart_timers(self) -> None:
+        """Arms the timers of a room restored in the middle of a phase."""
+        self.touch()
+        self.arm_move_deadline()
+        state = self.game.get_state()
+        if state == Game.GamePhase.INTERLUDE:
+            self.scheduler.schedule(
+                "interlude", self.interlude_time,
+                self.transact, self.start_round
+            )
+        elif state == Game.GamePhase.VICTORY:
+            self.scheduler.schedule(
+                "victory", self.victory_time,
+                self.transact, self.restart_game
+            )
+
+    def restart_game(self) -> None:
+        if self.game.get_state() != Game.GamePhase.VICTORY:
+            return
+        logger.debug('%s start new game', self.game.id)
+        self.game.start_game()
+        self.update_all()
+
+
+def create_room(ws):
+    player = ws_to_player[ws]
+    if player.current_game is not None:
+        fail_connect(ws)
+        return
+    game_backend = GameBackend()
+    game = game_backend.game
+    main_lobby.backends[game.id] = game_backend
+    try:
+        game_backend.transact(join_room, ws, game)
+    except Exception as error:
+        logger.exception("Player can't join to game. %s", error)
+
+
+def quick_join(ws: Connection) -> None:
+    """Seats the player in the fullest waiting room or a new one."""
+    player = ws_to_player[ws]
+    if player.current_game is not None:
+        fail_connect(ws)
+        return
+    game_id = main_lobby.open_rooms.fullest()
+    if game_id is None:
+        create_room(ws)
+        return
+    game_backend = main_lobby.backends[game_id]
+    game_backend.transact(game_backend.join, ws)
+
+
+def restore_rooms() -> int:
+    """Brings back the rooms of main_lobby.snapshots after a restart.
+    Their players get back to them with ["Resume", token]."""
+    restored = 0
+    for data in main_lobby.snapshots.load():
+        if data["ID"] in main_lobby.backends:
+            continue
+        game = Game.from_dict(data)
+        game_backend = GameBackend(game)
+        main_lobby.backends[game.id] = game_backend
+        for player in game.players:
+            main_lobby.absent[player.token] = game_backend
+        game_backend.restart_timers()
+        game_backend.index()
+        restored += 1
+    return restored
+
+
+def resume(ws: Connection, token: str) -> None:
+    """Seats the client as its player in a restored room."""
+    game_backend = main_lobby.absent.get(token)
+    if game_backend is None or ws_to_player[ws].current_game is not None:
+        fail_connect(ws)
+        return
+    del main_lobby.absent[token]
+    game = game_backend.game
+    player = next(player for player in game.players if player.token == token)
+    anonymous = ws_to_player[ws]
+    player_to_ws.pop(anonymous, None)
+    ws_to_player[ws] = player
+    player_to_ws[player] = ws
+    main_lobby.unregister(ws)
+    GameBackend.backend[ws] = game_backend
+    game_backend.register(ws)
+    game_backend.touch()
+    game_backend.send(ws, json_room_update(game, player))
+
+
+def leave_room(ws: Connection) -> None:
+    player = ws_to_player[ws]
+    assert player.current_game is not None
+    game_backend = GameBackend.backend[ws]
+    logger.debug('%s try leave from %s', player.id,
+                 game_backend.game.id)
+    game_backend.transact(game_backend.unregister, ws)
+    assert player.current_game is None
+    game_backend.update_all()
+    if not game_backend.clients and not main_lobby.awaits(game_backend):
+        close_room(game_backend)
+    assert ws not in main_lobby.clients
+    main_lobby.register(ws)
+
+
+def close_room(game_backend: GameBackend, idle: bool = False) -> None:
+    """Forgets a room without local clients. The stored game is deleted
+    once all its players have left or when the room is closed as idle."""
+    game = game_backend.game
+    logger.debug('Closing room %s', game.id)
+    game_backend.scheduler.cancel_all()
+    if main_lobby.backends.get(game.id) is game_backend:
+        main_lobby.backends.pop(game.id)
+        main_lobby.open_rooms.discard(game.id)
+        main_lobby.room_changed(game.id, None)
+    if Game.get_game(game.id) is game:
+        Game.delete_game(game.id)
+    game.release_cards()
+    if game.log is not None:
+        game.log.close()
+    for player in game.players:
+        if main_lobby.absent.get(player.token) is game_backend:
+            del main_lobby.absent[player.token]
+    main_lobby.snapshot_changed(game.id, None)
+    if main_lobby.store is not None and (idle or not game_backend):
+        main_lobby.store.delete(game.id)
+
+
+def memory_stats() -> dict:
+    """Live objects of the process and their approximate size."""
+    store = main_lobby.store
+    return {
+        "Rooms": len(main_lobby.backends),
+        # shared by all workers, None without a store
+        "StoredGames": None if store is None else len(store.game_ids()),
+        "OpenRooms": len(main_lobby.open_rooms),
+        "Games": Game.count_games(),
+        "Players": len(ws_to_player),
+        "LobbyClients": len(main_lobby.clients),
+        "RoomWatchers": len(main_lobby.feed.watchers),
+        "Cards": len(Card.card_ids),
+        "Timers": len(main_lobby.wheel),
+        "Bytes": deep_sizeof(main_lobby.backends, ws_to_player,
+                             Card.card_ids),
+    }
+
+
+def join_room(ws, game):
+    logger.debug('%s join to %s', ws, game.id)
+    main_lobby.unregister(ws)
+    game.add_player(ws_to_player[ws])
+    ws_to_player[ws].current_game = game
+    game_backend = main_lobby.backends[game.id]
+    GameBackend.backend[ws] = game_backend
+    game_backend.register(ws)
+    # sent back with "Resume" after a restart of the server
+    game_backend.send(ws, json.dumps(["Session", ws_to_player[ws].token]))
+    data = json_room_update(game, ws_to_player[ws])
+    game_backend.send(ws, data)
+    game_backend.update_all()
+
+
+def json_room_update(game: Game, player: Player) -> str:
+    return f'["RoomUpdate", {game.encode_current_game_state(player)}]'
+
+
+def game_by_ws(ws: Connection) -> Optional[GameBackend]:
+    return GameBackend.backend.get(ws, None)
+
+
+def fail_connect(user):
+    user.send('"FailConnect"')
+
+
+def route_message(ws: Connection, message: Union[str, list, Any]):
+    frames_logger.debug('%s', message)
+    if type(message) not in [str, list]:
+        logger.info("Unexpected type of message: %s", message)
+        return
+    if isinstance(message, str):
+        message = [message]
+
+    if message[0] in ["JoinRoom", "QuickJoin", "Resume", "WatchRooms",
+                      "UnwatchRooms"]:
+        Lobby.process_message(ws, message)
+    else:
+        game_backend = game_by_ws(ws)
+        if game_backend is None:
+            logger.warning("Unexpected message from client: %s", message)
+            return
+
+        if message[0] in ["UpdateInfo", "LeaveRoom", "SelectCard", "TellStory", "EndTurn",
+                          "EnableDelta", "Ack", "Resync"]:
+            game_backend.process_message(ws, message)
+        else:
+            logger.warning("Unexpected message from client: %s", message)
+
+
+def on_room_changed(game_id: int, version: int) -> None:
+    """Fanout callback, may be called from the broker's thread."""
+    if main_lobby.transport is not None:
+        main_lobby.transport.spawn(refresh_room, game_id, version)
+
+
+def refresh_room(game_id: int, version: int) -> None:
+    """Sends a room changed by another process to local clients."""
+    game_backend = main_lobby.backends.get(game_id)
+    if game_backend is None or not game_backend.clients:
+        return
+    if game_backend.stored_version == version:
+        return
+    game_backend.touch()
+    game_backend.sync()
+    game_backend.index()
+    game_backend.update_all()
+
+
+def connect(ws: Connection) -> Player:
+    """Registers a new connection in the lobby."""
+    logger.debug('New user %s', ws)
+    main_lobby.register(ws)
+    player = Player("noname")
+    ws_to_player[ws] = player
+    player_to_ws[player] = ws
+    return player
+
+
+def handle_message(ws: Connection, message: str) -> None:
+    """Processes one raw frame. Errors are logged,
+    the connection stays open."""
+    try:
+        data = json.loads(message)
+    except ValueError:
+        logger.warning("Malformed message from client: %s", message)
+        return
+    try:
+        route_message(ws, data)
+    except Exception as error:
+        logger.exception("Failed to process %s: %s", data, error)
+
+
+def disconnect(ws: Connection) -> None:
+    """Forgets a closed connection, leaving its room or the lobby."""
+    logger.debug('%s leave from site', ws)
+    game_backend = game_by_ws(ws)
+    if game_backend is not None:
+        game_backend.transact(game_backend.unregister, ws)
+        game_backend.update_all()
+        if not game_backend.clients and not main_lobby.awaits(game_backend):
+            close_room(game_backend)
+    main_lobby.unregister(ws)
+    player = ws_to_player.pop(ws, None)
+    if player is not None:
+        player_to_ws.pop(player, None)
+
+
+# Loggers, configured by logs.setup
+logger = logging.getLogger('app')
+frames_logger = logging.getLogger('app.frames')
+updates_logger = logging.getLogger('app.updates')
+# Create Lobby and global dicts
+main_lobby = Lobby()
+ws_to_player: Dict[Connection, Player] = {}  # web_socket -> Player
+player_to_ws: Dict[Player, Connection] = {}  # player_id -> web_socket
@@ -0,0 +1,40 @@
+"""Deadlines of room phase transitions."""
+from typing import Callable, Dict
+
+from transport import Timer, Transport
+
+
+class RoomScheduler(object):
+    """Named timers of one room.
+
+    Scheduling a name again replaces its deadline, so a room has at most
+    one pending transition of each kind. cancel_all() is called when the
+    room empties.
+    """
+
+    def __init__(self, transport: Transport) -> None:
+        self.transport = transport
+        self.timers: Dict[str, Timer] = dict()
+
+    def schedule(self, name: str, delay: float, func: Callable,
+                 *args) -> None:
+        self.cancel(name)
+        self.timers[name] = self.transport.call_later(
+            delay, self._fire, name, func, args
+        )
+
+    def _fire(self, name: str, func: Callable, args: tuple) -> None:
+        self.timers.pop(name, None)
+        func(*args)
+
+    def cancel(self, name: str) -> None:
+        timer = self.timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+
+    def cancel_all(self) -> None:
+        for name in list(self.timers):
+            self.cancel(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.timers
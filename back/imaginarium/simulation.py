@@ -1,4 +1,4 @@
-from server import *
+from rooms import *
 
 
 def main():
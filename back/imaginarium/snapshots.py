@@ -0,0 +1,130 @@
+"""Crash-safe snapshots of the rooms of a server process.
+
+Rooms mark their games as changed, a run interval seconds later takes
+Game.to_dict of every game changed since the last run on the event
+loop and hands them to a worker thread, which encodes them like
+store.encode_game and replaces <directory>/<game id>.game atomically
+(write, fsync, rename). Files of closed rooms are deleted. A run costs
+in proportion to the rooms changed since the previous one.
+
+load() reads the games back at startup, see rooms.restore_rooms.
+"""
+import logging
+import os
+import zlib
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from mechanics import Game
+from store import decode_game, encode_game_data
+
+logger = logging.getLogger("app")
+
+SUFFIX = ".game"
+
+
+class Snapshots(object):
+    def __init__(self, directory: str, interval: float = 5.0) -> None:
+        self.directory = directory
+        # seconds to collect changes before writing them
+        self.interval = interval
+        # game_id -> changed game, None if its room is closed
+        self.pending: Dict[int, Optional[Game]] = dict()
+        # game_id -> version written or being written
+        self.saved: Dict[int, int] = dict()
+        # a batch is being written by the worker thread
+        self.writing = False
+        # (game_id, game) the worker thread failed to write, they are
+        # written again by the next run
+        self.failed: deque = deque()
+
+    def path(self, game_id: int) -> str:
+        return os.path.join(self.directory, f"{game_id}{SUFFIX}")
+
+    def mark(self, game_id: int, game: Optional[Game]) -> bool:
+        """Remembers the changed game, None removes its snapshot.
+        Returns True if a run has to be scheduled."""
+        if game is not None and self.saved.get(game_id) == game.version:
+            return False
+        schedule = not self.pending
+        self.pending[game_id] = game
+        return schedule
+
+    def collect(self) -> Optional[List[Tuple[int, Optional[Game], dict]]]:
+        """Takes (game_id, game, Game.to_dict data) of the pending
+        changes, game and data are None for closed rooms. Returns None
+        if the previous batch is still being written, the changes wait
+        for the next run then."""
+        if self.writing:
+            return None
+        while self.failed:
+            game_id, game = self.failed.popleft()
+            self.saved.pop(game_id, None)
+            self.pending.setdefault(game_id, game)
+        pending, self.pending = self.pending, dict()
+        batch = []
+        for game_id, game in pending.items():
+            if game is None:
+                if self.saved.pop(game_id, None) is not None:
+                    batch.append((game_id, None, None))
+            elif self.saved.get(game_id) != game.version:
+                self.saved[game_id] = game.version
+                batch.append((game_id, game, game.to_dict()))
+        if batch:
+            self.writing = True
+        return batch
+
+    def write(self, batch: List[Tuple[int, Optional[Game], dict]]) -> None:
+        """Writes a batch made by collect. Runs in a worker thread,
+        Game.to_dict data is not shared with the game."""
+        try:
+            for game_id, game, data in batch:
+                try:
+                    if data is None:
+                        if os.path.exists(self.path(game_id)):
+                            os.remove(self.path(game_id))
+                    else:
+                        self.replace(game_id, encode_game_data(data))
+                except OSError:
+                    logger.exception("Failed to write snapshot of game %s",
+                                     game_id)
+                    self.failed.append((game_id, game))
+            sync_directory(self.directory)
+        finally:
+            self.writing = False
+
+    def replace(self, game_id: int, data: bytes) -> None:
+        temporary = self.path(game_id) + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path(game_id))
+
+    def load(self) -> List[dict]:
+        """Game.to_dict data of every snapshot, unreadable ones are
+        skipped."""
+        games = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "rb") as file:
+                    data = decode_game(file.read())
+            except (OSError, ValueError, zlib.error):
+                logger.exception("Skipping snapshot %s", name)
+                continue
+            self.saved[data["ID"]] = data["Version"]
+            games.append(data)
+        return games
+
+
+def sync_directory(directory: str) -> None:
+    """Makes renames in the directory durable, where the OS allows it."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
@@ -0,0 +1,192 @@
+"""Static files served from memory where possible.
+
+StaticFiles answers GET and HEAD for the files of a directory as a WSGI
+application, mount() puts it in front of the flask app. A file is
+looked up on disk once: its size, type and strong ETag are kept in
+memory, so conditional requests are answered without touching the disk,
+and files up to max_cached bytes are kept in an LRU of cache_bytes, so
+hot card pictures are sent from memory. Other files are streamed with
+wsgi.file_wrapper, which servers implement with sendfile, or in chunks
+where the server has none.
+
+In an immutable directory every name is a content hash (the picture
+store of packs.py and the variants of ingest.py): the ETag is the name
+itself, an If-None-Match with it gets 304 without any lookup and
+responses are cacheable forever. Elsewhere (the deploy bundle) the ETag
+is a hash of the content read with the first request and responses are
+revalidated; files changed on disk are seen after a restart.
+"""
+import hashlib
+import mimetypes
+import os
+import stat
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, NamedTuple, Optional
+
+CHUNK = 1 << 16
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+class Entry(NamedTuple):
+    path: str
+    size: int
+    etag: str
+    content_type: str
+
+
+def content_etag(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match compares weakly, W/ prefixes are ignored."""
+    if header == etag or header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def read_chunks(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK), b""):
+            yield chunk
+
+
+class StaticFiles(object):
+    def __init__(self, directory: str, immutable: bool = False,
+                 cache_bytes: int = 64 << 20,
+                 max_cached: int = 1 << 20) -> None:
+        self.directory = os.path.abspath(directory)
+        self.immutable = immutable
+        # memory for file contents and the largest file kept there
+        self.cache_bytes = cache_bytes
+        self.max_cached = max_cached
+        # name -> Entry of every file served
+        self.entries: Dict[str, Entry] = dict()
+        # name -> content, least recently used first
+        self.cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self.cached = 0
+        # files opened, cached or streamed
+        self.reads = 0
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Path of the file, None if the name leaves the directory."""
+        parts = name.split("/")
+        for part in parts:
+            if part in ("", ".", "..") or "\\" in part or "\0" in part:
+                return None
+        return os.path.join(self.directory, *parts)
+
+    def etag(self, name: str) -> str:
+        return f'"{name}"'
+
+    def lookup(self, name: str) -> Optional[Entry]:
+        entry = self.entries.get(name)
+        if entry is not None:
+            return entry
+        path = self.resolve(name)
+        if path is None:
+            return None
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        etag = self.etag(name) if self.immutable else content_etag(path)
+        content_type = (mimetypes.guess_type(name)[0]
+                        or "application/octet-stream")
+        entry = Entry(path, info.st_size, etag, content_type)
+        self.entries[name] = entry
+        return entry
+
+    def content(self, name: str, entry: Entry) -> Optional[bytes]:
+        """The file from the cache, read into it if it fits.
+        None for files streamed from disk."""
+        data = self.cache.get(name)
+        if data is not None:
+            self.cache.move_to_end(name)
+            return data
+        if entry.size > self.max_cached or entry.size > self.cache_bytes:
+            return None
+        self.reads += 1
+        with open(entry.path, "rb") as file:
+            data = file.read()
+        self.cache[name] = data
+        self.cached += len(data)
+        while self.cached > self.cache_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached -= len(evicted)
+        return data
+
+    def serve(self, environ: dict, start_response: Callable,
+              name: str) -> Iterable[bytes]:
+        method = environ.get("REQUEST_METHOD", "GET")
+        if method not in ("GET", "HEAD"):
+            start_response("405 Method Not Allowed",
+                           [("Allow", "GET, HEAD"), ("Content-Length", "0")])
+            return []
+        cache_control = IMMUTABLE if self.immutable else REVALIDATE
+        match = environ.get("HTTP_IF_NONE_MATCH")
+        if (match is not None and self.immutable
+                and self.resolve(name) is not None
+                and etag_matches(match, self.etag(name))):
+            start_response("304 Not Modified", [
+                ("ETag", self.etag(name)), ("Cache-Control", cache_control)])
+            return []
+        entry = self.lookup(name)
+        if entry is None:
+            start_response("404 Not Found", [("Content-Length", "0")])
+            return []
+        if match is not None and etag_matches(match, entry.etag):
+            start_response("304 Not Modified", [
+                ("ETag", entry.etag), ("Cache-Control", cache_control)])
+            return []
+        start_response("200 OK", [
+            ("Content-Type", entry.content_type),
+            ("Content-Length", str(entry.size)),
+            ("ETag", entry.etag),
+            ("Cache-Control", cache_control),
+        ])
+        if method == "HEAD":
+            return []
+        data = self.content(name, entry)
+        if data is not None:
+            return [data]
+        self.reads += 1
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if file_wrapper is not None:
+            return file_wrapper(open(entry.path, "rb"), CHUNK)
+        return read_chunks(entry.path)
+
+    def __call__(self, environ: dict,
+                 start_response: Callable) -> Iterable[bytes]:
+        return self.serve(environ, start_response,
+                          environ.get("PATH_INFO", "").lstrip("/"))
+
+
+def mount(app: Callable, *routes) -> Callable:
+    """WSGI application serving routes of (prefix, StaticFiles,
+    fallthrough) before app. Paths under a prefix are names in its
+    directory; with fallthrough, names not found there go to app."""
+    def dispatch(environ: dict, start_response: Callable) -> Iterable[bytes]:
+        path = environ.get("PATH_INFO", "")
+        for prefix, files, fallthrough in routes:
+            if not path.startswith(prefix):
+                continue
+            name = path[len(prefix):]
+            if fallthrough and files.lookup(name) is None:
+                break
+            return files.serve(environ, start_response, name)
+        return app(environ, start_response)
+    return dispatch
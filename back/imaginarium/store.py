@@ -0,0 +1,138 @@
+"""Shared storage of games for running several server processes.
+
+Games are kept as compressed compact JSON (Game.to_dict) together with
+their version. Saving is optimistic: it succeeds only if the stored
+version is still the one the process has loaded.
+"""
+import json
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from mechanics import Game
+
+
+class VersionConflict(Exception):
+    """The game was changed by another process since it was loaded."""
+
+
+def encode_game(game: Game) -> bytes:
+    return encode_game_data(game.to_dict())
+
+
+def encode_game_data(data: dict) -> bytes:
+    """Encodes Game.to_dict data."""
+    text = json.dumps(data, separators=(",", ":"))
+    return zlib.compress(text.encode(), 1)
+
+
+def decode_game(data: bytes) -> dict:
+    return json.loads(zlib.decompress(data))
+
+
+class GameStore(object):
+    """Storage interface. Version None means the game is not stored."""
+
+    def version(self, game_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    def load(self, game_id: int) -> Optional[Tuple[int, dict]]:
+        """Returns (version, Game.to_dict() data) of the stored game."""
+        raise NotImplementedError
+
+    def save(self, game: Game, expected: Optional[int]) -> None:
+        """Stores the game if its stored version is still expected.
+        Raises VersionConflict otherwise."""
+        raise NotImplementedError
+
+    def delete(self, game_id: int) -> None:
+        raise NotImplementedError
+
+    def game_ids(self) -> List[int]:
+        raise NotImplementedError
+
+
+class MemoryStore(GameStore):
+    """Single process stand-in for RedisStore."""
+
+    def __init__(self) -> None:
+        self.games: Dict[int, Tuple[int, bytes]] = dict()
+
+    def version(self, game_id: int) -> Optional[int]:
+        if game_id not in self.games:
+            return None
+        return self.games[game_id][0]
+
+    def load(self, game_id: int) -> Optional[Tuple[int, dict]]:
+        if game_id not in self.games:
+            return None
+        version, data = self.games[game_id]
+        return version, decode_game(data)
+
+    def save(self, game: Game, expected: Optional[int]) -> None:
+        if self.version(game.id) != expected:
+            raise VersionConflict(game.id)
+        self.games[game.id] = (game.version, encode_game(game))
+
+    def delete(self, game_id: int) -> None:
+        self.games.pop(game_id, None)
+
+    def game_ids(self) -> List[int]:
+        return list(self.games)
+
+
+# Compare-and-set of a game hash, the version is compared as a string.
+# KEYS: game key, set of game ids; ARGV: expected, version, data, id
+SAVE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'version')
+if (current or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[2], 'data', ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[4])
+return 1
+"""
+
+
+class RedisStore(GameStore):
+    """Games in Redis hashes game:<id> {version, data}."""
+
+    def __init__(self, client, prefix: str = "imaginarium") -> None:
+        self.client = client
+        self.prefix = prefix
+        self.save_script = client.register_script(SAVE_SCRIPT)
+
+    def key(self, game_id: int) -> str:
+        return f"{self.prefix}:game:{game_id}"
+
+    @property
+    def ids_key(self) -> str:
+        return f"{self.prefix}:games"
+
+    def version(self, game_id: int) -> Optional[int]:
+        version = self.client.hget(self.key(game_id), "version")
+        return None if version is None else int(version)
+
+    def load(self, game_id: int) -> Optional[Tuple[int, dict]]:
+        version, data = self.client.hmget(self.key(game_id),
+                                          ["version", "data"])
+        if version is None:
+            return None
+        return int(version), decode_game(data)
+
+    def save(self, game: Game, expected: Optional[int]) -> None:
+        saved = self.save_script(
+            keys=[self.key(game.id), self.ids_key],
+            args=["" if expected is None else str(expected),
+                  str(game.version), encode_game(game), game.id]
+        )
+        if not saved:
+            raise VersionConflict(game.id)
+
+    def delete(self, game_id: int) -> None:
+        pipe = self.client.pipeline()
+        pipe.delete(self.key(game_id))
+        pipe.srem(self.ids_key, game_id)
+        pipe.execute()
+
+    def game_ids(self) -> List[int]:
+        return [int(game_id) for game_id in self.client.smembers(self.ids_key)]
@@ -1,67 +1,57 @@
 import unittest
-from mechanics import Game, Player, Card, Pack
+from unittest import mock
+from mechanics import Game, Player, Card, Pack, Deck, load_packs
+from delta import make_patch, apply_patch, DeltaStream
+from transport import Transport
+from store import MemoryStore, RedisStore, VersionConflict
+from fanout import Fanout, MemoryBroker
+from timing import TimingWheel
+from matchmaking import OpenRooms
+from autoplay import AutoPlayer, play_until_phase
+import gamerunner
+import packs
+from static import StaticFiles, mount
+import gamelog
+from gamelog import GameLog
+from snapshots import Snapshots
+from logs import (DroppingQueueHandler, JsonFormatter, Rule,
+                  SamplingFilter)
+import rooms
 from typing import Optional, List
-from random import randint, choice
-
-
-def play_until_phase(game: Game, phase: Game.GamePhase,
-                     bets: Optional[List[int]] = None,
-                     guesses: Optional[List[int]] = None,
-                     stop: bool = False,
-                     enable_random: bool = False) -> None:
-    if phase == game.get_state() and stop:
-        return
-    if game.get_state() == Game.GamePhase.WAITING:
-        for player in game.players:
-            game.make_current_game_state(player)
-        game.start_game()
-    elif game.get_state() == Game.GamePhase.STORYTELLING:
-        winner = game.finished()
-        if winner is not None:
-            game.end_game(winner)
-            for player in game.players:
-                game.make_current_game_state(player)
-            return
-        cur_player = game.get_cur_player()
-        game.add_lead_card(game.hands[cur_player][0].id)
-        for player in game.players:
-            game.make_current_game_state(player)
-        game.start_turn("association")
-    elif game.get_state() == Game.GamePhase.MATCHING:
-        if bets is None:
-            bets = [game.hands[player][0] for player in game.players]
-        if enable_random:
-            bets = [choice(game.hands[player]) for player in game.players]
-        for player, bet in zip(game.players, bets):
-            game.make_bet(player, bet.id)
-            game.finish_turn(player)
-        for player in game.players:
-            game.make_current_game_state(player)
-        game.place_cards()
-    elif game.get_state() == Game.GamePhase.GUESSING:
-        if guesses is None:
-            guesses = [list(game.current_table.keys())[0]] * len(game.players)
-        if enable_random:
-            guesses = [choice(list(game.current_table.keys()))
-                       for player in game.players]
-        for player, guess in zip(game.players, guesses):
-            game.make_guess(player, guess.id)
-            game.finish_turn(player)
-        for player in game.players:
-            game.make_current_game_state(player)
-        game.valuate_guesses()
-    elif game.get_state() == Game.GamePhase.INTERLUDE:
-        for player in game.players:
-            game.make_current_game_state(player)
-        game.end_turn()
-    play_until_phase(
-        game,
-        phase,
-        bets=bets,
-        guesses=guesses,
-        stop=True,
-        enable_random=enable_random
-    )
+from random import randint, choice, Random
+import inspect
+import os
+import tempfile
+import io
+import json
+import logging
+import queue
+
+
+def setUpModule():
+    """Loads synthetic packs from a temporary front-end directory."""
+    global packs_directory
+    packs_directory = tempfile.TemporaryDirectory()
+    root = os.path.join(packs_directory.name, "public")
+    for pack in ("cats", "dogs"):
+        os.makedirs(os.path.join(root, pack))
+        for i in range(100):
+            name = os.path.join(root, pack, f"{i}.jpg")
+            with open(name, "w") as file:
+                file.write(f"{pack} {i}")
+    load_packs(root, os.path.join(packs_directory.name, "manifest.json"))
+
+
+def tearDownModule():
+    packs_directory.cleanup()
+
+
+def use_test_pack(test_case: unittest.TestCase, size: int = 100) -> Pack:
+    """Makes a synthetic pack the only one for the duration of the test."""
+    patcher = mock.patch.dict(Pack.pack_ids, clear=True)
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    return Pack("test", [f"{i}.jpg" for i in range(size)])
 
 
 def make_game() -> Game:
@@ -174,13 +164,1313 @@ class TestGame(unittest.TestCase):
         play_until_phase(self.game, Game.GamePhase.INTERLUDE)
 
     def test_full_game(self):
-        for _ in range(500000):
-            self.game = make_game()
-            play_until_phase(
-                self.game,
-                Game.GamePhase.VICTORY,
-                enable_random=True
+        # a few seeded games, python gamerunner.py plays as many as needed
+        # and prints the seed of every failing one
+        use_test_pack(self)
+        for seed in range(8):
+            players = 3 + seed % 4
+            game, rounds, violations = gamerunner.play_game(seed, players)
+            gamerunner.forget(game)
+            self.assertEqual(game.get_state(), Game.GamePhase.VICTORY)
+            self.assertEqual(violations, [], f"seed {seed}")
+
+
+class TestDelta(unittest.TestCase):
+    def setUp(self):
+        use_test_pack(self)
+        self.game = make_game()
+        self.player = self.game.players[0]
+
+    def test_version_grows(self):
+        version = self.game.version
+        play_until_phase(self.game, Game.GamePhase.MATCHING)
+        self.assertGreater(self.game.version, version)
+
+    def test_patch_round_trip(self):
+        old = self.game.make_current_game_state(self.player)
+        for phase in [Game.GamePhase.STORYTELLING, Game.GamePhase.MATCHING,
+                      Game.GamePhase.GUESSING, Game.GamePhase.INTERLUDE,
+                      Game.GamePhase.STORYTELLING]:
+            play_until_phase(self.game, phase)
+            new = self.game.make_current_game_state(self.player)
+            self.assertEqual(apply_patch(old, make_patch(old, new)), new)
+            old = new
+
+    def test_list_shrink(self):
+        old = {"Cards": [1, 2, 3], "Story": None}
+        new = {"Cards": [1], "Story": "story"}
+        self.assertEqual(apply_patch(old, make_patch(old, new)), new)
+
+    def test_stream(self):
+        stream = DeltaStream()
+        state = self.game.make_current_game_state(self.player)
+        message = stream.encode(state, self.game.version)
+        self.assertEqual(message[0], "RoomSnapshot")
+        client = {message[1]["Version"]: message[1]["State"]}
+        self.assertIsNone(stream.encode(state, self.game.version))
+        for phase in [Game.GamePhase.STORYTELLING, Game.GamePhase.MATCHING]:
+            play_until_phase(self.game, phase)
+            state = self.game.make_current_game_state(self.player)
+            message = stream.encode(state, self.game.version)
+            self.assertEqual(message[0], "RoomPatch")
+            patch = message[1]
+            client[patch["Version"]] = apply_patch(
+                client[patch["Base"]], patch["Ops"]
             )
+            self.assertEqual(client[patch["Version"]], state)
+            stream.ack(patch["Version"])
+        self.assertEqual(stream.acked_version, self.game.version)
+        self.assertFalse(stream.sent)
+
+
+class TestSharedView(unittest.TestCase):
+    def setUp(self):
+        use_test_pack(self)
+        self.game = make_game()
+
+    def test_cached_until_mutation(self):
+        play_until_phase(self.game, Game.GamePhase.STORYTELLING)
+        public = self.game.make_public_state()
+        self.assertIs(public, self.game.make_public_state())
+        states = [self.game.make_current_game_state(player)
+                  for player in self.game.players]
+        self.assertIs(states[0]["Opponents"][0], states[1]["Client"])
+        self.game.touch()
+        self.assertIsNot(public, self.game.make_public_state())
+
+    def test_encoded_state(self):
+        for phase in [Game.GamePhase.STORYTELLING, Game.GamePhase.MATCHING,
+                      Game.GamePhase.GUESSING, Game.GamePhase.INTERLUDE]:
+            play_until_phase(self.game, phase)
+            for player in self.game.players:
+                self.assertEqual(
+                    json.loads(self.game.encode_current_game_state(player)),
+                    self.game.make_current_game_state(player)
+                )
+
+    def test_owners(self):
+        play_until_phase(self.game, Game.GamePhase.GUESSING)
+        for player in self.game.players:
+            cards = self.game.make_current_game_state(player)["Table"]["Cards"]
+            owners = [card["Owner"] for card in cards if card["Owner"]]
+            self.assertEqual(len(owners), 1)
+            self.assertEqual(owners[0]["Name"], player.name)
+        play_until_phase(self.game, Game.GamePhase.INTERLUDE)
+        state = self.game.make_current_game_state(self.game.players[0])
+        self.assertEqual(
+            sorted(card["Owner"]["Name"] for card in state["Table"]["Cards"]),
+            sorted(player.name for player in self.game.players)
+        )
+
+
+# the timing wheel may fire a tick late
+TICK = 0.1
+
+
+class FakeConnection:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, data: str) -> None:
+        self.messages.append(json.loads(data))
+
+    def last(self, kind: str):
+        for message in reversed(self.messages):
+            if message == kind or message[0] == kind:
+                return message
+
+
+class RawConnection(FakeConnection):
+    """Also keeps the sent strings."""
+
+    def __init__(self):
+        super().__init__()
+        self.raw = []
+
+    def send(self, data: str) -> None:
+        self.raw.append(data)
+        super().send(data)
+
+
+class FakeTimer:
+    def __init__(self, transport, due, func, args):
+        self.transport = transport
+        self.due = due
+        self.call = (func, args)
+
+    def cancel(self):
+        if self in self.transport.timers:
+            self.transport.timers.remove(self)
+
+
+class ManualTransport(Transport):
+    """Runs spawned work at once and timers on demand."""
+
+    def __init__(self):
+        self.timers = []
+        self.now = 0.0
+
+    def spawn(self, func, *args):
+        func(*args)
+
+    def call_later(self, delay, func, *args):
+        timer = FakeTimer(self, self.now + delay, func, args)
+        self.timers.append(timer)
+        return timer
+
+    def time(self):
+        return self.now
+
+    def run_in_thread(self, func, *args):
+        func(*args)
+
+    def run_timers(self, seconds):
+        """Moves the clock forward running the timers due."""
+        end = self.now + seconds
+        while True:
+            due = [timer for timer in self.timers if timer.due <= end]
+            if not due:
+                break
+            timer = min(due, key=lambda timer: timer.due)
+            self.timers.remove(timer)
+            self.now = max(self.now, timer.due)
+            func, args = timer.call
+            func(*args)
+        self.now = end
+
+
+def use_rooms(test_case: unittest.TestCase) -> ManualTransport:
+    """Gives rooms a clean lobby driven by ManualTransport."""
+    transport = ManualTransport()
+    for name, value in [("main_lobby", rooms.Lobby(transport)),
+                        ("ws_to_player", {}), ("player_to_ws", {})]:
+        patcher = mock.patch.object(rooms, name, value)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+    patcher = mock.patch.dict(rooms.GameBackend.backend, clear=True)
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    return transport
+
+
+def send(ws, *message) -> None:
+    rooms.handle_message(ws, json.dumps(list(message)))
+
+
+def start_room(count: int = 3) -> List[FakeConnection]:
+    """Connects clients and seats them in one new room."""
+    clients = [FakeConnection() for _ in range(count)]
+    for ws in clients:
+        rooms.connect(ws)
+    send(clients[0], "JoinRoom", "")
+    room_id = clients[0].last("RoomUpdate")[1]["ID"]
+    for ws in clients[1:]:
+        send(ws, "JoinRoom", room_id)
+    return clients
+
+
+class TestRooms(unittest.TestCase):
+    def setUp(self):
+        use_test_pack(self)
+        self.transport = use_rooms(self)
+
+    def test_join_starts_game(self):
+        clients = start_room()
+        for ws in clients:
+            self.assertEqual(ws.last("RoomUpdate")[1]["Phase"],
+                             "Storytelling")
+
+    def test_unknown_room(self):
+        ws = FakeConnection()
+        rooms.connect(ws)
+        send(ws, "JoinRoom", "1")
+        self.assertEqual(ws.messages, ["FailConnect"])
+
+    def test_malformed_message(self):
+        ws = FakeConnection()
+        rooms.connect(ws)
+        rooms.handle_message(ws, "{")
+        send(ws, "EndTurn")
+        self.assertEqual(ws.messages, [])
+
+    def play_to_interlude(self, clients):
+        game = rooms.game_by_ws(clients[0]).game
+        by_player = {rooms.ws_to_player[ws]: ws for ws in clients}
+        storyteller = game.get_cur_player()
+        send(by_player[storyteller], "SelectCard",
+             game.hands[storyteller][0].id)
+        send(by_player[storyteller], "TellStory", "story")
+        for player, ws in by_player.items():
+            if player is not storyteller:
+                send(ws, "SelectCard", game.hands[player][0].id)
+                send(ws, "EndTurn")
+        for player, ws in by_player.items():
+            if player is not storyteller:
+                send(ws, "SelectCard", game.lead_card.id)
+                send(ws, "EndTurn")
+        return game
+
+    def test_round(self):
+        clients = start_room()
+        game = self.play_to_interlude(clients)
+        self.assertEqual(game.get_state(), Game.GamePhase.INTERLUDE)
+        self.assertIn("interlude", rooms.game_by_ws(clients[0]).scheduler)
+        self.transport.run_timers(rooms.GameBackend.interlude_time)
+        self.assertEqual(game.get_state(), Game.GamePhase.STORYTELLING)
+        for ws in clients:
+            self.assertEqual(ws.last("RoomUpdate")[1]["Phase"],
+                             "Storytelling")
+
+    def test_victory_single_update(self):
+        clients = start_room()
+        game = self.play_to_interlude(clients)
+        winner = game.players[0]
+        game.result[winner] = game.settings["win_score"]
+        sent = [len(ws.messages) for ws in clients]
+        self.transport.run_timers(rooms.GameBackend.interlude_time)
+        self.assertEqual(game.get_state(), Game.GamePhase.VICTORY)
+        for ws, count in zip(clients, sent):
+            updates = [message for message in ws.messages[count:]
+                       if message[0] == "RoomUpdate"]
+            self.assertEqual(len(updates), 1)
+            self.assertEqual(updates[0][1]["Phase"], "Victory")
+
+    def test_autoplay(self):
+        clients = start_room()
+        game = rooms.game_by_ws(clients[0]).game
+        players = {ws: AutoPlayer() for ws in clients}
+        for turn in range(1, 4):
+            for _ in range(4):
+                for ws, player in players.items():
+                    for message in player.moves(ws.last("RoomUpdate")[1]):
+                        send(ws, *message)
+            self.assertEqual(game.get_state(), Game.GamePhase.INTERLUDE)
+            self.assertTrue(game.guesses)
+            self.transport.run_timers(rooms.GameBackend.interlude_time)
+            self.assertEqual(game.turn, turn % len(clients))
+
+    def test_game_log(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        rooms.main_lobby.game_logs = directory.name
+        clients = start_room()
+        game = self.play_to_interlude(clients)
+        send(clients[1], "UpdateInfo", {"Name": "renamed"})
+        view = game_view(game)
+        path = os.path.join(directory.name, f"{game.id}.jsonl")
+        for ws in clients:
+            rooms.disconnect(ws)
+        with open(path) as lines:
+            replayed = gamelog.replay(lines, view["Version"])
+        self.assertEqual(game_view(replayed), view)
+        Game.delete_game(replayed.id)
+
+    def test_timers_cancelled_when_room_empties(self):
+        clients = start_room()
+        game = self.play_to_interlude(clients)
+        self.assertEqual(game.get_state(), Game.GamePhase.INTERLUDE)
+        backend = rooms.game_by_ws(clients[0])
+        self.assertIn("interlude", backend.scheduler)
+        for ws in clients:
+            rooms.disconnect(ws)
+        self.assertEqual(backend.scheduler.timers, {})
+        self.assertEqual(len(rooms.main_lobby.wheel), 0)
+
+    def test_stale_timer(self):
+        clients = start_room()
+        game = self.play_to_interlude(clients)
+        backend = rooms.game_by_ws(clients[0])
+        backend.start_round()
+        version = game.version
+        self.transport.run_timers(rooms.GameBackend.interlude_time)
+        self.assertEqual(game.version, version)
+
+    def test_storyteller_timeout(self):
+        clients = start_room()
+        game = rooms.game_by_ws(clients[0]).game
+        storyteller = game.get_cur_player()
+        self.transport.run_timers(game.settings["move_time"] + TICK)
+        self.assertEqual(game.get_state(), Game.GamePhase.STORYTELLING)
+        self.assertIsNot(game.get_cur_player(), storyteller)
+        self.transport.run_timers(game.settings["move_time"] + TICK)
+        self.assertEqual(game.turn, 2)
+
+    def test_listener_timeouts(self):
+        clients = start_room()
+        game = rooms.game_by_ws(clients[0]).game
+        by_player = {rooms.ws_to_player[ws]: ws for ws in clients}
+        storyteller = game.get_cur_player()
+        send(by_player[storyteller], "SelectCard",
+             game.hands[storyteller][0].id)
+        send(by_player[storyteller], "TellStory", "story")
+        self.transport.run_timers(game.settings["move_time"] - 1)
+        self.assertEqual(game.get_state(), Game.GamePhase.MATCHING)
+        self.transport.run_timers(1 + TICK)
+        self.assertEqual(game.get_state(), Game.GamePhase.GUESSING)
+        self.assertEqual(len(game.current_table), 3)
+        scores = dict(game.result)
+        self.transport.run_timers(game.settings["move_time"] + TICK)
+        self.assertEqual(game.get_state(), Game.GamePhase.INTERLUDE)
+        self.assertEqual(game.result, scores)
+
+    def test_delta_client(self):
+        clients = start_room()
+        send(clients[0], "EnableDelta")
+        snapshot = clients[0].last("RoomSnapshot")[1]
+        send(clients[0], "Ack", snapshot["Version"])
+        send(clients[1], "UpdateInfo", {"Name": "renamed"})
+        patch = clients[0].last("RoomPatch")[1]
+        self.assertEqual(patch["Base"], snapshot["Version"])
+        state = apply_patch(snapshot["State"], patch["Ops"])
+        self.assertIn("renamed",
+                      [opponent["Name"] for opponent in state["Opponents"]])
+
+    def test_disconnect(self):
+        clients = start_room()
+        backend = rooms.game_by_ws(clients[0])
+        rooms.disconnect(clients[0])
+        self.assertNotIn(clients[0], rooms.ws_to_player)
+        self.assertNotIn(clients[0], backend.clients)
+
+    def test_leave_room(self):
+        clients = start_room()
+        game = rooms.game_by_ws(clients[0]).game
+        for ws in clients:
+            send(ws, "LeaveRoom")
+            self.assertIn(ws, rooms.main_lobby.clients)
+            self.assertIsNone(rooms.game_by_ws(ws))
+        self.assertEqual(rooms.main_lobby.backends, {})
+        self.assertIsNone(Game.get_game(game.id))
+        self.assertEqual(len(rooms.main_lobby.wheel), 0)
+
+    def test_idle_room_evicted(self):
+        clients = start_room()
+        game = rooms.game_by_ws(clients[0]).game
+        # moves made on timeout keep the game going but not the room
+        self.transport.run_timers(rooms.GameBackend.idle_time + TICK)
+        self.assertEqual(rooms.main_lobby.backends, {})
+        self.assertIsNone(Game.get_game(game.id))
+        for ws in clients:
+            self.assertEqual(ws.messages[-1], "FailConnect")
+            self.assertIn(ws, rooms.main_lobby.clients)
+        send(clients[0], "JoinRoom", "")
+        self.assertEqual(clients[0].last("RoomUpdate")[0], "RoomUpdate")
+
+    def test_quick_join(self):
+        clients = [FakeConnection() for _ in range(5)]
+        for ws in clients:
+            rooms.connect(ws)
+        send(clients[0], "QuickJoin")
+        send(clients[1], "QuickJoin")
+        first = rooms.game_by_ws(clients[0])
+        self.assertIs(rooms.game_by_ws(clients[1]), first)
+        send(clients[2], "JoinRoom", "")
+        second = rooms.game_by_ws(clients[2])
+        self.assertEqual(rooms.main_lobby.open_rooms.seats,
+                         {first.game.id: 1, second.game.id: 2})
+        # the fullest room is filled first and leaves the index on start
+        send(clients[3], "QuickJoin")
+        self.assertIs(rooms.game_by_ws(clients[3]), first)
+        self.assertEqual(first.game.get_state(), Game.GamePhase.STORYTELLING)
+        self.assertNotIn(first.game.id, rooms.main_lobby.open_rooms)
+        send(clients[4], "QuickJoin")
+        self.assertIs(rooms.game_by_ws(clients[4]), second)
+        send(clients[4], "LeaveRoom")
+        self.assertEqual(rooms.main_lobby.open_rooms.seats,
+                         {second.game.id: 2})
+        rooms.disconnect(clients[2])
+        self.assertEqual(len(rooms.main_lobby.open_rooms), 0)
+        send(clients[4], "QuickJoin")
+        self.assertIsNot(rooms.game_by_ws(clients[4]), second)
+
+    def test_room_feed(self):
+        watchers = [RawConnection() for _ in range(2)]
+        for ws in watchers:
+            rooms.connect(ws)
+            send(ws, "WatchRooms")
+            self.assertEqual(ws.last("RoomList"), ["RoomList", []])
+        clients = start_room()
+        self.transport.run_timers(rooms.main_lobby.feed.interval)
+        game_id = str(rooms.game_by_ws(clients[0]).game.id)
+        patch = watchers[0].last("RoomListPatch")
+        self.assertEqual(patch[1], [["Add", {
+            "ID": game_id, "Players": 3, "Phase": "Storytelling",
+            "Pack": "test"
+        }]])
+        # one encoded message for all watchers
+        self.assertIs(watchers[0].raw[-1], watchers[1].raw[-1])
+        send(watchers[1], "UnwatchRooms")
+        for ws in clients:
+            rooms.disconnect(ws)
+        self.transport.run_timers(rooms.main_lobby.feed.interval)
+        self.assertEqual(watchers[0].last("RoomListPatch")[1],
+                         [["Remove", game_id]])
+        self.assertEqual(len(watchers[1].messages), 2)
+        send(watchers[0], "QuickJoin")
+        self.assertEqual(dict(rooms.main_lobby.feed.watchers), {})
+
+    def test_memory_stats(self):
+        start_room()
+        stats = rooms.memory_stats()
+        self.assertEqual(stats["Rooms"], 1)
+        self.assertEqual(stats["Players"], 3)
+        self.assertGreater(stats["Bytes"], 0)
+
+
+class TestOpenRooms(unittest.TestCase):
+    def test_fullest(self):
+        index = OpenRooms()
+        self.assertIsNone(index.fullest())
+        index.update(1, 2)
+        index.update(2, 1)
+        index.update(3, 1)
+        self.assertEqual(index.fullest(), 2)
+        index.update(2, 0)
+        self.assertEqual(index.fullest(), 3)
+        index.discard(3)
+        self.assertEqual(index.fullest(), 1)
+        self.assertEqual(index.buckets, {2: {1: None}})
+        index.discard(3)
+        self.assertEqual(len(index), 1)
+
+
+class TestLogs(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("app.test")
+        self.addCleanup(setattr, self.logger, "handlers", [])
+
+    def record(self, name="app.frames", level=logging.DEBUG):
+        return logging.makeLogRecord({"name": name, "levelno": level,
+                                      "msg": "%s", "args": ("frame",)})
+
+    def test_rate_limit(self):
+        rules = {"app.frames": Rule(rate=10)}
+        sampler = SamplingFilter(rules)
+        passed = sum(sampler.filter(self.record("app.frames.x"))
+                     for _ in range(100))
+        self.assertEqual(passed, 10)
+        self.assertEqual(rules["app.frames"].dropped, 90)
+        self.assertTrue(sampler.filter(self.record(level=logging.WARNING)))
+        self.assertTrue(sampler.filter(self.record("app")))
+
+    def test_sample(self):
+        sampler = SamplingFilter({"app": Rule(sample=0.1)})
+        with mock.patch("random.random", side_effect=[0.05, 0.5]):
+            self.assertTrue(sampler.filter(self.record()))
+            self.assertFalse(sampler.filter(self.record()))
+
+    def test_json_lines(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        self.logger.addHandler(handler)
+        self.logger.warning("Game %s", 1, extra={"game": 1})
+        data = json.loads(stream.getvalue())
+        self.assertEqual(data["message"], "Game 1")
+        self.assertEqual(data["game"], 1)
+        self.assertEqual(data["logger"], "app.test")
+
+    def test_full_queue_drops(self):
+        log_queue = queue.Queue(1)
+        handler = DroppingQueueHandler(log_queue)
+        self.logger.addHandler(handler)
+        for i in range(3):
+            self.logger.warning("message %s", i)
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(log_queue.get_nowait().msg, "message 0")
+
+
+def has_pillow() -> bool:
+    try:
+        import PIL  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def has_numpy() -> bool:
+    try:
+        import numpy  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@unittest.skipIf(not has_numpy(), "numpy is not installed")
+class TestMonteCarlo(unittest.TestCase):
+    def setUp(self):
+        use_test_pack(self)
+
+    def test_matches_game(self):
+        import montecarlo
+        for rule_set in [montecarlo.IMAGINARIUM, montecarlo.DIXIT]:
+            for players in [3, 4, 6]:
+                self.assertEqual(montecarlo.cross_check(
+                    20, players, rule_set=rule_set, seed=players
+                ), [])
+
+    def test_distributions(self):
+        import numpy as np
+        import montecarlo
+        simulation = montecarlo.simulate(10000, 4, win_score=40,
+                                         rng=np.random.default_rng(0))
+        best = simulation.scores.max(axis=1)
+        self.assertTrue((best >= 40).all())
+        self.assertTrue((simulation.rounds >= 10).all())
+        self.assertTrue((best == simulation.scores[
+            np.arange(10000), simulation.winners]).all())
+
+
+def game_view(game: Game) -> dict:
+    """State of the game with cards as pictures, card ids differ
+    between a game and its replay."""
+    return {
+        "Version": game.version,
+        "State": game.state.name,
+        "Players": [player.id for player in game.players],
+        "Result": {player.id: score for player, score in game.result.items()},
+        "Hands": {player.id: [card.picture for card in hand]
+                  for player, hand in game.hands.items()},
+        "Table": [[card.picture, player.id]
+                  for card, player in game.current_table.items()],
+        "Deck": [game.deck.remaining, sorted(game.deck.swaps.items()),
+                 [card.picture for card in game.deck.returned]],
+        "Turn": game.turn,
+    }
+
+
+class TestGameLog(unittest.TestCase):
+    def setUp(self):
+        use_test_pack(self)
+        self.game = Game(seed=1)
+        self.log = GameLog(self.game, snapshot_every=10)
+        for i in range(1, 5):
+            self.game.add_player(Player(str(i)))
+
+    def test_same_seed_same_deal(self):
+        other = Game(seed=1)
+        for player in self.game.players:
+            other.add_player(Player(player.name, id=player.id))
+        self.game.start_game()
+        other.start_game()
+        self.assertEqual(game_view(other), game_view(self.game))
+
+    def test_replay(self):
+        views = []
+        for _ in range(3):
+            play_until_phase(self.game, Game.GamePhase.GUESSING,
+                             enable_random=True)
+            self.game.make_random_bet(self.game.players[0])
+            views.append(game_view(self.game))
+            play_until_phase(self.game, Game.GamePhase.STORYTELLING,
+                             enable_random=True)
+        self.game.update_player(self.game.players[1], "renamed", None)
+        views.append(game_view(self.game))
+        self.assertGreater(len(self.log.lines), 3 * 10)
+        for view in views:
+            replayed = gamelog.replay(self.log.lines, view["Version"])
+            self.assertEqual(game_view(replayed), view)
+        replayed = gamelog.replay(self.log.lines)
+        self.assertEqual(game_view(replayed), views[-1])
+        self.assertIn("renamed", [player.name for player in replayed.players])
+
+    def test_replay_detects_divergence(self):
+        self.game.start_game()
+        self.log.lines.insert(1, '[0,"touch"]')
+        with self.assertRaises(gamelog.ReplayError):
+            gamelog.replay(self.log.lines)
+
+    def test_every_mutation_is_recorded(self):
+        mutations = [name for name, method in vars(Game).items()
+                     if inspect.isfunction(method) and
+                     hasattr(method, "__wrapped__")]
+        self.assertEqual(sorted(mutations), sorted(gamelog.ARGUMENTS))
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        use_test_pack(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.transport = use_rooms(self)
+
+    def test_changed_games_only(self):
+        snapshots = Snapshots(self.directory)
+        game = make_game()
+        self.assertTrue(snapshots.mark(game.id, game))
+        batch = snapshots.collect()
+        self.assertEqual(len(batch), 1)
+        self.assertIsNone(snapshots.collect())
+        snapshots.write(batch)
+        self.assertFalse(snapshots.mark(game.id, game))
+        self.assertEqual(snapshots.collect(), [])
+        game.start_game()
+        snapshots.mark(game.id, game)
+        snapshots.write(snapshots.collect())
+        self.assertEqual(Snapshots(self.directory).load(),
+                         [json.loads(json.dumps(game.to_dict()))])
+        snapshots.mark(game.id, None)
+        snapshots.write(snapshots.collect())
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_restore_and_resume(self):
+        rooms.main_lobby.snapshots = Snapshots(self.directory, interval=1)
+        clients = start_room()
+        game = rooms.game_by_ws(clients[0]).game
+        storyteller = game.get_cur_player()
+        by_player = {rooms.ws_to_player[ws]: ws for ws in clients}
+        send(by_player[storyteller], "SelectCard",
+             game.hands[storyteller][0].id)
+        send(by_player[storyteller], "TellStory", "story")
+        self.transport.run_timers(1)
+        view = game_view(game)
+        tokens = [ws.last("Session")[1] for ws in clients]
+        # the process dies with the room
+        Game.delete_game(game.id)
+        game.release_cards()
+
+        self.transport = use_rooms(self)
+        rooms.main_lobby.snapshots = Snapshots(self.directory, interval=1)
+        self.assertEqual(rooms.restore_rooms(), 1)
+        restored = rooms.main_lobby.backends[game.id]
+        self.assertEqual(game_view(restored.game), view)
+        self.assertIn("move", restored.scheduler)
+        ws = FakeConnection()
+        rooms.connect(ws)
+        send(ws, "Resume", tokens[1])
+        self.assertEqual(ws.last("RoomUpdate")[1]["ID"], str(game.id))
+        self.assertEqual(rooms.ws_to_player[ws].token, tokens[1])
+        other = FakeConnection()
+        rooms.connect(other)
+        send(other, "Resume", tokens[1])
+        self.assertEqual(other.messages[-1], "FailConnect")
+        rooms.disconnect(ws)
+        self.transport.run_timers(1)
+        # kept for the others until it is closed as idle
+        self.assertNotEqual(os.listdir(self.directory), [])
+        self.transport.run_timers(rooms.GameBackend.idle_time)
+        self.assertEqual(rooms.main_lobby.absent, {})
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+    def test_resume_after_other_leaves(self):
+        rooms.main_lobby.snapshots = Snapshots(self.directory, interval=1)
+        clients = start_room(2)
+        game = rooms.game_by_ws(clients[0]).game
+        self.transport.run_timers(1)
+        tokens = [ws.last("Session")[1] for ws in clients]
+        Game.delete_game(game.id)
+        game.release_cards()
+
+        self.transport = use_rooms(self)
+        rooms.main_lobby.snapshots = Snapshots(self.directory, interval=1)
+        self.assertEqual(rooms.restore_rooms(), 1)
+        first = FakeConnection()
+        rooms.connect(first)
+        send(first, "Resume", tokens[0])
+        rooms.disconnect(first)
+        # the room waits for the player who has not come back yet
+        self.assertIn(game.id, rooms.main_lobby.backends)
+        second = FakeConnection()
+        rooms.connect(second)
+        send(second, "Resume", tokens[1])
+        self.assertEqual(second.last("RoomUpdate")[1]["ID"], str(game.id))
+        rooms.disconnect(second)
+        self.assertEqual(rooms.main_lobby.backends, {})
+        self.assertEqual(rooms.main_lobby.absent, {})
+
+class TestPacks(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = os.path.join(directory.name, "public")
+        self.manifest = os.path.join(directory.name, "manifest.json")
+        for pack in ("cats", "dogs"):
+            os.makedirs(os.path.join(self.root, pack))
+        self.write("cats/a.jpg", b"a")
+        self.write("cats/b.JPG", b"b")
+        self.write("dogs/a.jpg", b"a")
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), "wb") as file:
+            file.write(data)
+
+    def stored(self):
+        return sorted(os.listdir(os.path.join(self.root, packs.STORE)))
+
+    def update(self):
+        hashed = []
+        content_name = packs.content_name
+
+        def counting(path):
+            hashed.append(path)
+            return content_name(path)
+        with mock.patch("packs.content_name", counting):
+            result = packs.update_store(self.root, self.manifest, 2)
+        return result, len(hashed)
+
+    def test_store(self):
+        result, hashed = self.update()
+        self.assertEqual(hashed, 3)
+        a, b = packs.content_name(os.path.join(self.root, "cats/a.jpg")), \
+            packs.content_name(os.path.join(self.root, "cats/b.JPG"))
+        self.assertTrue(b.endswith(".jpg"))
+        self.assertEqual(result, {"cats": [a, b], "dogs": [a]})
+        self.assertEqual(self.stored(), sorted([a, b]))
+        with open(os.path.join(self.root, packs.STORE, a), "rb") as file:
+            self.assertEqual(file.read(), b"a")
+
+    def test_unchanged(self):
+        first, _ = self.update()
+        second, hashed = self.update()
+        self.assertEqual(hashed, 0)
+        self.assertEqual(first, second)
+
+    def test_changed_and_removed(self):
+        first, _ = self.update()
+        old = first["cats"][0]
+        # written in place, the stored link to it changes as well
+        self.write("cats/a.jpg", b"changed")
+        os.utime(os.path.join(self.root, "cats/a.jpg"), ns=(1, 1))
+        os.remove(os.path.join(self.root, "cats/b.JPG"))
+        result, hashed = self.update()
+        self.assertEqual(hashed, 1)
+        new = result["cats"][0]
+        self.assertEqual(result, {"cats": [new], "dogs": [old]})
+        self.assertEqual(self.stored(), sorted([old, new]))
+        with open(os.path.join(self.root, packs.STORE, old), "rb") as file:
+            self.assertEqual(file.read(), b"a")
+
+    def test_card_variants(self):
+        patcher = mock.patch.dict(Pack.pack_ids, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pictures = [f"{i}.jpg" for i in range(100)]
+        variants = {picture: {variant: {"webp": f"{variant}-{picture}.webp",
+                                        "jpeg": f"{variant}-{picture}.jpg"}
+                              for variant in ("thumb", "full")}
+                    for picture in pictures[:50]}
+        Pack("variants", pictures, variants)
+        game = make_game()
+        play_until_phase(game, Game.GamePhase.GUESSING)
+        state = game.make_current_game_state(game.players[0])
+        for card in state["Hand"]["Cards"] + state["Table"]["Cards"]:
+            picture = Card.card_ids[card["ID"]].picture
+            self.assertEqual(card["Picture"], picture)
+            expected = variants.get(picture, {})
+            self.assertEqual(card["Thumb"], expected.get("thumb"))
+            self.assertEqual(card["Full"], expected.get("full"))
+
+
+@unittest.skipIf(not has_pillow(), "Pillow is not installed")
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        from PIL import Image
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = os.path.join(directory.name, "public")
+        self.manifest = os.path.join(directory.name, "manifest.json")
+        for pack in ("cats", "dogs"):
+            os.makedirs(os.path.join(self.root, pack))
+        picture = Image.merge("RGB", [
+            Image.linear_gradient("L").resize((1200, 900)),
+            Image.radial_gradient("L").resize((1200, 900)),
+            Image.effect_noise((1200, 900), 40)])
+        picture.save(os.path.join(self.root, "cats", "big.jpg"))
+        picture.save(os.path.join(self.root, "dogs", "same.jpg"))
+        with open(os.path.join(self.root, "dogs", "broken.jpg"), "w") as file:
+            file.write("not a picture")
+
+    def test_variants(self):
+        import ingest
+        from PIL import Image
+        processed, failed = ingest.ingest(self.root, self.manifest, 1)
+        self.assertEqual(processed, 2)
+        self.assertEqual(len(failed), 1)
+        variants = packs.read_variants(self.manifest)
+        picture = packs.update_store(self.root, self.manifest)["cats"][0]
+        self.assertEqual(variants[failed[0]], {})
+        store = os.path.join(self.root, packs.STORE)
+        for variant, (width, height, budget) in ingest.VARIANTS.items():
+            for kind, name in variants[picture][variant].items():
+                path = os.path.join(store, name)
+                self.assertLessEqual(os.path.getsize(path), budget)
+                with Image.open(path) as image:
+                    self.assertEqual(image.size, (width, height))
+                    self.assertEqual(image.format,
+                                     ingest.FORMATS[kind][0])
+
+        self.assertEqual(ingest.ingest(self.root, self.manifest, 1),
+                         (0, []))
+        os.remove(os.path.join(self.root, "cats", "big.jpg"))
+        os.remove(os.path.join(self.root, "dogs", "same.jpg"))
+        ingest.ingest(self.root, self.manifest, 1)
+        self.assertNotIn(picture, packs.read_variants(self.manifest))
+        self.assertEqual(
+            os.listdir(os.path.join(store, ingest.DIRECTORY)), [])
+
+
+class TestStatic(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        os.makedirs(os.path.join(self.directory, "variants"))
+        for name, size in [("a.jpg", 100), ("b.jpg", 100), ("c.jpg", 300),
+                           ("variants/a-thumb.webp", 10)]:
+            with open(os.path.join(self.directory, name), "wb") as file:
+                file.write(name[0].encode() * size)
+
+    def get(self, app, path, **headers):
+        environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path}
+        environ.update(headers)
+        response = dict()
+
+        def start_response(status, headers):
+            response["status"] = status
+            response["headers"] = dict(headers)
+        body = b"".join(app(environ, start_response))
+        return response["status"], response["headers"], body
+
+    def test_cache(self):
+        files = StaticFiles(self.directory, immutable=True, cache_bytes=200,
+                            max_cached=200)
+        status, headers, body = self.get(files, "/a.jpg")
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(body, b"a" * 100)
+        self.assertEqual(headers["ETag"], '"a.jpg"')
+        self.assertEqual(headers["Content-Type"], "image/jpeg")
+        self.assertIn("immutable", headers["Cache-Control"])
+        self.get(files, "/a.jpg")
+        self.assertEqual(files.reads, 1)
+        # too large for the cache, read every time
+        self.assertEqual(self.get(files, "/c.jpg")[2], b"c" * 300)
+        self.get(files, "/c.jpg")
+        self.assertEqual(files.reads, 3)
+        self.get(files, "/b.jpg")
+        self.get(files, "/variants/a-thumb.webp")
+        self.assertEqual(list(files.cache),
+                         ["b.jpg", "variants/a-thumb.webp"])
+        self.assertEqual(files.cached, 110)
+
+    def test_conditional(self):
+        files = StaticFiles(self.directory, immutable=True)
+        with mock.patch("os.stat", side_effect=AssertionError):
+            status, headers, body = self.get(
+                files, "/a.jpg", HTTP_IF_NONE_MATCH='W/"x", "a.jpg"')
+        self.assertEqual(status, "304 Not Modified")
+        self.assertEqual(body, b"")
+        self.assertEqual(files.reads, 0)
+
+        bundle = StaticFiles(self.directory)
+        etag = self.get(bundle, "/a.jpg")[1]["ETag"]
+        self.assertNotEqual(etag, '"a.jpg"')
+        with mock.patch("os.stat", side_effect=AssertionError):
+            status, headers, _ = self.get(bundle, "/a.jpg",
+                                          HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status, "304 Not Modified")
+        self.assertEqual(headers["Cache-Control"], "no-cache")
+
+    def test_not_found(self):
+        files = StaticFiles(os.path.join(self.directory, "variants"))
+        for path in ["/missing.jpg", "/../a.jpg", "/", "/x/..//a.jpg"]:
+            self.assertEqual(self.get(files, path)[0], "404 Not Found")
+
+    def test_mount(self):
+        def app(environ, start_response):
+            start_response("200 OK", [])
+            return [b"app"]
+        files = StaticFiles(self.directory, immutable=True)
+        wsgi_app = mount(app, ("/img/", files, False),
+                         ("/", StaticFiles(self.directory), True))
+        self.assertEqual(self.get(wsgi_app, "/img/b.jpg")[2], b"b" * 100)
+        self.assertEqual(self.get(wsgi_app, "/img/x.jpg")[0],
+                         "404 Not Found")
+        self.assertEqual(self.get(wsgi_app, "/c.jpg")[2], b"c" * 300)
+        self.assertEqual(self.get(wsgi_app, "/id/1")[2], b"app")
+        self.assertEqual(self.get(wsgi_app, "/")[2], b"app")
+
+
+class TestGameRunner(unittest.TestCase):
+    def setUp(self):
+        use_test_pack(self)
+
+    def test_shard(self):
+        games = Game.count_games()
+        result = gamerunner.run_shard(0, 0, 20, 4)
+        self.assertEqual(result.games, 20)
+        self.assertGreaterEqual(result.rounds, 20 * 10)
+        self.assertEqual(result.violations, [])
+        self.assertEqual(Game.count_games(), games)
+
+    def test_seed_replays_game(self):
+        def scores(seed):
+            game, rounds, _ = gamerunner.play_game(seed, 5)
+            result = [(player.name, score)
+                      for player, score in game.result.items()]
+            gamerunner.forget(game)
+            return rounds, result
+
+        self.assertEqual(scores(7), scores(7))
+        self.assertNotEqual(scores(7), scores(8))
+
+    def test_invariants(self):
+        game = make_game()
+        play_until_phase(game, Game.GamePhase.MATCHING)
+        self.assertEqual(gamerunner.check_invariants(game), [])
+        game.result[game.players[0]] = -1
+        game.hands[game.players[1]].append(game.hands[game.players[2]][0])
+        kinds = [kind for kind, _ in gamerunner.check_invariants(game)]
+        self.assertEqual(kinds, ["negative score", "duplicate card",
+                                 "deck conservation"])
+        gamerunner.forget(game)
+
+
+class TestLifecycle(unittest.TestCase):
+    """Rooms and cards do not outlive their players."""
+    cycles = 300
+
+    def setUp(self):
+        use_test_pack(self)
+        self.transport = use_rooms(self)
+        # cards left by other tests would make the dict resize mid-test
+        patcher = mock.patch.dict(Card.card_ids, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cycle(self):
+        clients = start_room()
+        TestRooms.play_to_interlude(self, clients)
+        self.transport.run_timers(rooms.GameBackend.interlude_time)
+        for ws in clients:
+            rooms.disconnect(ws)
+
+    def test_soak(self):
+        import gc
+        import tracemalloc
+
+        cards = len(Card.card_ids)
+        games = Game.count_games()
+        self.cycle()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            for _ in range(self.cycles // 10):
+                self.cycle()
+            gc.collect()
+            before = tracemalloc.get_traced_memory()[0]
+            for _ in range(self.cycles):
+                self.cycle()
+            gc.collect()
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(Card.card_ids), cards)
+        self.assertEqual(Game.count_games(), games)
+        self.assertEqual(rooms.main_lobby.backends, {})
+        self.assertEqual(rooms.ws_to_player, {})
+        self.assertEqual(rooms.player_to_ws, {})
+        self.assertEqual(rooms.GameBackend.backend, {})
+        self.assertEqual(len(rooms.main_lobby.wheel), 0)
+        # a leak of even a hundred bytes per room would show up here
+        self.assertLess(after - before, 50 * 1024)
+
+
+def redis_client():
+    """Client of a local redis-server or None if there is none."""
+    try:
+        import redis
+        client = redis.Redis()
+        client.ping()
+        return client
+    except Exception:
+        return None
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        use_test_pack(self)
+        self.game = make_game()
+
+    def make_store(self):
+        return MemoryStore()
+
+    def test_round_trip(self):
+        for phase in [Game.GamePhase.STORYTELLING, Game.GamePhase.GUESSING,
+                      Game.GamePhase.INTERLUDE]:
+            play_until_phase(self.game, phase)
+            copy = Game.from_dict(json.loads(json.dumps(self.game.to_dict())))
+            self.assertEqual(copy.version, self.game.version)
+            by_id = {player.id: player for player in copy.players}
+            for player in self.game.players:
+                self.assertEqual(
+                    copy.make_current_game_state(by_id[player.id]),
+                    self.game.make_current_game_state(player)
+                )
+        play_until_phase(copy, Game.GamePhase.GUESSING)
+
+    def test_optimistic_save(self):
+        store = self.make_store()
+        store.save(self.game, None)
+        self.addCleanup(store.delete, self.game.id)
+        with self.assertRaises(VersionConflict):
+            store.save(self.game, None)
+        base = self.game.version
+        self.game.start_game()
+        store.save(self.game, base)
+        version, data = store.load(self.game.id)
+        self.assertEqual(version, self.game.version)
+        self.assertEqual(data["State"], "STORYTELLING")
+        with self.assertRaises(VersionConflict):
+            store.save(self.game, base)
+        self.assertIn(self.game.id, store.game_ids())
+
+    def test_workers_share_room(self):
+        use_rooms(self)
+        store = rooms.main_lobby.store = self.make_store()
+        clients = start_room()
+        backend = rooms.game_by_ws(clients[0])
+        self.addCleanup(store.delete, backend.game.id)
+        version, data = store.load(backend.game.id)
+        self.assertEqual(version, backend.game.version)
+        other = rooms.GameBackend(Game.from_dict(data))
+        other.stored_version = version
+        send(clients[1], "UpdateInfo", {"Name": "renamed"})
+        other.transact(other.game.touch)
+        self.assertIn("renamed",
+                      [player.name for player in other.game.players])
+        send(clients[2], "UpdateInfo", {"Name": "again"})
+        self.assertIn("again",
+                      [player.name for player in backend.game.players])
+        self.assertEqual(store.version(backend.game.id), backend.game.version)
+
+
+@unittest.skipIf(redis_client() is None, "no local redis-server")
+class TestRedisStore(TestStore):
+    def make_store(self):
+        return RedisStore(redis_client(), prefix="imaginarium-test")
+
+
+class TestFanout(unittest.TestCase):
+    def setUp(self):
+        self.broker = MemoryBroker()
+        self.fanout = Fanout(self.broker)
+        self.received = []
+        Fanout(self.broker).listen(
+            lambda game_id, version: self.received.append((game_id, version))
+        )
+
+    def test_batching(self):
+        self.assertTrue(self.fanout.mark(1, 1))
+        self.assertFalse(self.fanout.mark(1, 2))
+        self.assertFalse(self.fanout.mark(2, 1))
+        self.fanout.flush()
+        self.assertEqual(self.broker.published, 2)
+        self.assertEqual(sorted(self.received), [(1, 2), (2, 1)])
+        self.fanout.flush()
+        self.assertEqual(self.broker.published, 2)
+
+    def test_own_messages_skipped(self):
+        own = []
+        self.fanout.listen(lambda *args: own.append(args))
+        self.fanout.mark(1, 1)
+        self.fanout.flush()
+        self.assertEqual(own, [])
+
+    def test_room_burst(self):
+        use_test_pack(self)
+        transport = use_rooms(self)
+        rooms.main_lobby.store = MemoryStore()
+        rooms.main_lobby.fanout = self.fanout
+        clients = start_room()
+        for i in range(10):
+            send(clients[i % 3], "UpdateInfo", {"Name": str(i)})
+        transport.run_timers(self.fanout.interval)
+        game = rooms.game_by_ws(clients[0]).game
+        self.assertEqual(self.received, [(game.id, game.version)])
+
+    def test_refresh_room(self):
+        use_test_pack(self)
+        use_rooms(self)
+        store = rooms.main_lobby.store = MemoryStore()
+        clients = start_room()
+        backend = rooms.game_by_ws(clients[0])
+        version, data = store.load(backend.game.id)
+        other = Game.from_dict(data)
+        other.players[0].name = "remote"
+        other.touch()
+        store.save(other, version)
+        rooms.on_room_changed(other.id, other.version)
+        names = [opponent["Name"] for ws in clients
+                 for opponent in ws.last("RoomUpdate")[1]["Opponents"]]
+        self.assertIn("remote", names)
+
+    def test_conflict_effects_once(self):
+        use_test_pack(self)
+        use_rooms(self)
+        store = rooms.main_lobby.store = MemoryStore()
+        clients = start_room(2)
+        backend = rooms.game_by_ws(clients[0])
+        ws = FakeConnection()
+        rooms.connect(ws)
+        save = store.save
+        conflicts = []
+
+        def conflicting(game, expected):
+            if not conflicts:
+                # another process changes the game first
+                conflicts.append(game.id)
+                version, data = store.load(game.id)
+                other = Game.from_dict(data)
+                other.touch()
+                save(other, version)
+                raise VersionConflict(game.id)
+            save(game, expected)
+        with mock.patch.object(store, "save", conflicting):
+            send(ws, "JoinRoom", str(backend.game.id))
+        self.assertEqual(conflicts, [backend.game.id])
+        self.assertEqual(backend.clients.count(ws), 1)
+        self.assertEqual([message[0] for message in ws.messages
+                          if message[0] == "Session"], ["Session"])
+        self.assertEqual(store.version(backend.game.id), backend.game.version)
+        self.assertEqual(len(backend.game.players), 3)
+
+
+    def test_evicted_room_deleted(self):
+        use_test_pack(self)
+        use_rooms(self)
+        store = rooms.main_lobby.store = MemoryStore()
+        clients = start_room()
+        backend = rooms.game_by_ws(clients[0])
+        self.assertIsNotNone(store.load(backend.game.id))
+        # evicted with all the players still seated
+        backend.evict()
+        self.assertIsNone(store.load(backend.game.id))
+        self.assertNotIn(backend.game.id, store.game_ids())
+
+    def test_idle_room_deleted(self):
+        use_test_pack(self)
+        transport = use_rooms(self)
+        store = rooms.main_lobby.store = MemoryStore()
+        start_room()
+        self.assertEqual(rooms.memory_stats()["StoredGames"], 1)
+        transport.run_timers(rooms.GameBackend.idle_time + TICK)
+        stats = rooms.memory_stats()
+        self.assertEqual(stats["Rooms"], 0)
+        self.assertEqual(stats["StoredGames"], 0)
+        self.assertEqual(store.game_ids(), [])
+
+    def test_move_deadline_once(self):
+        use_test_pack(self)
+        transport = use_rooms(self)
+        store = rooms.main_lobby.store = MemoryStore()
+        clients = start_room()
+        backend = rooms.game_by_ws(clients[0])
+        # the same room on another worker, which has seen the phase
+        version, data = store.load(backend.game.id)
+        other = rooms.GameBackend(Game.from_dict(data))
+        other.stored_version = version
+        other.update_all()
+        self.assertIn("move", other.scheduler)
+        turn = backend.game.turn
+        transport.run_timers(backend.game.settings["move_time"] + 1)
+        self.assertEqual(backend.game.turn, turn + 1)
+        self.assertEqual(store.load(backend.game.id)[1]["Turn"], turn + 1)
+
+
+class TestTimingWheel(unittest.TestCase):
+    def test_fires_on_time(self):
+        # 4 levels of 8 slots cover 4096 ticks
+        wheel = TimingWheel(bits=3)
+        fired = []
+        timers = dict()
+        rng = Random(1)
+        for i in range(3000):
+            expires = rng.choice([rng.randint(1, 8), rng.randint(1, 500),
+                                  rng.randint(1, 4096),
+                                  rng.randint(1, 2 ** 14)])
+            timers[i] = (expires, wheel.schedule(
+                expires, lambda i=i: fired.append((i, wheel.current))
+            ))
+        cancelled = set(rng.sample(range(3000), 500))
+        for i in cancelled:
+            timers[i][1].cancel()
+        wheel.advance_to(2 ** 14)
+        self.assertEqual(len(fired), 2500)
+        for i, tick in fired:
+            self.assertNotIn(i, cancelled)
+            self.assertEqual(tick, timers[i][0])
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancel_from_callback(self):
+        wheel = TimingWheel()
+        fired = []
+        cancel = wheel.schedule(5, lambda: second.cancel())
+        second = wheel.schedule(5, fired.append, 2)
+        wheel.schedule(5, fired.append, 1)
+        wheel.advance_to(10)
+        self.assertNotIn(2, fired)
+
+    def test_call_later(self):
+        transport = ManualTransport()
+        wheel = TimingWheel(transport)
+        fired = []
+        wheel.call_later(60, fired.append, 1)
+        transport.run_timers(59.9)
+        self.assertEqual(fired, [])
+        transport.run_timers(0.2)
+        self.assertEqual(fired, [1])
+        transport.run_timers(10)
+        self.assertEqual(transport.timers, [])
+
+
+class TestDeck(unittest.TestCase):
+    def setUp(self):
+        self.pack = use_test_pack(self, 50)
+
+    def test_deals_whole_pack(self):
+        deck = Deck(self.pack, Random(1))
+        cards = deck.deal(60)
+        self.assertEqual(len(cards), 50)
+        self.assertEqual(sorted(card.picture for card in cards),
+                         sorted(self.pack.pictures))
+        self.assertEqual(len(deck), 0)
+        self.assertIsNone(deck.draw())
+
+    def test_put_back_dealt_last(self):
+        deck = Deck(self.pack, Random(1))
+        first = deck.deal(10)
+        deck.put_back(first[:3])
+        self.assertEqual(len(deck), 43)
+        cards = deck.deal(43)
+        self.assertEqual(cards[-3:], first[:3])
+
+    def test_lazy_cards(self):
+        count = len(Card.card_ids)
+        game = make_game()
+        play_until_phase(game, Game.GamePhase.STORYTELLING)
+        self.assertEqual(len(Card.card_ids), count + 6 * len(game.players))
+        self.assertEqual(len(game.deck), 50 - 6 * len(game.players))
+
+    def test_cards_conserved(self):
+        game = make_game()
+        play_until_phase(game, Game.GamePhase.STORYTELLING)
+        for _ in range(3):
+            play_until_phase(game, Game.GamePhase.INTERLUDE)
+            play_until_phase(game, Game.GamePhase.STORYTELLING)
+        in_hands = sum(len(hand) for hand in game.hands.values())
+        self.assertEqual(in_hands + len(game.deck), 50)
+
+    def test_round_trip(self):
+        deck = Deck(self.pack, Random(1))
+        deck.put_back(deck.deal(5))
+        cards = {card.id: card for card in deck.returned}
+        copy = Deck.from_dict(json.loads(json.dumps(deck.to_dict())), cards)
+        copy.rng = Random(2)
+        deck.rng = Random(2)
+        self.assertEqual([card.picture for card in copy.deal(50)],
+                         [card.picture for card in deck.deal(50)])
 
 
 class TestCard(unittest.TestCase):
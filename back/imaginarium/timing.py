@@ -0,0 +1,129 @@
+"""Hierarchical timing wheel for room deadlines.
+
+All deadlines of the process live in one wheel driven by a single
+periodic transport timer. Scheduling and cancelling are O(1); a timer
+is moved to a finer level at most once per level.
+"""
+from typing import Callable, Dict, List, Optional
+
+from transport import Transport
+
+
+class WheelTimer(object):
+    __slots__ = ("wheel", "expires", "func", "args", "bucket")
+
+    def __init__(self, wheel: "TimingWheel", expires: int, func: Callable,
+                 args: tuple) -> None:
+        self.wheel = wheel
+        self.expires = expires
+        self.func = func
+        self.args = args
+        # slot the timer is in, None once fired or cancelled
+        self.bucket: Optional[Dict["WheelTimer", None]] = None
+
+    def cancel(self) -> None:
+        if self.bucket is not None:
+            del self.bucket[self]
+            self.bucket = None
+            self.wheel.size -= 1
+
+
+class TimingWheel(object):
+    """levels wheels of 2**bits slots, level i slot spans 2**(bits*i) ticks.
+    With the defaults deadlines up to 2**24 ticks (19 days) are exact,
+    later ones are re-inserted when they come into range."""
+
+    def __init__(self, transport: Optional[Transport] = None,
+                 tick: float = 0.1, bits: int = 6, levels: int = 4) -> None:
+        self.transport = transport
+        self.tick = tick
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.wheels: List[List[Dict[WheelTimer, None]]] = [
+            [dict() for _ in range(1 << bits)] for _ in range(levels)
+        ]
+        self.current = 0
+        self.origin: Optional[float] = None
+        self.running = False
+        # timers scheduled and not fired or cancelled yet
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def call_later(self, delay: float, func: Callable,
+                   *args) -> WheelTimer:
+        """Transport-like call_later backed by the wheel."""
+        if self.origin is None:
+            self.origin = self.transport.time()
+        now = self.now()
+        if not self.running:
+            # the wheel is empty, skip the idle ticks at once
+            self.current = now
+        timer = self.schedule(now + int(delay / self.tick + 0.5), func, *args)
+        if not self.running:
+            self.running = True
+            self.transport.call_later(self.tick, self._on_tick)
+        return timer
+
+    def now(self) -> int:
+        """Current tick by the transport clock."""
+        # the epsilon keeps float sums of ticks from lagging a tick behind
+        return int((self.transport.time() - self.origin) / self.tick + 1e-6)
+
+    def _on_tick(self) -> None:
+        self.advance_to(self.now())
+        if len(self):
+            self.transport.call_later(self.tick, self._on_tick)
+        else:
+            self.running = False
+
+    def schedule(self, expires: int, func: Callable, *args) -> WheelTimer:
+        """Runs func(*args) at the given absolute tick,
+        at the next tick at the earliest."""
+        timer = WheelTimer(self, max(expires, self.current + 1), func, args)
+        self._insert(timer)
+        self.size += 1
+        return timer
+
+    def _insert(self, timer: WheelTimer) -> None:
+        delta = timer.expires - self.current
+        level = 0
+        while level < self.levels - 1 and \
+                delta >= 1 << (self.bits * (level + 1)):
+            level += 1
+        expires = timer.expires
+        if delta >= 1 << (self.bits * self.levels):
+            # out of range, park in the furthest slot and re-insert later
+            expires = self.current + (1 << (self.bits * self.levels)) - 1
+        slot = (expires >> (self.bits * level)) & self.mask
+        timer.bucket = self.wheels[level][slot]
+        timer.bucket[timer] = None
+
+    def advance_to(self, tick: int) -> None:
+        """Fires all timers expiring up to the given tick."""
+        while self.current < tick:
+            self.current += 1
+            self._cascade()
+            bucket = self.wheels[0][self.current & self.mask]
+            self.wheels[0][self.current & self.mask] = dict()
+            for timer in list(bucket):
+                if timer.bucket is not bucket:
+                    continue  # cancelled by an earlier callback
+                timer.bucket = None
+                if timer.expires > self.current:
+                    self._insert(timer)
+                else:
+                    self.size -= 1
+                    timer.func(*timer.args)
+
+    def _cascade(self) -> None:
+        for level in range(1, self.levels):
+            if self.current & ((1 << (self.bits * level)) - 1):
+                return
+            slot = (self.current >> (self.bits * level)) & self.mask
+            bucket = self.wheels[level][slot]
+            self.wheels[level][slot] = dict()
+            for timer in bucket:
+                self._insert(timer)
@@ -0,0 +1,41 @@
+"""Interface between rooms and the server stack running them."""
+from typing import Callable
+
+try:
+    from typing import Protocol
+except ImportError:  # Python < 3.8
+    Protocol = object
+
+
+class Connection(Protocol):
+    """Client connection as seen by rooms."""
+
+    def send(self, data: str) -> None:
+        """Queues data for the client. Raises if the connection is closed."""
+
+
+class Timer(Protocol):
+    def cancel(self) -> None:
+        """Prevents the callback from running if it has not run yet."""
+
+
+class Transport(object):
+    """Event loop primitives used by rooms.
+    Implemented by every server transport."""
+
+    def spawn(self, func: Callable, *args) -> None:
+        """Runs func(*args) soon, outside of the current handler."""
+        raise NotImplementedError
+
+    def call_later(self, delay: float, func: Callable, *args) -> Timer:
+        """Runs func(*args) after delay seconds."""
+        raise NotImplementedError
+
+    def time(self) -> float:
+        """Monotonic clock in seconds."""
+        raise NotImplementedError
+
+    def run_in_thread(self, func: Callable, *args) -> None:
+        """Runs blocking func(*args) in a worker thread, so the event loop
+        goes on meanwhile. func must not touch rooms."""
+        raise NotImplementedError
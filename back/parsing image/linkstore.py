@@ -0,0 +1,137 @@
+"""Ссылки на картинки стены в SQLite вместо links.txt.
+
+Для каждой ссылки хранятся номер в порядке стены (add с front=True
+ставит более свежие ссылки перед старыми), время, когда её
+впервые увидели, статус закачки (NEW, SAVED, DUPLICATE, FAILED), md5
+и размер картинки. Проверка ссылки идёт по индексу первичного ключа,
+новые ссылки добавляются пачкой в одной транзакции, sample выбирает
+случайные ссылки за один проход курсора, не загружая все в память.
+"""
+import os
+import random
+import sqlite3
+from itertools import islice
+from threading import Lock
+from time import time
+
+NEW = 'new'
+SAVED = 'saved'
+DUPLICATE = 'duplicate'
+FAILED = 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS links (
+    link TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'new',
+    hash TEXT,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS links_position ON links (position);
+CREATE INDEX IF NOT EXISTS links_status ON links (status);
+'''
+BATCH = 1000  # ссылок на один INSERT при проверке членства
+
+
+class LinkStore:
+    def __init__(self, path='links.db', text='links.txt'):
+        # соединение общее для потоков save_images, запросы под lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = Lock()
+        with self.db:
+            self.db.executescript(SCHEMA)
+        if len(self) == 0 and text is not None and os.path.exists(text):
+            with open(text, encoding='utf-8') as file:
+                self.add(line.strip() for line in file)
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM links').fetchone()[0]
+
+    def __contains__(self, link):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM links WHERE link = ?',
+                                   (link,)).fetchone() is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def add(self, links, front=False):
+        """Добавляет новые ссылки одной транзакцией, уже известные
+        пропускает. С front=True ссылки (свежие посты, в порядке стены)
+        встают перед уже известными. Возвращает число добавленных."""
+        now = time()
+        links = list(filter(None, links))
+        with self.lock, self.db:
+            if front:
+                start = self.db.execute(
+                    'SELECT COALESCE(MIN(position), 0) FROM links'
+                ).fetchone()[0] - len(links)
+            else:
+                start = self.db.execute(
+                    'SELECT COALESCE(MAX(position), -1) + 1 FROM links'
+                ).fetchone()[0]
+            before = self.db.total_changes
+            self.db.executemany(
+                'INSERT OR IGNORE INTO links (link, position, first_seen) '
+                'VALUES (?, ?, ?)',
+                ((link, start + number, now)
+                 for number, link in enumerate(links)))
+            return self.db.total_changes - before
+
+    def known(self, links):
+        """Какие из ссылок уже есть, пачками по BATCH."""
+        links = iter(links)
+        found = set()
+        with self.lock:
+            while True:
+                batch = list(islice(links, BATCH))
+                if not batch:
+                    return found
+                marks = ', '.join('?' * len(batch))
+                found.update(link for link, in self.db.execute(
+                    f'SELECT link FROM links WHERE link IN ({marks})', batch))
+
+    def get(self, link):
+        """(статус, md5, размер) ссылки или None."""
+        with self.lock:
+            return self.db.execute(
+                'SELECT status, hash, size FROM links WHERE link = ?',
+                (link,)).fetchone()
+
+    def mark(self, link, status, digest=None, size=None):
+        with self.lock, self.db:
+            self.db.execute(
+                'UPDATE links SET status = ?, hash = ?, size = ? '
+                'WHERE link = ?', (status, digest, size, link))
+
+    def links(self, status=None):
+        """Ссылки в порядке стены, курсор читается по ходу."""
+        if status is None:
+            rows = self.db.execute('SELECT link FROM links ORDER BY position')
+        else:
+            rows = self.db.execute(
+                'SELECT link FROM links WHERE status = ? ORDER BY position',
+                (status,))
+        for link, in rows:
+            yield link
+
+    def sample(self, k, status=None, rng=random):
+        """k случайных ссылок за один проход (reservoir sampling,
+        алгоритм R), в памяти только выбранные."""
+        reservoir = []
+        for seen, link in enumerate(self.links(status)):
+            if seen < k:
+                reservoir.append(link)
+            else:
+                index = rng.randrange(seen + 1)
+                if index < k:
+                    reservoir[index] = link
+        return reservoir
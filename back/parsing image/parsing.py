@@ -1,91 +1,239 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 from timeit import default_timer
-import httplib2
 from hashlib import md5
+import os
+import sys
 from re import compile, sub
-from random import shuffle
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit
+from linkstore import LinkStore, NEW, SAVED, DUPLICATE, FAILED
+
+# хэш хранилища картинок берётся из packs.py сервера
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'imaginarium'))
+from packs import content_digest  # noqa: E402
 
 headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.162 Safari/537.36'}
 
+WORKERS = 16  # страниц стены или картинок качается одновременно
+PER_HOST = 8  # одновременных запросов к одному хосту
+RETRIES = 5  # повторы при ошибках соединения и ответах 429 и 5xx
+BACKOFF = 0.5  # пауза перед повтором: BACKOFF * 2 ** (номер повтора - 1)
+TIMEOUT = 30
+CHUNK = 1 << 16
+
+PUBLIC = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'front', 'public')
+# img в PUBLIC - хранилище packs.py, картинки сохраняются в набор
+PACK = os.path.join(PUBLIC, 'vk')
+LINKS_DB = 'links.db'  # ссылки и их закачки, см. linkstore.py
+PARTS = '.parts'  # недокачанные картинки
+
+_host_limits = {}
+_host_limits_lock = Lock()
+
+
+def make_session(pool_size=PER_HOST):
+    """Одна сессия на весь парсинг: keep-alive соединения переиспользуются,
+    неудачные запросы повторяются с экспоненциальной паузой."""
+    session = requests.Session()
+    session.headers.update(headers)
+    retry = Retry(total=RETRIES, backoff_factor=BACKOFF,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
-def cnt_pages(URL):
-    with requests.Session() as session:
-        s = session.get(URL, headers=headers)
-        soup = BeautifulSoup(s.text, 'html.parser')
-        last_page = int(soup.find_all('a', attrs={'class': 'pg_lnk fl_l'})[-1].attrs['href'].split('=')[-1]) // 20
-        return last_page
+def host_limit(url):
+    host = urlsplit(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = BoundedSemaphore(PER_HOST)
+        return _host_limits[host]
 
 
-def get_pictures_on_page(URL):
+def fetch(session, url):
+    with host_limit(url):
+        response = session.get(url, timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.text
+
+
+def cnt_pages(URL, session=None):
+    if session is None:
+        with make_session() as session:
+            return cnt_pages(URL, session)
+    soup = BeautifulSoup(fetch(session, URL), 'html.parser')
+    last_page = int(soup.find_all('a', attrs={'class': 'pg_lnk fl_l'})[-1].attrs['href'].split('=')[-1]) // 20
+    return last_page
+
+
+def get_pictures_on_page(URL, session=None):
+    if session is None:
+        with make_session() as session:
+            return get_pictures_on_page(URL, session)
     fix_link = compile(r'https://sun\d+-\d+.userapi.com')
     imgs = []
-    with requests.Session() as session:
-        s = session.get(URL, headers=headers)
-        soup = BeautifulSoup(s.text, 'html.parser')
-        pictures = soup.find_all('div', attrs={'class': 'page_post_sized_thumbs'})
-        for num, pic in enumerate(pictures):
-            if len(pic.contents) == 1:  # одна картинка в посте
-                try:
-                    temp = pic.contents[0].attrs['onclick'].split('"')[5].replace('\/', '/')
-                    if 'http' not in temp:
-                        continue  # это видео
-                    imgs.append(sub(fix_link, 'https://pp.userapi.com', temp))
-                except Exception as error:
-                    print(f'{error}\n Поломались на {num} картинке, на странице {URL}.')
+    soup = BeautifulSoup(fetch(session, URL), 'html.parser')
+    pictures = soup.find_all('div', attrs={'class': 'page_post_sized_thumbs'})
+    for num, pic in enumerate(pictures):
+        if len(pic.contents) == 1:  # одна картинка в посте
+            try:
+                temp = pic.contents[0].attrs['onclick'].split('"')[5].replace('\/', '/')
+                if 'http' not in temp:
+                    continue  # это видео
+                imgs.append(sub(fix_link, 'https://pp.userapi.com', temp))
+            except Exception as error:
+                print(f'{error}\n Поломались на {num} картинке, на странице {URL}.')
     return imgs
 
 
-def all_parse(URL):
-    pages = cnt_pages(URL)
-    links = []
+def parse_pages(URL, pages, session, workers=WORKERS):
+    """Картинки страниц стены с 0 по pages - 1 по порядку,
+    страницы качаются в workers потоков."""
+    page_urls = [f'{URL}&offset={20 * k}' for k in range(pages)]
+    with ThreadPoolExecutor(workers) as pool:
+        pictures = pool.map(lambda page: get_pictures_on_page(page, session),
+                            page_urls)
+        return [link for page in pictures for link in page]
+
+
+def all_parse(URL, workers=WORKERS):
     start = default_timer()
-    for k in range(pages):
-        pictures = get_pictures_on_page(f'{URL}&offset={20 * k}')
-        links.extend(pictures)
+    with make_session(min(workers, PER_HOST)) as session:
+        pages = cnt_pages(URL, session)
+        links = parse_pages(URL, pages, session, workers)
     print(f'Спарсили за {round(default_timer() - start, 2)}с.')
-    save_links(links)
-    shuffle(links)
-    save_images(links[:500])
+    with LinkStore(LINKS_DB) as store:
+        print(f'Добавили {store.add(links)} новых ссылок')
+        save_images(store.sample(500, status=NEW), store=store)
 
 
 def update_image(URL):
-    pages = cnt_pages(URL)
-    all_links = []
-    with open('links.txt', 'r') as file:
-        for link in file:
-            all_links.append(link.replace('\n', ''))
+    session = make_session()
+    store = LinkStore(LINKS_DB)
+    pages = cnt_pages(URL, session)
     links = []
     for k in range(pages):
-        pictures = get_pictures_on_page(f'{URL}&offset={20 * k}')
+        pictures = get_pictures_on_page(f'{URL}&offset={20 * k}', session)
         for link in pictures:
-            if link in all_links:
+            if link in store:
                 break
             links.append(link)
         else:
             continue
         break
-    with open('links.txt', 'a', encoding='utf-8') as file:
-        print('\n'.join(map(str, links)), file=file)
+    session.close()
+    # новые посты стены свежее всех известных
+    store.add(links, front=True)
     print(f'Сохранили {len(links)} новых картинок')
-    # save_images(links)
+    # save_images(links, store=store)
+    store.close()
+
+
+def library_hashes(root=PUBLIC):
+    """Хэши картинок библиотеки: имена файлов в хранилище root/img
+    (content_digest содержимого, см. packs.py) и имена файлов наборов,
+    скачанные картинки в них названы по md5. Наборы попадают в
+    хранилище при запуске сервера или ingest.py."""
+    hashes = set()
+    if not os.path.isdir(root):
+        return hashes
+    for pack in os.listdir(root):
+        if not os.path.isdir(os.path.join(root, pack)):
+            continue
+        for name in os.listdir(os.path.join(root, pack)):
+            hashes.add(os.path.splitext(name)[0])
+    return hashes
+
+
+def download(session, link, part):
+    """Качает картинку в part, считая по ходу md5 и хэш хранилища. Если
+    part остался от прерванной закачки, докачивает его с места обрыва.
+    Возвращает оба хэша."""
+    digest, stored = md5(), content_digest()
+    size = 0
+    if os.path.exists(part):
+        with open(part, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK), b''):
+                digest.update(chunk)
+                stored.update(chunk)
+                size += len(chunk)
+    request_headers = {'Range': f'bytes={size}-'} if size else {}
+    with host_limit(link):
+        with session.get(link, headers=request_headers, stream=True,
+                         timeout=TIMEOUT) as response:
+            if response.status_code == 416:  # part уже скачан целиком
+                return digest.hexdigest(), stored.hexdigest()
+            response.raise_for_status()
+            if response.status_code != 206:  # сервер отдал всё заново
+                digest, stored = md5(), content_digest()
+                size = 0
+            with open(part, 'ab' if size else 'wb') as file:
+                for chunk in response.iter_content(CHUNK):
+                    file.write(chunk)
+                    digest.update(chunk)
+                    stored.update(chunk)
+    return digest.hexdigest(), stored.hexdigest()
 
 
-def save_images(links):
+def save_images(links, directory=PACK, workers=WORKERS, root=PUBLIC,
+                store=None, parts=PARTS):
+    """Качает картинки в directory под именами md5 в workers потоков.
+    Картинки, уже скачанные по store (LinkStore), и картинки, которые
+    уже есть в библиотеке root (см. library_hashes), не сохраняются. Прерванный запуск
+    продолжается повторным вызовом."""
+    if store is None:
+        with LinkStore(LINKS_DB) as store:
+            return save_images(links, directory, workers, root, store, parts)
     start = default_timer()
-    h = httplib2.Http('.cache')
-    for img in links:
-        response, content = h.request(img)
-        out = open(f'..\\..\\front\\public\\img\\{md5(content).hexdigest()}.jpg', 'wb')
-        out.write(content)
-        out.close()
-    print(f'Сохранили все изображения за {round(default_timer() - start, 2)}с.')
-
-
-def save_links(links):
-    with open('links.txt', 'w', encoding='utf-8') as file:
-        print('\n'.join(map(str, links)), file=file)
-    print('Сохранили список изображений')
+    os.makedirs(directory, exist_ok=True)
+    os.makedirs(parts, exist_ok=True)
+    known = library_hashes(root) | {os.path.splitext(name)[0]
+                                    for name in os.listdir(directory)}
+    store.add(links)
+    todo = [link for link in dict.fromkeys(links)
+            if store.get(link)[0] not in (SAVED, DUPLICATE)]
+    lock = Lock()
+    saved = failed = 0
+
+    def save(session, link):
+        nonlocal saved, failed
+        part = os.path.join(parts, md5(link.encode()).hexdigest() + '.part')
+        try:
+            digest, stored = download(session, link, part)
+        except (requests.RequestException, OSError) as error:
+            print(f'{error}\n Не скачали {link}, докачаем при следующем запуске.')
+            store.mark(link, FAILED)
+            with lock:
+                failed += 1
+            return
+        size = os.path.getsize(part)
+        with lock:
+            if digest in known or stored in known:
+                os.remove(part)
+                status = DUPLICATE
+            else:
+                os.replace(part, os.path.join(directory, f'{digest}.jpg'))
+                known.update((digest, stored))
+                saved += 1
+                status = SAVED
+        store.mark(link, status, digest, size)
+
+    with make_session(min(workers, PER_HOST)) as session:
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(lambda link: save(session, link), todo))
+    print(f'Сохранили {saved} изображений, {len(todo) - saved - failed} повторов '
+          f'и {failed} ошибок за {round(default_timer() - start, 2)}с.')
+    return saved, failed
 
 
 if __name__ == '__main__':
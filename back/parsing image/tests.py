@@ -0,0 +1,275 @@
+import unittest
+from unittest import mock
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep
+import os
+import tempfile
+from random import Random
+from collections import Counter
+import parsing
+import linkstore
+from linkstore import LinkStore
+
+PAGES = 10
+POSTS = 20
+
+
+def wall_page(offset: int) -> str:
+    """Стена в разметке vk.com: ссылки на страницы и посты по картинке."""
+    posts = []
+    for post in range(offset, offset + POSTS):
+        onclick = ('return showPhoto("-1_2", "wall-1_3", '
+                   f'"https:\\/\\/sun9-{post}.userapi.com\\/c\\/{post}.jpg", '
+                   '{})')
+        posts.append('<div class="page_post_sized_thumbs">'
+                     f"<a onclick='{onclick}'></a></div>")
+    pages = ''.join(f'<a class="pg_lnk fl_l" href="/wall?own=1&offset={20 * k}">'
+                    f'{k}</a>' for k in range(PAGES + 1))
+    return f'<html><body>{pages}{"".join(posts)}</body></html>'
+
+
+class WallServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), WallHandler)
+        self.lock = Lock()
+        self.active = 0
+        self.max_active = 0
+        self.connections = set()
+        self.requests = []
+        # пути, на которые один раз отвечаем 503
+        self.failing = set()
+        # путь -> картинка
+        self.images = {}
+        # пути, где один раз рвём соединение на середине картинки
+        self.cut = set()
+        self.ranges = []
+
+
+class WallHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_image(self):
+        server = self.server
+        data = server.images[self.path]
+        with server.lock:
+            cut = self.path in server.cut
+            server.cut.discard(self.path)
+        start = 0
+        if 'Range' in self.headers:
+            server.ranges.append(self.headers['Range'])
+            start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        if cut:
+            self.wfile.write(data[start:len(data) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(data[start:])
+
+    def do_GET(self):
+        server = self.server
+        if self.path.startswith('/img/'):
+            with server.lock:
+                server.requests.append(self.path)
+            return self.send_image()
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.connections.add(self.client_address)
+            server.requests.append(self.path)
+            failing = self.path in server.failing
+            server.failing.discard(self.path)
+        sleep(0.01)
+        offset = int(self.path.split('offset=')[1]) if 'offset=' in self.path else 0
+        body = b'' if failing else wall_page(offset).encode()
+        with server.lock:
+            server.active -= 1
+        self.send_response(503 if failing else 200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestParsing(unittest.TestCase):
+    def setUp(self):
+        self.server = WallServer()
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/wall?own=1'
+        patcher = mock.patch.multiple(parsing, BACKOFF=0, PER_HOST=3,
+                                      _host_limits={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pages_in_order(self):
+        with parsing.make_session(3) as session:
+            pages = parsing.cnt_pages(self.url, session)
+            links = parsing.parse_pages(self.url, pages, session, workers=6)
+        self.assertEqual(pages, PAGES)
+        self.assertEqual(links, [f'https://pp.userapi.com/c/{post}.jpg'
+                                 for post in range(PAGES * POSTS)])
+
+    def test_limits_and_reuse(self):
+        with parsing.make_session(3) as session:
+            parsing.parse_pages(self.url, PAGES, session, workers=6)
+        self.assertLessEqual(self.server.max_active, 3)
+        # соединения переиспользуются, а не открываются на каждую страницу
+        self.assertLessEqual(len(self.server.connections), 3)
+        self.assertEqual(len(self.server.requests), PAGES)
+
+    def test_retry(self):
+        failing = '/wall?own=1&offset=60'
+        self.server.failing.add(failing)
+        with parsing.make_session(3) as session:
+            links = parsing.parse_pages(self.url, PAGES, session, workers=6)
+        self.assertEqual(len(links), PAGES * POSTS)
+        self.assertEqual(self.server.requests.count(failing), 2)
+
+
+class TestSaveImages(unittest.TestCase):
+    def setUp(self):
+        self.server = WallServer()
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = os.path.join(directory.name, 'public')
+        self.pack = os.path.join(self.root, 'vk')
+        os.makedirs(os.path.join(self.root, 'old'))
+        self.store = LinkStore(os.path.join(directory.name, 'links.db'),
+                               text=None)
+        self.addCleanup(self.store.close)
+        self.arguments = dict(directory=self.pack, workers=4, root=self.root,
+                              store=self.store,
+                              parts=os.path.join(directory.name, 'parts'))
+        patcher = mock.patch.multiple(parsing, BACKOFF=0, _host_limits={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pictures = [bytes([n]) * 200000 for n in range(4)]
+        for n in range(4):
+            self.server.images[f'/img/{n}.jpg'] = self.pictures[n]
+        # та же картинка по другой ссылке и картинка из другого набора
+        self.server.images['/img/copy.jpg'] = self.pictures[0]
+        self.server.images['/img/old.jpg'] = b'old'
+        with open(os.path.join(self.root, 'old',
+                               md5(b'old').hexdigest() + '.jpg'), 'wb'):
+            pass
+        base = f'http://127.0.0.1:{self.server.server_port}'
+        self.links = [base + path for path in self.server.images]
+
+    def test_dedupe(self):
+        self.assertEqual(parsing.save_images(self.links, **self.arguments),
+                         (4, 0))
+        self.assertEqual(sorted(os.listdir(self.pack)),
+                         sorted(md5(picture).hexdigest() + '.jpg'
+                                for picture in self.pictures))
+        for picture in self.pictures:
+            name = os.path.join(self.pack, md5(picture).hexdigest() + '.jpg')
+            with open(name, 'rb') as file:
+                self.assertEqual(file.read(), picture)
+        self.assertEqual(self.store.get(self.links[0]),
+                         (linkstore.SAVED, md5(self.pictures[0]).hexdigest(),
+                          200000))
+        self.assertEqual(self.store.get(self.links[4])[0], linkstore.DUPLICATE)
+        requests = len(self.server.requests)
+        self.assertEqual(parsing.save_images(self.links, **self.arguments),
+                         (0, 0))
+        self.assertEqual(len(self.server.requests), requests)
+
+    def test_store_dedupe(self):
+        # картинка, уже лежащая в хранилище под именем из packs.py
+        os.makedirs(os.path.join(self.root, 'img'))
+        stored = parsing.content_digest()
+        stored.update(self.pictures[1])
+        with open(os.path.join(self.root, 'img',
+                               stored.hexdigest() + '.jpg'), 'wb'):
+            pass
+        self.assertEqual(parsing.save_images(self.links, **self.arguments),
+                         (3, 0))
+        self.assertEqual(self.store.get(self.links[1])[0], linkstore.DUPLICATE)
+        self.assertNotIn(md5(self.pictures[1]).hexdigest() + '.jpg',
+                         os.listdir(self.pack))
+
+    def test_resume(self):
+        self.server.cut.add('/img/2.jpg')
+        self.assertEqual(parsing.save_images(self.links, **self.arguments),
+                         (3, 1))
+        self.assertEqual(self.store.get(self.links[2])[0], linkstore.FAILED)
+        self.assertEqual(parsing.save_images(self.links, **self.arguments),
+                         (1, 0))
+        # докачка с конца последнего записанного куска
+        self.assertEqual(len(self.server.ranges), 1)
+        self.assertNotEqual(self.server.ranges[0], 'bytes=0-')
+        name = md5(self.pictures[2]).hexdigest() + '.jpg'
+        with open(os.path.join(self.pack, name), 'rb') as file:
+            self.assertEqual(file.read(), self.pictures[2])
+        self.assertEqual(os.listdir(self.arguments['parts']), [])
+
+
+class TestLinkStore(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'links.db')
+        self.text = os.path.join(directory.name, 'links.txt')
+        with open(self.text, 'w', encoding='utf-8') as file:
+            print('\n'.join(f'link{n}' for n in range(100)), file=file)
+
+    def test_links(self):
+        with LinkStore(self.path, self.text) as store:
+            self.assertEqual(len(store), 100)
+            self.assertIn('link5', store)
+            self.assertNotIn('link100', store)
+            self.assertEqual(store.add(['link5', 'link100', 'link100']), 1)
+            self.assertEqual(store.known(f'link{n}' for n in range(95, 2000)),
+                             {f'link{n}' for n in range(95, 101)})
+            store.mark('link7', linkstore.SAVED, 'abc', 10)
+            self.assertEqual(store.get('link7'), (linkstore.SAVED, 'abc', 10))
+            self.assertEqual(store.get('link8'), (linkstore.NEW, None, None))
+        # links.txt читается только в пустую базу
+        with LinkStore(self.path, self.text) as store:
+            self.assertEqual(list(store.links()),
+                             [f'link{n}' for n in range(101)])
+            self.assertEqual(list(store.links(linkstore.SAVED)), ['link7'])
+
+    def test_add_front(self):
+        with LinkStore(self.path, self.text) as store:
+            # свежие посты стены встают перед известными, в порядке стены
+            self.assertEqual(store.add(['new0', 'new1', 'link0'],
+                                       front=True), 2)
+            self.assertEqual(list(store.links())[:4],
+                             ['new0', 'new1', 'link0', 'link1'])
+            self.assertEqual(store.add(['newer'], front=True), 1)
+            self.assertEqual(list(store.links())[:2], ['newer', 'new0'])
+
+    def test_sample(self):
+        with LinkStore(self.path, self.text) as store:
+            self.assertEqual(sorted(store.sample(200)), sorted(store.links()))
+            rng = Random(0)
+            counts = Counter()
+            for _ in range(2000):
+                sample = store.sample(10, rng=rng)
+                self.assertEqual(len(set(sample)), 10)
+                counts.update(sample)
+        # каждая ссылка выбирается с вероятностью 10 / 100
+        self.assertEqual(len(counts), 100)
+        self.assertTrue(all(120 < count < 290 for count in counts.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
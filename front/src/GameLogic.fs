@@ -50,7 +50,8 @@ type RoomState with
         { Info = i
           Chosen = this.SelectedCard |> Option.contains i.ID
           Correct = this.CorrectCard |> Option.contains i.ID
-          Selectable = this.HandSelectable }
+          Selectable = this.HandSelectable
+          Small = true }
 
     member this.CardArgs_Table(i: CardInfo) =
         { Info = i
@@ -58,7 +59,8 @@ type RoomState with
           Correct = this.CorrectCard |> Option.contains i.ID
           Selectable =
               this.TableSelectable
-              && not (this.DealtCard |> Option.contains i.ID) }
+              && not (this.DealtCard |> Option.contains i.ID)
+          Small = false }
 
     member this.TurnBtnClickable = this.EndTurnReady && this.IsListener
 
@@ -16,10 +16,16 @@ type CardID = string
 
 type GameID = string
 
+/// Files of a card picture variant made by ingest.py
+type Variant = { webp: string; jpeg: string }
+
 type CardInfo =
     { ID: CardID
       Owner: Player option
-      Voters: Player list }
+      Voters: Player list
+      Picture: string
+      Thumb: Variant option
+      Full: Variant option }
 
 type Hand =
     { Cards: CardInfo list
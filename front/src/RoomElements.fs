@@ -10,7 +10,9 @@ type CardArgs =
     { Info: CardInfo
       Chosen: bool
       Correct: bool
-      Selectable: bool }
+      Selectable: bool
+      // hand cards use the thumbnail, table cards the full variant
+      Small: bool }
 
 let private blob (p: Player) =
     Html.figure [ prop.className "image"
@@ -30,8 +32,14 @@ let private voters (p: Player list) =
     Html.div [ prop.className "voters d-flex px-1 py-1 flex-wrap"
                prop.children (p |> List.map blob) ]
 
-let private cardContent (id: CardID) =
-    Bulma.cardContent [ Html.img [ prop.src ^ imgSrc id ] ]
+let private cardContent (a: CardArgs) =
+    let variant = if a.Small then a.Info.Thumb else a.Info.Full
+    match variant with
+    | Some v ->
+        Bulma.cardContent [ Html.picture [ Html.source [ prop.type' "image/webp"
+                                                         prop.srcset ^ imgSrc v.webp ]
+                                           Html.img [ prop.src ^ imgSrc v.jpeg ] ] ]
+    | None -> Bulma.cardContent [ Html.img [ prop.src ^ imgSrc a.Info.Picture ] ]
 
 let private selectCardMsg id =
     globalDispatch
@@ -43,7 +51,7 @@ let card (a: CardArgs) =
                                 if a.Chosen then "chosen"
                                 if a.Correct then "correct" ]
                  spacing.mx3
-                 prop.children [ cardContent a.Info.ID
+                 prop.children [ cardContent a
                                  if a.Info.Owner.IsSome then
                                      owner a.Info.Owner.Value
                                      voters a.Info.Voters ]
@@ -21,6 +21,6 @@ let inline resultCollapse errorVal =
 
 let inline konst x _ = x
 
-let imgSrc (id: Model.CardID) = "/img/" + id
+let imgSrc (picture: string) = "/img/" + picture
 
 let aviSrc (avi: string) = "/avi/" + avi